@@ -1,27 +1,38 @@
 #!/usr/bin/env python
 
 from ocp_cd_tools import Runtime, Dir
-from ocp_cd_tools.image import pull_image, create_image_verify_repo_file, Image
+from ocp_cd_tools.image import create_image_verify_repo_file, Image
+from ocp_cd_tools.pullmanager import PullManager
+from ocp_cd_tools.verifycache import VerifyCache
+from ocp_cd_tools.rpmdb import parse_archive_ref
 from ocp_cd_tools.model import Missing
 from ocp_cd_tools.brew import get_watch_task_info_copy
 from ocp_cd_tools import constants
 from ocp_cd_tools import metadata
 from ocp_cd_tools.config import MetaDataConfig as mdc
 from ocp_cd_tools.config import valid_updates
+from ocp_cd_tools.lazyimport import LazyModule
+from ocp_cd_tools import service
+from ocp_cd_tools import workqueue
 import datetime
 import click
+import json
 import os
 import shutil
-import yaml
 import sys
 import subprocess
+import threading
+import time
 import urllib
 import traceback
-import koji
 from numbers import Number
 from multiprocessing.dummy import Pool as ThreadPool
 from multiprocessing import cpu_count
-from dockerfile_parse import DockerfileParser
+
+# Only loaded by the commands which use them, so others (and --help) start quickly
+dockerfile_parse = LazyModule("dockerfile_parse")
+koji = LazyModule("koji")
+yaml = LazyModule("yaml")
 
 pass_runtime = click.make_pass_decorator(Runtime)
 context_settings = dict(help_option_names=['-h', '--help'])
@@ -67,6 +78,22 @@ context_settings = dict(help_option_names=['-h', '--help'])
               help='Process Dockerfiles in ODCS mode. HACK for the time being.')
 @click.option('--disabled', default=False, is_flag=True,
               help='Treat disabled images/rpms as if they were enabled')
+@click.option("--trace-file", metavar="PATH", default=None,
+              help="Write a Chrome trace-event JSON timeline of the run (viewable in Perfetto) to this file.")
+@click.option("--cache-dir", metavar="PATH", envvar="OIT_CACHE_DIR", default=None,
+              help="Directory for data reused across runs (e.g. the RPM index). Defaults to <working-dir>/cache.\n Env var: OIT_CACHE_DIR")
+@click.option("--partial-sources", default=False, is_flag=True,
+              help="Clone group sources as blobless, single-branch clones backed by a persistent mirror in the cache dir.")
+@click.option("--sparse-sources", default=False, is_flag=True,
+              help="Only check out the content.source.path directories used by the images of each group source. Implies --partial-sources.")
+@click.option("--source-jobs", metavar="N", default=4, type=click.IntRange(1),
+              help="Number of group sources to clone concurrently while initializing (4 by default).")
+@click.option("--fast-clone", default=False, is_flag=True,
+              help="Clone only the distgit branch being worked on with git, falling back to rhpkg if that fails.")
+@click.option("--clone-depth", metavar="N", default=None, type=click.IntRange(0),
+              help="History depth of --fast-clone distgit clones (1 by default; 0 for the whole branch).")
+@click.option("--refresh-content-sets", default=False, is_flag=True,
+              help="Validate every content set with Pulp, ignoring results cached in --cache-dir.")
 @click.pass_context
 def cli(ctx, **kwargs):
     # @pass_runtime
@@ -77,6 +104,12 @@ option_commit_message = click.option("--message", "-m", metavar='MSG', help="Com
                                      required=True)
 option_push = click.option('--push/--no-push', default=False, is_flag=True,
                            help='Pushes to distgit after local changes (--no-push by default).')
+option_jobs = click.option("--jobs", "-j", metavar="N", default=1, type=click.IntRange(1),
+                           help="Number of images to process concurrently (1 by default).")
+option_resume = click.option("--resume", default=False, is_flag=True,
+                             help="Skip the work a previous run in the same --working-dir completed.")
+option_pull_jobs = click.option("--pull-jobs", metavar="N", default=4, type=click.IntRange(1),
+                                help="Number of images to pull concurrently (4 by default).")
 
 # =============================================================================
 #
@@ -172,6 +205,100 @@ def images_push_distgit(runtime):
     runtime.push_distgits()
 
 
+def call_prefixed(prefix, cmd_str, **kwargs):
+    """
+    Runs a shell command like subprocess.call, but echoes each line of its
+    output (stdout and stderr combined) with the given prefix so that the
+    output of commands running concurrently can be told apart.
+    :return: The exit status of the command
+    """
+    proc = subprocess.Popen(cmd_str, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs)
+    for line in iter(proc.stdout.readline, ''):
+        with Runtime.log_lock:
+            click.echo("[{}] {}".format(prefix, line.rstrip("\n")))
+    return proc.wait()
+
+
+def update_distgits(runtime, update_f, jobs, push, operation):
+    """
+    Runs update_f(image) for each image in the group, with up to `jobs` images
+    in flight at once. update_f is expected to modify and commit the image's
+    distgit; if push is True, each distgit is pushed as soon as update_f returns
+    (unless resuming a run which already pushed that commit).
+    Progress is reported as each image finishes and failures are summarized at
+    the end rather than aborting the remaining images.
+    """
+    def process(image):
+        update_f(image)
+        if push:
+            dgr = image.distgit_repo()
+            inputs = {"sha": dgr.head_sha()}
+            if runtime.checkpoints.completed(image.distgit_key, "pushed", inputs) is None:
+                dgr.push()
+                runtime.checkpoints.record(image.distgit_key, "pushed", inputs)
+
+    metas = runtime.image_metas()
+    failed = []
+    for i, (image, _, error) in enumerate(runtime.parallel_imap(process, metas, n_threads=jobs), 1):
+        if error is None:
+            runtime.logger.info("[{}/{}] {} complete: {}".format(i, len(metas), operation, image.distgit_key))
+        else:
+            failed.append(image.distgit_key)
+            runtime.logger.error("[{}/{}] {} failed: {}\n{}".format(
+                i, len(metas), operation, image.distgit_key, error))
+
+    if failed:
+        runtime.logger.error("\n".join(["{} failures:".format(operation)] + sorted(failed)))
+        exit(1)
+
+
+def latest_pull_urls(runtime, jobs):
+    """
+    Finds the pull spec of the latest build of each image in the group. Each
+    lookup is a brew query, so up to `jobs` are made at once.
+    :return: A dict of distgit_key -> pull url
+    """
+    urls = {}
+    failed = []
+    for image, url, error in runtime.parallel_imap(lambda m: m.pull_url(), runtime.image_metas(), n_threads=jobs):
+        if error is None:
+            urls[image.distgit_key] = url
+        else:
+            failed.append(image.distgit_key)
+            runtime.logger.error("Unable to find latest build of {}: {}".format(image.distgit_key, error))
+    if failed:
+        raise IOError("Unable to find latest builds of: {}".format(", ".join(sorted(failed))))
+    return urls
+
+
+def pull_images(runtime, urls, jobs, on_pulled=None):
+    """
+    Pulls each distinct url once, with up to `jobs` pulls at once. Group members
+    are pulled after the members they are built from, so shared layers land first.
+    :param urls: A dict of distgit_key (or any name, for images outside the group) -> pull url
+    :param on_pulled: If given, f(url, success) is called as soon as each url has been pulled (or failed)
+    :return: The sorted list of urls which could not be pulled
+    """
+    manager = PullManager(n_threads=jobs)
+    for key, url in urls.iteritems():
+        image = runtime.image_map.get(key)
+        parents = [urls[m] for m in image.parent_members() if m in urls] if image else []
+        manager.add(url, parents)
+
+    def pulled(result):
+        on_pulled(result.url, result.success)
+
+    failed = []
+    for result in manager.pull_all(on_pulled=pulled if on_pulled else None):
+        runtime.add_record("image_pull", url=result.url, seconds="{:.1f}".format(result.seconds),
+                           status=0 if result.success else -1)
+        if not result.success:
+            failed.append(result.url)
+    if failed:
+        runtime.logger.error("\n".join(["Pull failures:"] + sorted(failed)))
+    return sorted(failed)
+
+
 @cli.command("images:update-dockerfile", short_help="Update a group's distgit Dockerfile from metadata.")
 @click.option("--stream", metavar="ALIAS REPO/NAME:TAG", nargs=2, multiple=True,
               help="Associate an image name with a given stream alias.  [multiple]")
@@ -184,8 +311,9 @@ def images_push_distgit(runtime):
               help="Repo group type to use for version autodetection scan (e.g. signed, unsigned).")
 @option_commit_message
 @option_push
+@option_jobs
 @pass_runtime
-def images_update_dockerfile(runtime, stream, version, release, repo_type, message, push):
+def images_update_dockerfile(runtime, stream, version, release, repo_type, message, push, jobs):
     """
     Updates the Dockerfile in each distgit repository with the latest metadata and
     the version/release information specified. This does not update the Dockerfile
@@ -199,7 +327,8 @@ def images_update_dockerfile(runtime, stream, version, release, repo_type, messa
     - If '+', the current release will be bumped.
     - Else, the literal value will be set in the Dockerfile.
     """
-    runtime.initialize(validate_content_sets=True)
+    # Sources are only read for their container.yaml in ODCS mode
+    runtime.initialize(validate_content_sets=True, resolve_image_sources=runtime.odcs_mode)
 
     # If not pushing, do not clean up our work
     runtime.remove_tmp_working_dir = push
@@ -219,14 +348,14 @@ def images_update_dockerfile(runtime, stream, version, release, repo_type, messa
         )
 
     runtime.clone_distgits()
-    for image in runtime.image_metas():
+
+    def update(image):
         dgr = image.distgit_repo()
         (real_version, real_release) = dgr.update_distgit_dir(version, release)
         dgr.commit(message)
         dgr.tag(real_version, real_release)
 
-    if push:
-        runtime.push_distgits()
+    update_distgits(runtime, update, jobs, push, "Update")
 
 
 @cli.command("images:verify", short_help="Run some smoke tests to verify produced images")
@@ -243,8 +372,15 @@ def images_update_dockerfile(runtime, stream, version, release, repo_type, messa
               help="Verify that all installed packages are signed with a valid key")
 @click.option('--check-versions', default=None, is_flag=True,
               help="Verify that installed package versions match the target release")
+@click.option('--force', default=False, is_flag=True,
+              help="Verify every image, even those unchanged since they were last verified with the same checks")
+@click.option('--offline', default=False, is_flag=True,
+              help="Read each image's RPM database from its layers instead of starting containers (no docker daemon needed; --check-orphans is unavailable)")
+@click.option('--verify-jobs', metavar="N", default=cpu_count(), type=click.IntRange(1),
+              help="Number of images to verify concurrently (the number of CPUs by default).")
+@option_pull_jobs
 @pass_runtime
-def images_verify(runtime, image, no_pull, repo_type, **kwargs):
+def images_verify(runtime, image, no_pull, repo_type, force, offline, verify_jobs, pull_jobs, **kwargs):
     """Catches mistakes in images (see the --check-FOO options) before we
     ship them on to QE for further verification. This command roughly
     approximates the image check job ran on the QE Jenkins.
@@ -253,7 +389,11 @@ def images_verify(runtime, image, no_pull, repo_type, **kwargs):
     test reports. Some useful artifacts are produced in the
     `working-dir`: debug.log: The full verbose log of all
     operations. verify_fail_log.yml: Failed images check
-    details. verify_full_log.yml: Full image check details.
+    details. verify/: One YAML file of check details per image,
+    written as soon as that image has been verified.
+
+    Each image is verified as soon as it has been pulled, while the
+    remaining images are still being pulled.
 
     EXAMPLES
 
@@ -270,6 +410,14 @@ def images_verify(runtime, image, no_pull, repo_type, **kwargs):
       \b
       $ oit.py --group openshift-3.4 images:verify --image reg.rh.com:8888/openshift3/ose:v3.4.1.44.38-12
 
+    * The rpm based checks on a saved image, without a docker daemon:
+
+      \b
+      $ oit.py --group openshift-3.11 images:verify --image docker-archive:/tmp/ose.tar
+
+    The version expected of a saved image is taken from the name:tag recorded in the
+    archive, or from a reference like docker-archive:/tmp/ose.tar:ose:v3.11.0-2.
+
     Exit code is the number of images that failed the image check
 
     """
@@ -283,30 +431,75 @@ def images_verify(runtime, image, no_pull, repo_type, **kwargs):
     else:
         enabled_checks = list(k for k, v in kwargs.items() if v)
 
+    # Offline verification only has the image's RPM database, no yum to find orphans with.
+    # Saved images are always verified offline.
+    if (offline or any(parse_archive_ref(img) for img in image)) and 'check_orphans' in enabled_checks:
+        if kwargs['check_orphans']:
+            raise click.BadParameter("--check-orphans cannot be run with --offline or on docker-archive: images")
+        runtime.logger.warning("[Verify] Skipping check_orphans, which cannot be run offline")
+        enabled_checks.remove('check_orphans')
+
     repo_file = create_image_verify_repo_file(runtime, repo_type=repo_type)
 
+    # Results of images verified before are reused, unless forced
+    cache = VerifyCache(os.path.join(runtime.cache_dir, "verify-cache.json"), repo_file, refresh=force)
+
     # Doing this manually, or automatic on a group?
     if len(image) == 0:
-        images = [Image(runtime, x.pull_url(), repo_file, enabled_checks, distgit=x.name) for x in runtime.image_metas()]
+        urls = latest_pull_urls(runtime, pull_jobs)
+        images = [Image(runtime, urls[x.distgit_key], repo_file, enabled_checks, distgit=x.name, cache=cache,
+                        offline=offline)
+                  for x in runtime.image_metas()]
     else:
-        images = [Image(runtime, img, repo_file, enabled_checks) for img in image]
-
-    # Don't pre-pull images, useful during development iteration. If
-    # --no-pull isn't given, then we will pre-pull all images.
-    if not no_pull:
-        for image in images:
-            pull_image(image.pull_url)
+        # Saved images are read from their archive, never pulled
+        urls = dict((img, img) for img in image if not parse_archive_ref(img))
+        images = [Image(runtime, img, repo_file, enabled_checks, cache=cache, offline=offline) for img in image]
+
+    results_dir = os.path.join(runtime.working_dir, 'verify')
+    if not os.path.isdir(results_dir):
+        os.makedirs(results_dir)
+
+    def verify(img):
+        result = img.verify_image()
+        # Record each result as it comes in, so an interrupted run still leaves them
+        name = (img.distgit or img.name_tag).replace('/', '_').replace(':', '_')
+        result_file = os.path.join(results_dir, '{}.yml'.format(name))
+        with open(result_file + '.tmp', 'w') as fp:
+            yaml.safe_dump(result, fp, indent=4, default_flow_style=False)
+        os.rename(result_file + '.tmp', result_file)
+        cache.save()
+        return result
 
     count_images = len(images)
     runtime.logger.info("[Verify] Running verification checks on {count} images: {chks}".format(count=count_images, chks=", ".join(enabled_checks)))
 
-    pool = ThreadPool(cpu_count())
-    results = pool.map(
-        lambda img: img.verify_image(),
-        images)
+    pool = ThreadPool(verify_jobs)
+    # Image -> its verification, started in the order images are pulled
+    pending = {}
+
+    def start_verify(url, success=True):
+        # A failed pre-pull is retried by docker when the container starts
+        for img in images:
+            if img.pull_url == url:
+                pending[img] = pool.apply_async(verify, (img,))
+
+    # Don't pre-pull images, useful during development iteration. If
+    # --no-pull isn't given, then we will pre-pull all images and
+    # verify each one as soon as it lands. Offline verification
+    # fetches only the layers it reads, without a daemon.
+    if no_pull or offline:
+        urls = {}
+    pulling = set(urls.values())
+    for url in set(img.pull_url for img in images) - pulling:
+        start_verify(url)
+    if pulling:
+        pull_images(runtime, urls, pull_jobs, on_pulled=start_verify)
+
     # Wait for results
     pool.close()
     pool.join()
+    # Report in the order images were given, however their pulls finished
+    results = [pending[img].get() for img in images]
 
     ######################################################################
     # Done! Let's begin accounting and recording
@@ -344,8 +537,10 @@ def images_verify(runtime, image, no_pull, repo_type, **kwargs):
               help="Repo group type to use for version autodetection scan (e.g. signed, unsigned).")
 @option_commit_message
 @option_push
+@option_jobs
+@option_resume
 @pass_runtime
-def images_rebase(runtime, stream, version, release, repo_type, message, push):
+def images_rebase(runtime, stream, version, release, repo_type, message, push, jobs, resume):
     """
     Many of the Dockerfiles stored in distgit are based off of content managed in GitHub.
     For example, openshift-enterprise-node should always closely reflect the changes
@@ -357,11 +552,17 @@ def images_rebase(runtime, stream, version, release, repo_type, message, push):
     This operation will also set the version and release in the file according to the
     command line arguments provided.
 
+    With --jobs, several images are rebased, committed, tagged and (with --push)
+    pushed at once. A distgit_commit record is written as each image completes.
+
     If a distgit repo does not have associated source (i.e. it is managed directly in
     distgit), the Dockerfile in distgit will not be rebased, but other aspects of the
     metadata may be applied (base image, tags, etc) along with the version and release.
+
+    With --resume, images a previous run in the same --working-dir rebased,
+    committed or pushed from the same inputs are not processed again.
     """
-    runtime.initialize(validate_content_sets=True)
+    runtime.initialize(validate_content_sets=True, resolve_image_sources=True, resume=resume)
 
     # If not pushing, do not clean up our work
     runtime.remove_tmp_working_dir = push
@@ -381,33 +582,38 @@ def images_rebase(runtime, stream, version, release, repo_type, message, push):
         )
 
     runtime.clone_distgits()
-    for image in runtime.image_metas():
+
+    def rebase(image):
         dgr = image.distgit_repo()
-        (real_version, real_release) = dgr.rebase_dir(version, release)
-        sha = dgr.commit(message, log_diff=True)
-        dgr.tag(real_version, real_release)
+        sha = dgr.rebase_and_commit(version, release, message)
+        if sha is None:
+            return
         runtime.add_record(
             "distgit_commit",
             distgit=dgr.metadata.qualified_name,
             image=dgr.config.name,
             sha=sha)
 
-    if push:
-        runtime.push_distgits()
+    update_distgits(runtime, rebase, jobs, push, "Rebase")
 
 
 @cli.command("images:foreach", short_help="Run a command relative to each distgit dir.")
 @click.argument("cmd", nargs=-1)
 @click.option("--message", "-m", metavar='MSG', help="Commit message for dist-git.", required=False)
 @option_push
+@option_jobs
 @pass_runtime
-def images_foreach(runtime, cmd, message, push):
+def images_foreach(runtime, cmd, message, push, jobs):
     """
     Clones all distgit repos found in the specified group and runs an arbitrary
     command once for each local distgit directory. If the command runs without
-    error for all directories, a commit will be made. If not a dry_run,
+    error for a directory, a commit will be made. If --push is specified,
     the repo will be pushed.
 
+    With --jobs, the command runs in several directories at once. Each line of
+    output is prefixed with the distgit_key of the image that produced it, and
+    images whose command exited non-zero are listed at the end.
+
     \b
     The following environment variables will be available in each invocation:
     oit_repo_name : The name of the distgit repository
@@ -427,42 +633,41 @@ def images_foreach(runtime, cmd, message, push):
 
     cmd_str = " ".join(cmd)
 
-    for image in runtime.image_metas():
+    def run(image):
         dgr = image.distgit_repo()
-        with Dir(dgr.distgit_dir):
-            runtime.logger.info("Executing in %s: [%s]" % (dgr.distgit_dir, cmd_str))
-
-            dfp = DockerfileParser()
-            dfp.content = image.fetch_cgit_file("Dockerfile")
-
-            if subprocess.call(cmd_str,
-                               shell=True,
-                               env={"oit_repo_name": image.name,
-                                    "oit_repo_namespace": image.namespace,
-                                    "oit_image_name": dfp.labels["name"],
-                                    "oit_image_version": dfp.labels["version"],
-                                    "oit_group": runtime.group,
-                                    "oit_metadata_dir": runtime.metadata_dir,
-                                    "oit_working_dir": runtime.working_dir,
-                                    "oit_config_filename": image.config_filename,
-                                    "oit_distgit_key": image.distgit_key,
-                                    }) != 0:
-                raise IOError("Command return non-zero status")
-            runtime.logger.info("\n")
+        runtime.logger.info("Executing in %s: [%s]" % (dgr.distgit_dir, cmd_str))
+
+        # The distgit is already cloned; read the labels from there rather than cgit
+        dfp = dockerfile_parse.DockerfileParser(os.path.join(dgr.distgit_dir, "Dockerfile"))
+
+        rc = call_prefixed(image.distgit_key, cmd_str,
+                           cwd=dgr.distgit_dir,
+                           env={"oit_repo_name": image.name,
+                                "oit_repo_namespace": image.namespace,
+                                "oit_image_name": dfp.labels["name"],
+                                "oit_image_version": dfp.labels["version"],
+                                "oit_group": runtime.group,
+                                "oit_metadata_dir": runtime.metadata_dir,
+                                "oit_working_dir": runtime.working_dir,
+                                "oit_config_filename": image.config_filename,
+                                "oit_distgit_key": image.distgit_key,
+                                })
+        if rc != 0:
+            raise IOError("Command returned non-zero status: %s" % rc)
 
         if message is not None:
             dgr.commit(message)
 
-    if push:
-        runtime.push_distgits()
+    update_distgits(runtime, run, jobs, push, "Foreach")
 
 
 @cli.command("images:revert", help="Revert a fixed number of commits in each distgit.")
 @click.argument("count", nargs=1)
 @click.option("--message", "-m", metavar='MSG', help="Commit message for dist-git.", default=None, required=False)
 @option_push
+@option_jobs
 @pass_runtime
-def images_revert(runtime, count, message, push):
+def images_revert(runtime, count, message, push, jobs):
     """
     Revert a particular number of commits in each distgit repository. If
     a message is specified, a new commit will be made.
@@ -485,19 +690,19 @@ def images_revert(runtime, count, message, push):
 
     cmd_str = " ".join(cmd)
     runtime.clone_distgits()
-    dgrs = [image.distgit_repo() for image in runtime.image_metas()]
-    for dgr in dgrs:
-        with Dir(dgr.distgit_dir):
-            runtime.logger.info("Running revert in %s: [%s]" % (dgr.distgit_dir, cmd_str))
-            if subprocess.call(cmd_str, shell=True) != 0:
-                raise IOError("Command return non-zero status")
-            runtime.logger.info("\n")
+
+    def revert(image):
+        dgr = image.distgit_repo()
+        dgr.fetch_history()
+        runtime.logger.info("Running revert in %s: [%s]" % (dgr.distgit_dir, cmd_str))
+        rc = call_prefixed(image.distgit_key, cmd_str, cwd=dgr.distgit_dir)
+        if rc != 0:
+            raise IOError("Command returned non-zero status: %s" % rc)
 
         if message is not None:
             dgr.commit(message)
 
-    if push:
-        runtime.push_distgits()
+    update_distgits(runtime, revert, jobs, push, "Revert")
 
 
 @cli.command("images:merge-branch", help="Copy content of source branch to target.")
@@ -505,8 +710,9 @@ def images_revert(runtime, count, message, push):
 @click.option('--allow-overwrite', default=False, is_flag=True,
               help='Merge in source branch even if Dockerfile already exists in distgit')
 @option_push
+@option_jobs
 @pass_runtime
-def images_merge(runtime, target, push, allow_overwrite):
+def images_merge(runtime, target, push, allow_overwrite, jobs):
     """
     For each distgit repo, copies the content of the group's branch to a new
     branch.
@@ -517,15 +723,14 @@ def images_merge(runtime, target, push, allow_overwrite):
     runtime.remove_tmp_working_dir = push
 
     runtime.clone_distgits()
-    dgrs = [image.distgit_repo() for image in runtime.image_metas()]
-    for dgr in dgrs:
+
+    def merge(image):
+        dgr = image.distgit_repo()
         with Dir(dgr.distgit_dir):
             dgr.logger.info("Merging from branch {} to {}".format(dgr.branch, target))
             dgr.merge_branch(target, allow_overwrite)
-            runtime.logger.info("\n")
 
-    if push:
-        runtime.push_distgits()
+    update_distgits(runtime, merge, jobs, push, "Merge")
 
 
 def _taskinfo_has_timestamp(task_info, key_name):
@@ -643,8 +848,15 @@ def print_build_metrics(runtime):
 @click.option("--push-to", default=[], metavar="REGISTRY", multiple=True,
               help="Specific registries to push to when image build completes.  [multiple]")
 @click.option('--scratch', default=False, is_flag=True, help='Perform a scratch build.')
+@click.option("--queue-dir", default=None, metavar="DIR",
+              help="Publish the builds to a work queue in DIR (e.g. on shared storage) and wait "
+                   "for `doozer worker` processes to run them, instead of building here.")
+@click.option("--poll-interval", default=30, type=int, metavar="SECONDS",
+              help="With --queue-dir, how often to check the queue for finished builds.")
+@option_resume
 @pass_runtime
-def images_build_image(runtime, odcs, repo_type, repo, push_to_defaults, push_to, scratch):
+def images_build_image(runtime, odcs, repo_type, repo, push_to_defaults, push_to, scratch, queue_dir, poll_interval,
+                       resume):
     """
     Attempts to build container images for all of the distgit repositories
     in a group. If an image has already been built, it will be treated as
@@ -661,14 +873,24 @@ def images_build_image(runtime, odcs, repo_type, repo, push_to_defaults, push_to
     2. Specify the raw URL to this file for the build.
     3. You will probably want to use --scratch since it is unlikely you want your
         custom build tagged.
+
+    To spread builds and pushes over several hosts, give a --queue-dir they
+    can all reach and start `doozer worker --queue-dir DIR` on each. This
+    process then only publishes the images (and the order they must be built
+    in) and collects the workers' results into its record log.
+
+    With --resume, images a previous run in the same --working-dir built (or
+    pushed) from the same distgit commit and options are not built (or
+    pushed) again, and brew is not asked about them. Queue workers resume
+    from their own working dirs.
     """
     # Initialize all distgit directories before trying to build. This is to
     # ensure all build locks are acquired before the builds start and for
-    # clarity in the logs.
-    runtime.initialize(clone_distgits=True)
+    # clarity in the logs. Workers clone the distgits they build themselves.
+    runtime.initialize(clone_distgits=queue_dir is None, resume=resume)
 
-    items = [m.distgit_repo() for m in runtime.image_metas()]
-    if not items:
+    metas = runtime.image_metas()
+    if not metas:
         runtime.logger.info("No images found. Check the arguments.")
         exit(1)
 
@@ -677,12 +899,18 @@ def images_build_image(runtime, odcs, repo_type, repo, push_to_defaults, push_to
         runtime.logger.info("No repos specified. --repo-type or --repo is required.")
         exit(1)
 
-    results = runtime.parallel_exec(
-        lambda (dgr, terminate_event): dgr.build_container(
-            odcs, repo_type, repo, push_to_defaults, additional_registries=push_to,
-            terminate_event=terminate_event, scratch=scratch),
-        items)
-    results = results.get()
+    if queue_dir:
+        params = dict(group=runtime.group, branch=runtime.branch, odcs=odcs, repo_type=repo_type, repo=list(repo),
+                      push_to_defaults=push_to_defaults, push_to=list(push_to), scratch=scratch,
+                      resume=resume)
+        results = run_build_queue(runtime, workqueue.WorkQueue(queue_dir), params, metas, poll_interval)
+    else:
+        results = runtime.parallel_exec(
+            lambda (dgr, terminate_event): dgr.build_container(
+                odcs, repo_type, repo, push_to_defaults, additional_registries=push_to,
+                terminate_event=terminate_event, scratch=scratch),
+            [m.distgit_repo() for m in metas])
+        results = results.get()
 
     try:
         print_build_metrics(runtime)
@@ -691,14 +919,130 @@ def images_build_image(runtime, odcs, repo_type, repo, push_to_defaults, push_to
         traceback.print_exc()
         runtime.logger.error("Error trying to show build metrics")
 
-    failed = [m.distgit_key for m, r in zip(runtime.image_metas(), results) if not r]
+    failed = [m.distgit_key for m, r in zip(metas, results) if not r]
     if failed:
         runtime.logger.error("\n".join(["Build/push failures:"] + sorted(failed)))
         exit(1)
 
-    # Push all late images
-    for image in runtime.image_metas():
-        image.distgit_repo().push_image([], push_to_defaults, additional_registries=push_to, push_late=True)
+    # Push all late images. Check the config first so that images built by
+    # queue workers are not cloned for nothing.
+    for image in metas:
+        if image.config.push.late is True:
+            image.distgit_repo().push_image([], push_to_defaults, additional_registries=push_to, push_late=True)
+
+
+def run_build_queue(runtime, queue, params, metas, poll_interval):
+    """
+    Publishes image builds to a work queue and waits for workers to run them.
+    Records written by the workers for each build are added to the record log.
+    :return: A list with True for each image in metas which built (and pushed) successfully
+    """
+    queue.publish(params, {m.distgit_key: m.build_dependencies() for m in metas})
+    runtime.logger.info("Published {} image builds to {}; waiting for `doozer worker --queue-dir {}`".format(
+        len(metas), queue.queue_dir, queue.queue_dir))
+
+    collected = set()
+    while True:
+        jobs = queue.jobs()
+        for name in sorted(jobs):
+            job = jobs[name]
+            if name in collected or job["state"] not in workqueue.FINISHED:
+                continue
+            collected.add(name)
+            runtime.add_record_lines(job["records"])
+            runtime.logger.info("{} {} ({}/{}){}".format(
+                name, "built" if job["state"] == workqueue.DONE else "failed",
+                len(collected), len(jobs), " by {}".format(job["worker"]) if job["worker"] else ""))
+            if job["message"]:
+                runtime.logger.info("{}: {}".format(name, job["message"]))
+        if len(collected) == len(jobs):
+            break
+        time.sleep(poll_interval)
+
+    return [jobs[m.distgit_key]["state"] == workqueue.DONE for m in metas]
+
+
+@cli.command("worker", short_help="Run image builds published by images:build --queue-dir.")
+@click.option("--queue-dir", required=True, metavar="DIR",
+              help="The work queue directory given to images:build.")
+@click.option("--poll-interval", default=30, type=int, metavar="SECONDS",
+              help="How often to check the queue for images ready to build.")
+@pass_runtime
+def worker(runtime, queue_dir, poll_interval):
+    """
+    Claims images from a work queue published by `images:build --queue-dir`,
+    builds and pushes them (with the options given to images:build) and
+    reports the outcome and records back to the queue. An image is only
+    claimed once the group members it is built from have been built.
+
+    The group and image list default to those of the queue. Run any number
+    of workers, on any hosts that can reach the queue directory. Each runs
+    one build at a time in its own working directory, and exits when every
+    image in the queue has been built or has failed.
+    """
+    queue = workqueue.WorkQueue(queue_dir)
+    params = queue.params()
+    while params is None:
+        runtime.logger.info("Waiting for images:build to publish to {}".format(queue_dir))
+        time.sleep(poll_interval)
+        params = queue.params()
+
+    if runtime.group is None:
+        runtime.group = params["group"]
+    elif runtime.group != params["group"]:
+        raise click.BadParameter("The queue is for group {}, not {}".format(params["group"], runtime.group))
+    if runtime.branch is None:
+        runtime.branch = params["branch"]
+    if not runtime.images:
+        runtime.images = [",".join(sorted(queue.jobs()))]
+    runtime.initialize(clone_distgits=False, resume=params.get("resume", False))
+
+    name = workqueue.worker_id()
+    built = failed = 0
+    while True:
+        key = queue.claim(name)
+        if key is None:
+            if queue.finished():
+                break
+            time.sleep(poll_interval)
+            continue
+
+        runtime.logger.info("Claimed {} from {}".format(key, queue_dir))
+        image = runtime.resolve_image(key, False)
+        if image is None:
+            queue.finish(key, name, False, message="{} is not in worker {}'s images".format(key, name))
+            failed += 1
+            continue
+
+        start = os.path.getsize(runtime.record_log_path)
+        with queue.claimed(key, name):
+            try:
+                success = image.distgit_repo().build_container(
+                    params["odcs"], params["repo_type"], params["repo"], params["push_to_defaults"],
+                    additional_registries=params["push_to"], terminate_event=threading.Event(),
+                    scratch=params["scratch"], wait_for_parents=False)
+                message = None
+            except Exception:
+                success, message = False, traceback.format_exc()
+        with open(runtime.record_log_path) as f:
+            f.seek(start)
+            records = f.read().splitlines()
+
+        if not queue.finish(key, name, success, records, message):
+            runtime.logger.warning("Lost the claim on {}; another worker built it too".format(key))
+        if success:
+            built += 1
+        else:
+            failed += 1
+
+    try:
+        print_build_metrics(runtime)
+    except:
+        traceback.print_exc()
+        runtime.logger.error("Error trying to show build metrics")
+    runtime.logger.info("Queue finished; this worker built {} and failed {} image(s)".format(built, failed))
+    if failed:
+        exit(1)
 
 
 @cli.command("images:push", short_help="Push the most recently built images to mirrors.")
@@ -775,28 +1119,30 @@ def images_push(runtime, tag, version_release, to_defaults, late_only, to, dry_r
 
 
 @cli.command("images:pull", short_help="Pull latest images from pulp")
+@option_pull_jobs
 @pass_runtime
-def images_pull_image(runtime):
+def images_pull_image(runtime, pull_jobs):
     """
     Pulls latest images from pull, fetching the dockerfiles from cgit to
     determine the version/release.
     """
     runtime.initialize(clone_distgits=True)
-    for image in runtime.image_metas():
-        image.pull_image()
+    if pull_images(runtime, latest_pull_urls(runtime, pull_jobs), pull_jobs):
+        exit(1)
 
 
 @cli.command("images:scan-for-cves", short_help="Scan images with openscap")
+@option_pull_jobs
 @pass_runtime
-def images_scan_for_cves(runtime):
+def images_scan_for_cves(runtime, pull_jobs):
     """
     Pulls images and scans them for CVEs using `atomic scan` and `openscap`.
     """
     runtime.initialize(clone_distgits=True)
-    image_urls = [x.pull_url() for x in runtime.image_metas()]
-    for image_url in image_urls:
-        pull_image(image_url, runtime.logger)
-    subprocess.check_call(["atomic", "scan"] + image_urls)
+    urls = latest_pull_urls(runtime, pull_jobs)
+    if pull_images(runtime, urls, pull_jobs):
+        exit(1)
+    subprocess.check_call(["atomic", "scan"] + sorted(urls.values()))
 
 
 @cli.command("images:print", short_help="Print data from each distgit.")
@@ -862,7 +1208,7 @@ def images_print(runtime, short, show_non_release, show_base_only, pattern):
         if image.base_only and not show_base_only:
             continue
 
-        dfp = DockerfileParser(path=runtime.working_dir)
+        dfp = dockerfile_parse.DockerfileParser(path=runtime.working_dir)
         try:
             dfp.content = image.fetch_cgit_file("Dockerfile")
         except Exception:
@@ -929,7 +1275,7 @@ def distgit_config_template(url):
         click.echo("Error fetching {}: {}".format(url, f.code), err=True)
         exit(1)
 
-    dfp = DockerfileParser()
+    dfp = dockerfile_parse.DockerfileParser()
     dfp.content = f.read()
 
     if "cgit/rpms/" in url:
@@ -1046,6 +1392,9 @@ def query_rpm_version(runtime, repo_type):
     Retrieve the version number of the atomic-openshift RPM in the indicated
     repository. This is the version number that will be applied to new images
     created from this build.
+
+    The repository's metadata is indexed in --cache-dir and only downloaded
+    again when it changes.
     """
     runtime.initialize(clone_distgits=False)
 
@@ -1053,6 +1402,48 @@ def query_rpm_version(runtime, repo_type):
     click.echo("version: {}".format(version))
 
 
+@cli.command("images:rpm-index", short_help="Report the RPMs installed by each image's Dockerfile.")
+@click.option("--package", "-p", metavar="NAME", multiple=True,
+              help="Only report the images which install this package.  [multiple]")
+@pass_runtime
+def images_rpm_index(runtime, package):
+    """
+    Prints a JSON document mapping each image (distgit_key) to the packages its
+    Dockerfile installs with yum (with ENV substitution resolved), and each
+    package to the images which install it:
+
+    \b
+      {"images": {"<distgit_key>": ["<package>", ...], ...},
+       "packages": {"<package>": ["<distgit_key>", ...], ...}}
+
+    Dockerfiles are read from distgit clones in the working directory or
+    fetched from cgit. The results are kept in an index in --cache-dir keyed
+    by Dockerfile sha256, so only Dockerfiles which changed since the last
+    run are analyzed again.
+    """
+    runtime.initialize(clone_distgits=False)
+
+    def rpm_install_list(image):
+        # Use a clone already in the working directory rather than fetching from cgit
+        if os.path.isdir(os.path.join(runtime.distgits_dir, image.namespace, image.distgit_key)):
+            image.distgit_repo()
+        return image.get_rpm_install_list()
+
+    metas = runtime.image_metas()
+    results = runtime.parallel_exec(
+        lambda (image, terminate_event): rpm_install_list(image),
+        metas, n_threads=20).get()
+    runtime.rpm_index.save()
+
+    images = dict((image.distgit_key, sorted(set(rpms))) for image, rpms in zip(metas, results))
+    packages = runtime.rpm_index.package_map(images.keys())
+    if package:
+        packages = dict((p, packages.get(p, [])) for p in package)
+        images = dict((k, v) for k, v in images.iteritems() if set(v) & set(package))
+
+    click.echo(json.dumps({"images": images, "packages": packages}, indent=2, sort_keys=True))
+
+
 @cli.command("cleanup", short_help="Cleanup the OIT environment")
 @pass_runtime
 def cleanup(runtime):
@@ -1238,5 +1629,29 @@ def config_new(runtime, new_type, name):
     click.echo('Remember to use config:commit after the new config is complete')
 
 
+@cli.command("serve", short_help="Run commands sent by doozerc.py in one long running process.")
+@click.option("--socket", "socket_path", metavar="PATH", envvar="DOOZER_SOCKET", default=service.DEFAULT_SOCKET,
+              help="Unix socket to accept commands on (~/.doozer.sock by default). Env var: DOOZER_SOCKET")
+@pass_runtime
+def serve(runtime, socket_path):
+    """
+    Runs doozer commands sent by doozerc.py, one at a time, in this process.
+    Imports, parsed group configs and caches (git queries, yum repository
+    metadata, Dockerfile analysis...) are kept between commands, so a chain
+    of commands spends its time on the work rather than on starting up.
+
+    Each command gets its own working directory (unless it passes
+    --working-dir) and record log, and runs in the client's current
+    directory and environment. All commands share this service's
+    --cache-dir (~/.cache/doozer by default) unless they give their own.
+
+    \b
+      $ doozer.py serve &
+      $ doozerc.py --group openshift-3.11 images:list
+    """
+    cache_dir = os.path.abspath(runtime.cache_dir or os.path.expanduser("~/.cache/doozer"))
+    service.serve(cli, socket_path, default_args=["--cache-dir", cache_dir])
+
+
 if __name__ == '__main__':
     cli(obj={})
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Thin client for `doozer.py serve`.
+
+Sends its command line, current directory and environment to the service
+and relays the command's output and exit code, e.g.:
+
+  $ doozerc.py --group openshift-3.11 images:list
+
+Only the standard library is imported, so the client starts in a few
+milliseconds. The socket is ~/.doozer.sock unless DOOZER_SOCKET is set.
+"""
+
+import json
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = os.path.expanduser("~/.doozer.sock")
+
+
+def main(argv):
+    path = os.environ.get("DOOZER_SOCKET", DEFAULT_SOCKET)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+    except socket.error as e:
+        sys.stderr.write("Unable to connect to doozer service at {}: {}\n"
+                         "Start one with: doozer.py serve\n".format(path, e))
+        return 2
+
+    request = {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}
+    conn.sendall(json.dumps(request) + "\n")
+
+    streams = {"stdout": sys.stdout, "stderr": sys.stderr}
+    for line in conn.makefile("rb"):
+        message = json.loads(line)
+        if "exit" in message:
+            return message["exit"]
+        for name, data in message.items():
+            streams[name].write(data.encode("utf-8"))
+            streams[name].flush()
+
+    sys.stderr.write("Lost connection to doozer service\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
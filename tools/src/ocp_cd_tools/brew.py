@@ -11,8 +11,6 @@ from multiprocessing.dummy import Pool as ThreadPool
 from multiprocessing import cpu_count
 from multiprocessing import Lock
 import shlex
-import koji
-import koji_cli.lib
 import traceback
 
 # ours
@@ -20,11 +18,15 @@ import constants
 import exceptions
 import exectools
 import logutil
+import repodata
+import tracing
+from lazyimport import LazyModule, HTTPKerberosAuth
 
 # 3rd party
 import click
 import requests
-from requests_kerberos import HTTPKerberosAuth
+koji = LazyModule("koji")
+koji_cli_lib = LazyModule("koji_cli.lib")
 
 logger = logutil.getLogger(__name__)
 
@@ -50,8 +52,13 @@ def get_watch_task_info_copy():
 
 
 def watch_task(log_f, task_id, terminate_event):
+    with tracing.span("watch", task_id=task_id):
+        return _watch_task(log_f, task_id, terminate_event)
+
+
+def _watch_task(log_f, task_id, terminate_event):
     end = time.time() + 4 * 60 * 60
-    watcher = koji_cli.lib.TaskWatcher(
+    watcher = koji_cli_lib.TaskWatcher(
         task_id,
         koji.ClientSession(constants.BREW_HUB),
         quiet=True)
@@ -327,25 +334,17 @@ def get_tagged_rpm_names(branch, arch='x86_64'):
 def check_rpm_buildroot(name, branch, arch='x86_64'):
     """
     Query the buildroot used by ODCS to determine if a given RPM name
-    is provided by ODCS for the given arch.
+    is provided by ODCS for the given arch. The buildroot's repodata is
+    indexed once per run (per branch and arch) and shared by all callers.
     :param str name: RPM name
     :param str branch: Current building branch, such as rhaos-3.10-rhel-7
     :param str arch: CPU architecture to search
+    :return: The names of the packages providing name
     """
-    args = locals()
-    query = 'repoquery --repofrompath foo,"http://download-node-02.eng.bos.redhat.com/brewroot/repos/{branch}-ppc64le-container-build/latest/{arch}" --repoid=foo --arch {arch},noarch --whatprovides {name}'
-    rc, stdout, stderr = exectools.cmd_gather(query.format(**args))
-    if rc == 0:
-        result = []
-        stdout = stdout.strip()
-        for rpm in stdout.strip().splitlines():
-            n = rpm.split(':')[0]
-            n = '-'.join(n.split('-')[0:-1])
-            result.append(n)
-
-        return result
-    else:
-        raise ValueError(stderr)
+    try:
+        return repodata.buildroot(branch, arch).whatprovides(name)
+    except IOError as e:
+        raise ValueError(str(e))
 
 
 class BrewTaggedImageBuilds(object):
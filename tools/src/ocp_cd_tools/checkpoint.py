@@ -0,0 +1,99 @@
+"""
+A journal of the phases each image has completed in a working directory.
+
+images:rebase and images:build record each phase an image completes
+(cloned, rebased, committed, pushed, built, mirrored) as a JSON line in
+<working_dir>/checkpoints.jsonl, with a hash of the phase's inputs and
+whatever later phases need from it (e.g. the commit sha). Rerun with
+--resume in the same working directory, a phase is skipped only if the
+journal has it with the same input hash. Anything its inputs are made of
+changing (a new source commit, another version, a distgit that has moved
+on...) means the phase, and those which take its result as input, are
+redone.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import logutil
+
+logger = logutil.getLogger(__name__)
+
+
+def input_hash(inputs):
+    """
+    :param inputs: JSON serializable description of what a phase's result depends on
+    :return: A stable hash of inputs
+    """
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str)).hexdigest()
+
+
+class Checkpoints(object):
+
+    def __init__(self, path=None, resume=False):
+        """
+        :param path: The journal file; None keeps nothing (every phase runs)
+        :param resume: Whether completed() should report phases completed by earlier runs
+        """
+        self.path = path
+        self.resume = resume
+        self._lock = threading.Lock()
+        self._phases = {}  # (key, phase) => latest journal entry
+        if path is not None and os.path.isfile(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # The last line may be cut short if a run was killed while writing it
+                    logger.warning("Ignoring malformed line in {}: {}".format(self.path, line.strip()))
+                    continue
+                self._phases[(entry["key"], entry["phase"])] = entry
+
+    def _entry(self, key, phase, inputs):
+        entry = self._phases.get((key, phase))
+        if entry is not None and entry["inputs"] == input_hash(inputs):
+            return entry
+        return None
+
+    def completed(self, key, phase, inputs):
+        """
+        :param key: The image (distgit_key) the phase applies to
+        :param phase: The name of the phase (e.g. "built")
+        :param inputs: What the phase's result depends on
+        :return: The info recorded with the phase if resuming and it was completed
+                 with the same inputs; otherwise None
+        """
+        if not self.resume:
+            return None
+        with self._lock:
+            entry = self._entry(key, phase, inputs)
+        if entry is None:
+            return None
+        logger.info("Resuming: {} already {} at {}".format(
+            key, phase, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["time"]))))
+        return entry["info"]
+
+    def record(self, key, phase, inputs, **info):
+        """
+        Journals the completion of a phase.
+        :param info: JSON serializable results of the phase to return from completed()
+        """
+        with self._lock:
+            entry = self._entry(key, phase, inputs)
+            if entry is not None and entry["info"] == info:
+                return
+            entry = dict(key=key, phase=phase, inputs=input_hash(inputs), info=info, time=time.time())
+            self._phases[(key, phase)] = entry
+            if self.path is None:
+                return
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, sort_keys=True) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
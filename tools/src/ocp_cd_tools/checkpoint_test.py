@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Test the journal of phases completed by images
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from checkpoint import Checkpoints
+
+
+class CheckpointsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-checkpoint")
+        self.path = os.path.join(self.test_dir, "checkpoints.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_resume(self):
+        checkpoints = Checkpoints(self.path)
+        checkpoints.record("cli", "built", {"distgit": "abc"}, version="v3.11.0", release="1")
+        # Only resumed runs skip work
+        self.assertIsNone(checkpoints.completed("cli", "built", {"distgit": "abc"}))
+
+        checkpoints = Checkpoints(self.path, resume=True)
+        self.assertEqual(checkpoints.completed("cli", "built", {"distgit": "abc"}),
+                         {"version": "v3.11.0", "release": "1"})
+        self.assertIsNone(checkpoints.completed("cli", "built", {"distgit": "def"}))
+        self.assertIsNone(checkpoints.completed("cli", "mirrored", {"distgit": "abc"}))
+        self.assertIsNone(checkpoints.completed("pod", "built", {"distgit": "abc"}))
+
+    def test_latest_entry_wins(self):
+        checkpoints = Checkpoints(self.path)
+        checkpoints.record("cli", "committed", {"version": "v3.11.0"}, sha="abc")
+        checkpoints.record("cli", "committed", {"version": "v3.11.0"}, sha="abc")
+        checkpoints.record("cli", "committed", {"version": "v3.11.1"}, sha="def")
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+        checkpoints = Checkpoints(self.path, resume=True)
+        self.assertIsNone(checkpoints.completed("cli", "committed", {"version": "v3.11.0"}))
+        self.assertEqual(checkpoints.completed("cli", "committed", {"version": "v3.11.1"}), {"sha": "def"})
+
+    def test_truncated(self):
+        Checkpoints(self.path).record("cli", "cloned", {"branch": "rhaos-3.11-rhel-7"})
+        with open(self.path, "a") as f:
+            f.write('{"key": "pod", "phase": "clo')
+
+        checkpoints = Checkpoints(self.path, resume=True)
+        self.assertEqual(checkpoints.completed("cli", "cloned", {"branch": "rhaos-3.11-rhel-7"}), {})
+        self.assertIsNone(checkpoints.completed("pod", "cloned", {"branch": "rhaos-3.11-rhel-7"}))
+
+    def test_no_journal(self):
+        checkpoints = Checkpoints(resume=True)
+        checkpoints.record("cli", "built", {})
+        self.assertEqual(checkpoints.completed("cli", "built", {}), {})
+        self.assertEqual(os.listdir(self.test_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
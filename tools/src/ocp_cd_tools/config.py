@@ -1,11 +1,12 @@
 import metadata
-import yaml
-from pykwalify.core import Core
 import os
 import shutil
 from pushd import Dir
 import exectools
 import sys
+from lazyimport import LazyModule
+
+yaml = LazyModule("yaml")
 
 
 VALID_UPDATES = {
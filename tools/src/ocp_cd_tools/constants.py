@@ -10,6 +10,9 @@ OCP_BUILD_DATA_RW = "git@github.com:openshift/ocp-build-data.git"
 BREW_HUB = "https://brewhub.engineering.redhat.com/brewhub"
 BREW_IMAGE_HOST = "brew-pulp-docker01.web.prod.ext.phx2.redhat.com:8888"
 CGIT_URL = "http://pkgs.devel.redhat.com/cgit"
+DISTGIT_HOST = "pkgs.devel.redhat.com"
+# The yum repository of the buildroot used by ODCS composes
+BREW_BUILDROOT_REPO_URL = "http://download-node-02.eng.bos.redhat.com/brewroot/repos/{branch}-ppc64le-container-build/latest/{arch}"
 
 # For Bugzilla searches
 BUGZILLA_SERVER = "bugzilla.redhat.com"
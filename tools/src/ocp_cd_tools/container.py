@@ -30,6 +30,13 @@ then running a subset of operations in the new container."""
         rc, stdout, stderr = self._cmd(run_str)
         self.cid = stdout.rstrip()
 
+    def image_id(self):
+        """
+        :return: The ID (config digest) of the local image, or None if it is not present
+        """
+        rc, stdout, stderr = self._cmd('docker inspect --format {{{{.Id}}}} {img}'.format(img=self.image))
+        return stdout.strip() if rc == 0 else None
+
     def stop(self):
         """Stop the container"""
         return self._cmd('docker stop {cid}'.format(cid=self.cid))
@@ -6,19 +6,24 @@ import time
 import traceback
 import errno
 from multiprocessing import Lock
-import yaml
 import logging
-import bashlex
-
-from dockerfile_parse import DockerfileParser
 
 import logutil
 import assertion
 import constants
 import exectools
+import filesync
+import gitquery
+import shellfrag
+import tracing
+from dockerfile import DockerfileTransform
 from pushd import Dir
 from brew import watch_task, check_rpm_buildroot
 from model import Model, Missing
+from lazyimport import LazyModule
+
+dockerfile_parse = LazyModule("dockerfile_parse")
+yaml = LazyModule("yaml")
 
 OIT_COMMENT_PREFIX = '#oit##'
 OIT_BEGIN = '##OIT_BEGIN'
@@ -39,15 +44,15 @@ CONTAINER_YAML_HEADER = """
 logger = logutil.getLogger(__name__)
 
 
-def recursive_overwrite(src, dest, ignore=set()):
+def dir_size(path):
     """
-    Use rsync to copy one file tree to a new location
+    :return: The total size in bytes of the files beneath path
     """
-    exclude = ''
-    for i in ignore:
-        exclude += ' --exclude="{}" '.format(i)
-    cmd = 'rsync -av {} {}/ {}/'.format(exclude, src, dest)
-    exectools.cmd_assert(cmd.split(' '), retries=3)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.lstat(os.path.join(root, name)).st_size
+    return total
 
 
 def pull_image(url):
@@ -57,9 +62,10 @@ def pull_image(url):
         logger.info("Error pulling image %s -- retrying in 60 seconds" % url)
         time.sleep(60)
 
-    exectools.retry(
-        3, wait_f=wait,
-        task_f=lambda: exectools.cmd_gather(["docker", "pull", url])[0] == 0)
+    with tracing.span("pull", url=url):
+        exectools.retry(
+            3, wait_f=wait,
+            task_f=lambda: exectools.cmd_gather(["docker", "pull", url])[0] == 0)
 
 
 class DistGitRepo(object):
@@ -90,6 +96,10 @@ class DistGitRepo(object):
             self.clone(self.runtime.distgits_dir, self.branch)
 
     def clone(self, distgits_root_dir, distgit_branch):
+        with tracing.track(self.metadata.distgit_key), tracing.span("clone", branch=distgit_branch):
+            self._clone(distgits_root_dir, distgit_branch)
+
+    def _clone(self, distgits_root_dir, distgit_branch):
         with Dir(distgits_root_dir):
 
             namespace_dir = os.path.join(distgits_root_dir, self.metadata.namespace)
@@ -100,6 +110,21 @@ class DistGitRepo(object):
             # don't conflict by stomping on the same git directory.
             self.distgit_dir = os.path.join(namespace_dir, self.metadata.distgit_key)
 
+            # A clone interrupted by a previous run must not be mistaken for a complete one.
+            # Directories the journal does not know of may still hold complete clones (from
+            # before checkpoints, or with local changes), so only those without a commit are removed.
+            checkpoints = self.runtime.checkpoints
+            clone_inputs = {"branch": distgit_branch}
+            if os.path.isdir(self.distgit_dir) and checkpoints.resume and \
+                    checkpoints.completed(self.metadata.distgit_key, "cloned", clone_inputs) is None:
+                if not os.path.isdir(os.path.join(self.distgit_dir, ".git")):
+                    raise IOError("Distgit directory is not a git clone; remove it to clone again: %s"
+                                  % self.distgit_dir)
+                if gitquery.get_repo(self.distgit_dir).head_sha() is None:
+                    self.logger.info("Distgit directory was not completely cloned; recloning: %s" % self.distgit_dir)
+                    gitquery.forget(self.distgit_dir)
+                    shutil.rmtree(self.distgit_dir)
+
             if os.path.isdir(self.distgit_dir):
                 self.logger.info("Distgit directory already exists; skipping clone: %s" % self.distgit_dir)
             else:
@@ -111,36 +136,89 @@ class DistGitRepo(object):
                     if e.errno != errno.EEXIST:
                         raise
 
-                cmd_list = ["rhpkg"]
+                start = time.time()
+                method = "fast"
+                if not (self.runtime.fast_clone and self._fast_clone(distgit_branch)):
+                    method = "rhpkg"
+                    cmd_list = ["rhpkg"]
 
-                if self.runtime.user is not None:
-                    cmd_list.append("--user=%s" % self.runtime.user)
+                    if self.runtime.user is not None:
+                        cmd_list.append("--user=%s" % self.runtime.user)
 
-                cmd_list.extend(["clone", self.metadata.qualified_name, self.distgit_dir])
+                    cmd_list.extend(["clone", self.metadata.qualified_name, self.distgit_dir])
 
-                self.logger.info("Cloning distgit repository [branch:%s] into: %s" % (distgit_branch, self.distgit_dir))
+                    self.logger.info("Cloning distgit repository [branch:%s] into: %s" % (distgit_branch, self.distgit_dir))
 
-                # Clone the distgit repository. Occasional flakes in clone, so use retry.
-                exectools.cmd_assert(cmd_list, retries=3)
+                    # Clone the distgit repository. Occasional flakes in clone, so use retry.
+                    exectools.cmd_assert(cmd_list, retries=3)
 
-            with Dir(self.distgit_dir):
+                self.runtime.add_record("distgit_clone",
+                                        distgit=self.metadata.qualified_name,
+                                        branch=distgit_branch,
+                                        method=method,
+                                        bytes=dir_size(os.path.join(self.distgit_dir, ".git")),
+                                        seconds="{:.3f}".format(time.time() - start))
 
-                rc, out, err = exectools.cmd_gather(["git", "rev-parse", "--abbrev-ref", "HEAD"])
-                out = out.strip()
-
-                # Only switch if we are not already in the branch. This allows us to work in
-                # working directories with uncommited changes.
-                if out != distgit_branch:
+            # Only switch if we are not already in the branch. This allows us to work in
+            # working directories with uncommited changes.
+            if gitquery.get_repo(self.distgit_dir).branch() != distgit_branch:
+                with Dir(self.distgit_dir):
                     # Switch to the target branch; all git changes should retry for flakes
                     exectools.cmd_assert(["rhpkg", "switch-branch", distgit_branch], retries=3)
 
+            checkpoints.record(self.metadata.distgit_key, "cloned", clone_inputs)
             self._read_master_data()
 
+    def _distgit_url(self):
+        user = "{}@".format(self.runtime.user) if self.runtime.user is not None else ""
+        return "ssh://{}{}/{}".format(user, constants.DISTGIT_HOST, self.metadata.qualified_name)
+
+    def _fast_clone(self, distgit_branch):
+        """
+        Clones only the branch being worked on (at --clone-depth) and checks it out directly,
+        instead of cloning every branch with rhpkg and switching afterwards.
+        :return: True if the clone succeeded; False if the caller should fall back to rhpkg.
+        """
+        cmd_list = ["git", "clone", "--single-branch", "--branch", distgit_branch]
+        if self.runtime.clone_depth:
+            cmd_list.extend(["--depth", str(self.runtime.clone_depth)])
+        cmd_list.extend([self._distgit_url(), self.distgit_dir])
+
+        self.logger.info("Fast cloning distgit repository [branch:%s] into: %s" % (distgit_branch, self.distgit_dir))
+        rc, out, err = exectools.cmd_gather(cmd_list)
+        if rc != 0:
+            self.logger.warning("Fast clone failed; falling back to rhpkg clone: {}".format(err.strip()))
+            if os.path.isdir(self.distgit_dir):
+                shutil.rmtree(self.distgit_dir)
+            return False
+        return True
+
+    def fetch_history(self, *branches):
+        """
+        Repos made by --fast-clone only have the working branch, and possibly only part
+        of its history. Fetches the complete history and the given branches, if missing.
+        """
+        repo = gitquery.get_repo(self.distgit_dir)
+        shallow = os.path.isfile(os.path.join(repo.git_dir, "shallow"))
+        single_branch = repo.config("remote.origin.fetch") != "+refs/heads/*:refs/remotes/origin/*"
+        if not shallow and not (single_branch and branches):
+            return
+        with Dir(self.distgit_dir):
+            if single_branch:
+                for branch in branches:
+                    exectools.cmd_assert(["git", "remote", "set-branches", "--add", "origin", branch])
+            cmd_list = ["git", "fetch", "origin"]
+            if shallow:
+                cmd_list.append("--unshallow")
+            exectools.cmd_assert(cmd_list, retries=3)
+
     def merge_branch(self, target, allow_overwrite=False):
+        self.fetch_history(target)
         self.logger.info('Switching to branch: {}'.format(target))
         exectools.cmd_assert(["rhpkg", "switch-branch", target], retries=3)
         if not allow_overwrite:
-            if os.path.isfile('Dockerfile') or os.path.isdir('.oit'):
+            if os.path.isfile(os.path.join(self.distgit_dir, 'Dockerfile')) or \
+                    os.path.isdir(os.path.join(self.distgit_dir, '.oit')):
                 raise IOError('Unable to continue merge. Dockerfile found in target branch. Use --allow-overwrite to force.')
         self.logger.info('Merging source branch history over current branch')
         msg = 'Merge branch {} into {}'.format(self.branch, target)
@@ -159,12 +237,7 @@ class DistGitRepo(object):
         if alias is Missing:
             raise IOError("Can't find any source alias in config: %s" % self.metadata.config_filename)
 
-        source_root = self.runtime.resolve_source(alias)
-        sub_path = self.config.content.source.path
-
-        path = source_root
-        if sub_path is not Missing:
-            path = os.path.join(source_root, sub_path)
+        path = self.runtime.resolve_source_path(alias, self.config.content.source.path)
 
         assertion.isdir(path, "Unable to find path for source [%s] for config: %s" % (path, self.metadata.config_filename))
         return path
@@ -183,9 +256,10 @@ class DistGitRepo(object):
             # commit changes; if these flake there is probably not much we can do about it
             exectools.cmd_assert(["git", "add", "-A", "."])
             exectools.cmd_assert(["git", "commit", "--allow-empty", "-m", commit_message])
-            rc, sha, err = exectools.cmd_gather(["git", "rev-parse", "HEAD"])
-            assertion.success(rc, "Failure fetching commit SHA for {}".format(self.distgit_dir))
-        return sha.strip()
+        sha = gitquery.get_repo(self.distgit_dir).head_sha()
+        if sha is None:
+            raise IOError("Failure fetching commit SHA for {}".format(self.distgit_dir))
+        return sha
 
     def tag(self, version, release):
         if version is None:
@@ -200,6 +274,12 @@ class DistGitRepo(object):
             self.logger.info("Adding tag to local repo: {}".format(tag))
             exectools.cmd_gather(["git", "tag", "-f", tag, "-m", tag])
 
+    def head_sha(self):
+        """
+        :return: The sha of the distgit's HEAD commit
+        """
+        return gitquery.get_repo(self.distgit_dir).head_sha()
+
 
 class ImageDistGitRepo(DistGitRepo):
     def __init__(self, metadata):
@@ -208,7 +288,7 @@ class ImageDistGitRepo(DistGitRepo):
         self.build_lock.acquire()
         self.logger = metadata.logger
 
-    def _manage_container_config(self):
+    def _manage_container_config(self, dfp=None):
 
         # Determine which image build method to use in OSBS.
         # By default, specify nothing. use the OSBS default.
@@ -221,7 +301,7 @@ class ImageDistGitRepo(DistGitRepo):
         if self.config.image_build_method is not Missing:
             build_method = self.config.image_build_method
 
-        container_config = self._generate_odcs_config() or {}
+        container_config = self._generate_odcs_config(dfp) or {}
         if build_method is not Missing:
             container_config['image_build_method'] = build_method
 
@@ -230,12 +310,13 @@ class ImageDistGitRepo(DistGitRepo):
 
         # generate yaml data with header
         content_yml = yaml.safe_dump(container_config, default_flow_style=False)
-        with open('container.yaml', 'w') as rc:
+        with open(os.path.join(self.distgit_dir, 'container.yaml'), 'w') as rc:
             rc.write(CONTAINER_YAML_HEADER + content_yml)
 
-    def _generate_odcs_config(self):
+    def _generate_odcs_config(self, dfp=None):
         """
-        Generates a compose conf file in container.yaml
+        Generates a compose conf file in container.yaml.
+        If dfp is given, packages are detected from it rather than the distgit Dockerfile.
         Example in image yml file:
         odcs:
             packages:
@@ -272,11 +353,12 @@ class ImageDistGitRepo(DistGitRepo):
         CYAML = 'build_container.yaml' if no_source else 'container.yaml'
 
         # always delete from distgit
-        if os.path.exists(CYAML):
-            os.remove(CYAML)
+        distgit_container_yaml = os.path.join(self.distgit_dir, CYAML)
+        if os.path.exists(distgit_container_yaml):
+            os.remove(distgit_container_yaml)
 
         if no_source:
-            source_container_yaml = CYAML
+            source_container_yaml = distgit_container_yaml
         else:
             source_container_yaml = os.path.join(self.source_path(), CYAML)
         if os.path.isfile(source_container_yaml):
@@ -319,7 +401,7 @@ class ImageDistGitRepo(DistGitRepo):
 
         if package_mode == 'auto':
             packages = []
-            for rpm in self.metadata.get_rpm_install_list():
+            for rpm in self.metadata.get_rpm_install_list(dfp=dfp):
                 res = []
                 # ODCS is fine with a mix of packages that are only available in a single arch
                 for arch in self.metadata.runtime.arches:
@@ -361,31 +443,31 @@ class ImageDistGitRepo(DistGitRepo):
         self.logger.debug("Generating repo file for Dockerfile {}".format(self.metadata.name))
 
         # Make our metadata directory if it does not exist
-        if not os.path.isdir(".oit"):
-            os.mkdir(".oit")
+        oit_dir = os.path.join(self.distgit_dir, ".oit")
+        if not os.path.isdir(oit_dir):
+            os.mkdir(oit_dir)
 
         repos = self.runtime.repos
         enabled_repos = self.config.get('enabled_repos', [])
         for t in repos.repotypes:
-            with open('.oit/{}.repo'.format(t), 'w') as rc:
+            with open(os.path.join(oit_dir, '{}.repo'.format(t)), 'w') as rc:
                 content = repos.repo_file(t, enabled_repos=enabled_repos)
                 rc.write(content)
 
-        with open('content_sets.yml', 'w') as rc:
+        with open(os.path.join(self.distgit_dir, 'content_sets.yml'), 'w') as rc:
             rc.write(repos.content_sets(enabled_repos=enabled_repos))
 
     def _read_master_data(self):
-        with Dir(self.distgit_dir):
-            self.org_image_name = None
-            self.org_version = None
-            self.org_release = None
-            # Read in information about the image we are about to build
-            dockerfile = os.path.join(Dir.getcwd(), 'Dockerfile')
-            if os.path.isfile(dockerfile):
-                dfp = DockerfileParser(path=dockerfile)
-                self.org_image_name = dfp.labels.get("name")
-                self.org_version = dfp.labels.get("version")
-                self.org_release = dfp.labels.get("release")  # occasionally no release given
+        self.org_image_name = None
+        self.org_version = None
+        self.org_release = None
+        # Read in information about the image we are about to build
+        dockerfile = os.path.join(self.distgit_dir, 'Dockerfile')
+        if os.path.isfile(dockerfile):
+            dfp = dockerfile_parse.DockerfileParser(path=dockerfile)
+            self.org_image_name = dfp.labels.get("name")
+            self.org_version = dfp.labels.get("version")
+            self.org_release = dfp.labels.get("release")  # occasionally no release given
 
     def push_image(self, tag_list, push_to_defaults, additional_registries=[], version_release_tuple=None,
                    push_late=False, dry_run=False):
@@ -518,7 +600,8 @@ class ImageDistGitRepo(DistGitRepo):
 
                             for r in range(10):
                                 self.logger.info("Pushing image to mirror [retry=%d]: %s" % (r, push_url))
-                                rc, out, err = exectools.cmd_gather(["docker", "push", push_url])
+                                with tracing.span("push", url=push_url, attempt=r):
+                                    rc, out, err = exectools.cmd_gather(["docker", "push", push_url])
                                 if rc == 0:
                                     break
                                 self.logger.info("Error pushing image -- retrying in 60 seconds")
@@ -564,13 +647,14 @@ class ImageDistGitRepo(DistGitRepo):
             self.logger.info("Skipping image build since it is not included: %s" % image_name)
             return
         parent_dgr = image.distgit_repo()
-        parent_dgr.wait_for_build(self.metadata.qualified_name)
+        with tracing.span("wait_for_parent", parent=image_name):
+            parent_dgr.wait_for_build(self.metadata.qualified_name)
         if terminate_event.is_set():
             raise KeyboardInterrupt()
 
     def build_container(
             self, odcs, repo_type, repo, push_to_defaults, additional_registries, terminate_event,
-            scratch=False, retries=3):
+            scratch=False, retries=3, wait_for_parents=True):
         """
         This method is designed to be thread-safe. Multiple builds should take place in brew
         at the same time. After a build, images are pushed serially to all mirrors.
@@ -582,6 +666,8 @@ class ImageDistGitRepo(DistGitRepo):
         :param terminate_event: Allows the main thread to interrupt the build.
         :param scratch: Whether this is a scratch build. UNTESTED.
         :param retries: Number of times the build should be retried.
+        :param wait_for_parents: Whether to wait for group members this image depends on to be built
+                                 in this process. False when something else (e.g. a work queue) orders builds.
         :return: True if the build was successful
         """
         if self.org_image_name is None or self.org_version is None:
@@ -611,24 +697,26 @@ class ImageDistGitRepo(DistGitRepo):
         target_tag = "-".join((self.org_version, release))
         target_image = ":".join((self.org_image_name, target_tag))
 
+        checkpoints = self.runtime.checkpoints
+        key = self.metadata.distgit_key
+
         try:
-            if not scratch and self.org_release is not None \
+            build_inputs = dict(image=target_image, distgit=self.head_sha(), odcs=odcs, repo_type=repo_type,
+                                repo=list(repo), scratch=scratch)
+            built = checkpoints.completed(key, "built", build_inputs)
+            if built is not None:
+                self.logger.info("Image already built by a previous run for: {}".format(target_image))
+                push_version, push_release = built["version"], built["release"]
+            elif not scratch and self.org_release is not None \
                     and self.metadata.tag_exists(target_tag):
                 self.logger.info("Image already built for: {}".format(target_image))
             else:
-                # If this image is FROM another group member, we need to wait on that group member
-                # Use .get('from',None) since from is a reserved word.
-                image_from = Model(self.config.get('from', None))
-                if image_from.member is not Missing:
-                    self._set_wait_for(image_from.member, terminate_event)
-                for builder in image_from.get('builder', []):
-                    if 'member' in builder:
-                        self._set_wait_for(builder['member'], terminate_event)
-
-                # Allow an image to wait on an arbitrary image in the group. This is presently
+                # If this image is FROM another group member, we need to wait on that group member.
+                # wait_for allows an image to wait on an arbitrary image in the group. This is presently
                 # just a workaround for: https://projects.engineering.redhat.com/browse/OSBS-5592
-                if self.config.wait_for is not Missing:
-                    self._set_wait_for(self.config.wait_for, terminate_event)
+                if wait_for_parents:
+                    for member in self.metadata.build_dependencies():
+                        self._set_wait_for(member, terminate_event)
 
                 def wait(n):
                     self.logger.info("Async error in image build thread [attempt #{}]".format(n + 1))
@@ -646,9 +734,11 @@ class ImageDistGitRepo(DistGitRepo):
             # Just in case someone else is building an image, go ahead and find what was just
             # built so that push_image will have a fixed point of reference and not detect any
             # subsequent builds.
-            push_version, push_release = ('','')
-            if not scratch:
-                _, push_version, push_release = self.metadata.get_latest_build_info()
+            if built is None:
+                push_version, push_release = ('','')
+                if not scratch:
+                    _, push_version, push_release = self.metadata.get_latest_build_info()
+                checkpoints.record(key, "built", build_inputs, version=push_version, release=push_release)
             record["message"] = "Success"
             record["status"] = 0
             self.build_status = True
@@ -664,21 +754,32 @@ class ImageDistGitRepo(DistGitRepo):
             self.build_lock.release()
 
         self.push_status = True  # if if never pushes, the status is True
-        if not scratch and self.build_status and (push_to_defaults or additional_registries):
+        mirror_inputs = None
+        if self.build_status:
+            mirror_inputs = dict(version=push_version, release=push_release, push_to_defaults=push_to_defaults,
+                                 registries=sorted(additional_registries))
+        if mirror_inputs and checkpoints.completed(key, "mirrored", mirror_inputs) is not None:
+            self.logger.info("Image already pushed by a previous run for: {}".format(target_image))
+        elif not scratch and self.build_status and (push_to_defaults or additional_registries):
             # If this is a scratch build, we aren't going to be pushing. We might be able to determine the
             # image name by parsing the build log, but not worth the effort until we need scratch builds.
             # The image name for a scratch build looks something like:
             # brew-pulp-docker01.web.prod.ext.phx2.redhat.com:8888/openshift3/ose-base:rhaos-3.7-rhel-7-docker-candidate-16066-20170829214444
 
             # To ensure we don't overwhelm the system building, pull & push synchronously
-            with self.runtime.mutex:
+            with tracing.span("wait_for_push_mutex"):
+                self.runtime.mutex.acquire()
+            try:
                 self.push_status = False
                 try:
                     self.push_image([], push_to_defaults, additional_registries, version_release_tuple=(push_version, push_release))
                     self.push_status = True
+                    checkpoints.record(key, "mirrored", mirror_inputs)
                 except Exception as push_e:
                     self.logger.info("Error during push after successful build: %s" % str(push_e))
                     self.push_status = False
+            finally:
+                self.runtime.mutex.release()
 
         record['push_status'] = '0' if self.push_status else '-1'
 
@@ -722,7 +823,8 @@ class ImageDistGitRepo(DistGitRepo):
             cmd_list.append("--scratch")
 
         # Run the build with --nowait so that we can immediately get information about the brew task
-        rc, out, err = exectools.cmd_gather(cmd_list)
+        with tracing.span("task_submit", image=target_image):
+            rc, out, err = exectools.cmd_gather(cmd_list)
 
         if rc != 0:
             # Probably no point in continuing.. can't contact brew?
@@ -757,7 +859,8 @@ class ImageDistGitRepo(DistGitRepo):
 
         # Gather brew-logs
         logs_dir = "%s/%s" % (self.runtime.brew_logs_dir, self.metadata.name)
-        logs_rc, _, logs_err = exectools.cmd_gather(["brew", "download-logs", "-d", logs_dir, task_id])
+        with tracing.span("log_download", task_id=task_id):
+            logs_rc, _, logs_err = exectools.cmd_gather(["brew", "download-logs", "-d", logs_dir, task_id])
 
         if logs_rc != 0:
             self.logger.info("Error downloading build logs from brew for task %s: %s" % (task_id, logs_err))
@@ -771,7 +874,7 @@ class ImageDistGitRepo(DistGitRepo):
         return True
 
     def push(self):
-        with Dir(self.distgit_dir):
+        with Dir(self.distgit_dir), tracing.span("distgit_push"):
             self.logger.info("Pushing repository")
             exectools.cmd_assert(["rhpkg", "push"], retries=3)
             # rhpkg will create but not push tags :(
@@ -797,7 +900,7 @@ class ImageDistGitRepo(DistGitRepo):
 
                 new_val = []
                 for c in cmds:
-                    split = list(bashlex.split(c))
+                    split = shellfrag.split(c)
                     if split and split[0] == 'yum':
                         res = []
                         i = 0
@@ -835,7 +938,15 @@ class ImageDistGitRepo(DistGitRepo):
 
         dfp.lines = new_lines
 
-    def update_distgit_dir(self, version, release):
+    def update_distgit_dir(self, version, release, apply_modifications=False):
+        """
+        Applies the image metadata (labels, FROM, version/release...) to the Dockerfile in
+        the distgit directory. The Dockerfile is read once, transformed in memory, and
+        written back once.
+        :param apply_modifications: Whether content.source.modifications should be applied
+            to the Dockerfile before anything else (i.e. it was just copied from source).
+        :return: Returns the (version, release) the Dockerfile was set to.
+        """
         ignore_missing_base = self.runtime.ignore_missing_base
         # A collection of comment lines that will be included in the generated Dockerfile. They
         # will be prefix by the OIT_COMMENT_PREFIX and followed by newlines in the Dockerfile.
@@ -863,14 +974,19 @@ class ImageDistGitRepo(DistGitRepo):
                     ""])
 
         with Dir(self.distgit_dir):
+            dockerfile_path = os.path.join(self.distgit_dir, "Dockerfile")
+
             # Source or not, we should find a Dockerfile in the root at this point or something is wrong
-            assertion.isfile("Dockerfile", "Unable to find Dockerfile in distgit root")
+            assertion.isfile(dockerfile_path, "Unable to find Dockerfile in distgit root")
 
-            self._generate_repo_conf()
+            dfp = DockerfileTransform.load(dockerfile_path)
+
+            if apply_modifications and self.config.content.source.modifications is not Missing:
+                self._run_modifications(dfp)
 
-            self._manage_container_config()
+            self._generate_repo_conf()
 
-            dfp = DockerfileParser(path="Dockerfile")
+            self._manage_container_config(dfp.dfp)
 
             self.__clean_repos(dfp)
 
@@ -882,7 +998,7 @@ class ImageDistGitRepo(DistGitRepo):
 
             uuid_tag = "%s.%s" % (version, self.runtime.uuid)
 
-            with open('additional-tags', 'w') as at:
+            with open(os.path.join(self.distgit_dir, 'additional-tags'), 'w') as at:
                 at.write("%s\n" % uuid_tag)  # The uuid which we ensure we get the right FROM tag
                 # at.write("%s\n" % version)  # Removed for https://projects.engineering.redhat.com/browse/OSBS-5638?focusedCommentId=837662&page=com.atlassian.jira.plugin.system.issuetabpanels:comment-tabpanel#comment-837662
                 vsplit = version.split(".")
@@ -994,6 +1110,22 @@ class ImageDistGitRepo(DistGitRepo):
                 if deprecated in dfp.labels:
                     del dfp.labels[deprecated]
 
+            sha_label = 'io.openshift.source-repo-commit'
+            source_label = 'io.openshift.source-repo-url'
+            source_commit_label = 'io.openshift.source-commit-url'
+
+            # just always delete so it's either correct or not available
+            for label in (sha_label, source_label, source_commit_label):
+                if label in dfp.labels:
+                    del dfp.labels[label]
+
+            if self.full_source_sha:
+                dfp.labels[sha_label] = self.full_source_sha
+            if self.source_url:
+                dfp.labels[source_label] = self.source_url
+                if self.full_source_sha:
+                    dfp.labels[source_commit_label] = '{}/commit/{}'.format(self.source_url, self.full_source_sha)
+
             # Remove any programmatic oit comments from previous management
             df_lines = dfp.content.splitlines(False)
             df_lines = [line for line in df_lines if not line.strip().startswith(OIT_COMMENT_PREFIX)]
@@ -1024,76 +1156,28 @@ class ImageDistGitRepo(DistGitRepo):
 
             df_content = "\n".join(df_lines)
 
-            with open('Dockerfile', 'w') as df:
-                for comment in oit_comments:
-                    df.write("%s %s\n" % (OIT_COMMENT_PREFIX, comment))
-                df.write(df_content)
-
-            sha_label = 'io.openshift.source-repo-commit'
-            source_label = 'io.openshift.source-repo-url'
-            source_commit_label = 'io.openshift.source-commit-url'
-
-            # just always delete so it's either correct or not available
-            for label in (sha_label, source_label, source_commit_label):
-                if label in dfp.labels:
-                    del dfp.labels[label]
-
-            if self.full_source_sha:
-                dfp.labels[sha_label] = self.full_source_sha
-            if self.source_url:
-                dfp.labels[source_label] = self.source_url
-                if self.full_source_sha:
-                    dfp.labels[source_commit_label] = '{}/commit/{}'.format(self.source_url, self.full_source_sha)
-
-            self._reflow_labels()
+            # Labels are appended to the content in a single statement when the Dockerfile
+            # is saved, so replacing the content does not undo the label edits above.
+            dfp.content = "".join("%s %s\n" % (OIT_COMMENT_PREFIX, comment) for comment in oit_comments) + df_content
+            dfp.save(dockerfile_path)
 
             return (version, release)
 
-    def _reflow_labels(self, filename="Dockerfile"):
-        """
-        The Dockerfile parser we are presently using writes all labels on a single line
-        and occasionally make multiple LABEL statements. Calling this method with a
-        Dockerfile in the current working directory will rewrite the file with
-        labels at the end in a single statement.
-        """
-
-        dfp = DockerfileParser(path=filename)
-        labels = dict(dfp.labels)  # Make a copy of the labels we need to add back
-
-        # Delete any labels from the modeled content
-        for key in dfp.labels:
-            del dfp.labels[key]
-
-        # Capture content without labels
-        df_content = dfp.content.strip()
-
-        # Write the file back out and append the labels to the end
-        with open(filename, 'w') as df:
-            df.write("%s\n\n" % df_content)
-            if labels:
-                df.write("LABEL")
-                for k, v in labels.iteritems():
-                    df.write(" \\\n")  # All but the last line should have line extension backslash "\"
-                    escaped_v = v.replace('"', '\\"')  # Escape any " with \"
-                    df.write("        %s=\"%s\"" % (k, escaped_v))
-                df.write("\n\n")
-
     def _merge_source(self):
         """
         Pulls source defined in content.source and overwrites most things in the distgit
         clone with content from that source.
         """
 
-        with Dir(self.source_path()):
-            # gather source repo short sha for audit trail
-            rc, out, err = exectools.cmd_gather(["git", "rev-parse", "--short", "HEAD"])
-            self.source_sha = out.strip()
-            rc, out, err = exectools.cmd_gather(["git", "rev-parse", "HEAD"])
-            self.full_source_sha = out.strip()
+        # Source repos are shared by many images; these are answered without forking git
+        source_repo = gitquery.get_repo(self.source_path())
+
+        # gather source repo short sha for audit trail
+        self.source_sha = source_repo.short_sha()
+        self.full_source_sha = source_repo.head_sha()
 
-            rc, out, err = exectools.cmd_gather(["git", "remote", "get-url", "origin"])
-            out = out.strip()
-            self.source_url = out.replace(':', '/').replace('.git', '').replace('git@', 'https://')
+        out = source_repo.config("remote.origin.url") or ""
+        self.source_url = out.replace(':', '/').replace('.git', '').replace('git@', 'https://')
 
         # See if the config is telling us a file other than "Dockerfile" defines the
         # distgit image content.
@@ -1105,39 +1189,32 @@ class ImageDistGitRepo(DistGitRepo):
         # The path to the source Dockerfile we are reconciling against
         source_dockerfile_path = os.path.join(self.source_path(), dockerfile_name)
 
-        # Clean up any files not special to the distgit repo
-        for ent in os.listdir("."):
-
-            # Do not delete anything that is hidden
-            # protects .oit, .gitignore, others
-            if ent.startswith("."):
-                continue
-
-            # Skip special files that aren't hidden
-            if ent in ["additional-tags"]:
-                continue
-
-            # Otherwise, clean up the entry
-            if os.path.isfile(ent):
-                os.remove(ent)
-            else:
-                shutil.rmtree(ent)
-
-        # Copy all files and overwrite where necessary
-        recursive_overwrite(self.source_path(), self.distgit_dir)
-
-        if dockerfile_name != "Dockerfile":
-            # Does a non-distgit Dockerfile already exist from copying source; remove if so
-            if os.path.isfile("Dockerfile"):
-                os.remove("Dockerfile")
-
-            # Rename our distgit source Dockerfile appropriately
-            os.rename(dockerfile_name, "Dockerfile")
-
-        # Clean up any extraneous Dockerfile.* that might be distractions (e.g. Dockerfile.centos)
-        for ent in os.listdir("."):
-            if ent.startswith("Dockerfile."):
-                os.remove(ent)
+        distgit_dockerfile_path = os.path.join(self.distgit_dir, "Dockerfile")
+
+        def keep(rel):
+            # Leave distgit-only entries alone if they are hidden (protects
+            # .git, .oit, .gitignore, others) or special files that aren't hidden
+            top = rel.split(os.sep)[0]
+            return top.startswith(".") or top in ["additional-tags"]
+
+        def exclude(rel):
+            # Clean up any extraneous Dockerfile.* that might be distractions (e.g. Dockerfile.centos)
+            return os.sep not in rel and rel.startswith("Dockerfile.")
+
+        # Make the distgit content match the source, rewriting only the files which differ
+        renames = {dockerfile_name: "Dockerfile"} if dockerfile_name != "Dockerfile" else {}
+        start = time.time()
+        stats = filesync.sync_tree(self.source_path(), self.distgit_dir, renames=renames,
+                                   exclude_f=exclude, keep_f=keep)
+        self.logger.info("Synced source into distgit: {}".format(stats))
+        self.runtime.add_record("source_sync",
+                                distgit=self.metadata.qualified_name,
+                                image=self.config.name,
+                                files_copied=stats.files_copied,
+                                bytes_copied=stats.bytes_copied,
+                                files_unchanged=stats.files_unchanged,
+                                entries_deleted=stats.entries_deleted,
+                                seconds="{:.3f}".format(time.time() - start))
 
         notify_owner = False
 
@@ -1154,10 +1231,11 @@ class ImageDistGitRepo(DistGitRepo):
 
         source_dockerfile_hash = hashlib.sha256(open(source_dockerfile_path, 'rb').read()).hexdigest()
 
-        if not os.path.isdir(".oit/reconciled"):
-            os.mkdir(".oit/reconciled")
+        reconciled_dir = os.path.join(self.distgit_dir, ".oit", "reconciled")
+        if not os.path.isdir(reconciled_dir):
+            os.mkdir(reconciled_dir)
 
-        dockerfile_already_reconciled_path = '.oit/reconciled/{}.Dockerfile'.format(source_dockerfile_hash)
+        dockerfile_already_reconciled_path = os.path.join(reconciled_dir, '{}.Dockerfile'.format(source_dockerfile_hash))
 
         # If the file does not exist, the source file has not been reconciled before.
         if not os.path.isfile(dockerfile_already_reconciled_path):
@@ -1169,20 +1247,23 @@ class ImageDistGitRepo(DistGitRepo):
         # Leave a record for external processes that owners will need to notified.
 
         if notify_owner:
-            with Dir(self.source_path()):
-                author_email = None
-                err = None
-                rc, sha, err = exectools.cmd_gather('git log -n 1 --pretty=format:%H {}'.format(dockerfile_name))
-                if rc == 0:
-                    rc, ae, err = exectools.cmd_gather('git show -s --pretty=format:%ae {}'.format(sha))
-                    if rc == 0:
-                        if ae.lower().endswith('@redhat.com'):
-                            self.logger.info('Last Dockerfile commiter: {}'.format(ae))
-                            author_email = ae
-                        else:
-                            err = 'Last commiter email found, but is not @redhat.com address: {}'.format(ae)
-                if err:
-                    self.logger.info('Unable to get author email for last {} commit: {}'.format(dockerfile_name, err))
+            author_email = None
+            err = None
+            try:
+                sha = source_repo.last_commit(source_dockerfile_path)
+                if sha is None:
+                    err = 'No commits found'
+                else:
+                    ae = source_repo.author_email(sha)
+                    if ae.lower().endswith('@redhat.com'):
+                        self.logger.info('Last Dockerfile commiter: {}'.format(ae))
+                        author_email = ae
+                    else:
+                        err = 'Last commiter email found, but is not @redhat.com address: {}'.format(ae)
+            except IOError as e:
+                err = str(e)
+            if err:
+                self.logger.info('Unable to get author email for last {} commit: {}'.format(dockerfile_name, err))
 
             owners = []
             if self.config.owners is not Missing and isinstance(self.config.owners, list):
@@ -1195,17 +1276,17 @@ class ImageDistGitRepo(DistGitRepo):
             else:
                 source_dockerfile_subpath = "{}/{}".format(sub_path, dockerfile_name)
             self.runtime.add_record("dockerfile_notify", distgit=self.metadata.qualified_name, image=self.config.name,
-                                    dockerfile=os.path.abspath("Dockerfile"), owners=','.join(owners),
+                                    dockerfile=distgit_dockerfile_path, owners=','.join(owners),
                                     source_alias=self.config.content.source.get('alias', None),
                                     source_dockerfile_subpath=source_dockerfile_subpath)
 
-    def _run_modifications(self):
+    def _run_modifications(self, dfp):
         """
         Interprets and applies content.source.modify steps in the image metadata.
+        :param dfp: The DockerfileTransform to modify
         """
 
-        with open("Dockerfile", 'r') as df:
-            dockerfile_data = df.read()
+        dockerfile_data = dfp.content
 
         self.logger.debug(
             "About to start modifying Dockerfile [%s]:\n%s\n" %
@@ -1230,33 +1311,91 @@ class ImageDistGitRepo(DistGitRepo):
             else:
                 raise IOError("Don't know how to perform modification action: %s" % modification.action)
 
-        with open('Dockerfile', 'w') as df:
-            df.write(dockerfile_data)
+        dfp.content = dockerfile_data
+
+    def rebase_inputs(self, version, release):
+        """
+        :return: Everything the result of rebase_dir(version, release) depends on,
+                 other than the distgit's own content (see checkpoint.py)
+        """
+        inputs = dict(version=version, release=release, uuid=self.runtime.uuid, config=self.config,
+                      group=self.runtime.group_config, streams=self.runtime.streams,
+                      stream_overrides=self.runtime.stream_alias_overrides,
+                      latest_parent_version=self.runtime.latest_parent_version)
+
+        # Parents which are not being built are looked up in brew (see update_distgit_dir)
+        parents = {}
+        for base in self.metadata.parent_members():
+            if self.runtime.resolve_image(base, False) is not None:
+                parents[base] = "included"
+            elif self.runtime.ignore_missing_base and self.runtime.latest_parent_version:
+                _, v, r = self.runtime.late_resolve_image(base).get_latest_build_info()
+                parents[base] = "{}-{}".format(v, r)
+            else:
+                parents[base] = None
+        inputs["parents"] = parents
+
+        if self.config.content.source is not Missing:
+            inputs["source"] = gitquery.get_repo(self.source_path()).head_sha()
+        return inputs
 
     def rebase_dir(self, version, release):
+        with tracing.track(self.metadata.distgit_key), tracing.span("rebase", version=version, release=release):
+            return self._rebase_dir(version, release)
+
+    def rebase_and_commit(self, version, release, message):
+        """
+        Rebases the distgit, commits and tags the result unless the checkpoints show a
+        previous run already did so from the same inputs.
+        :return: The sha of the commit made, or None if the distgit was already committed
+        """
+        key = self.metadata.distgit_key
+        checkpoints = self.runtime.checkpoints
+        inputs = dict(self.rebase_inputs(version, release), message=message)
+        head = self.head_sha()
+
+        committed = checkpoints.completed(key, "committed", inputs)
+        if committed is not None and committed["sha"] == head:
+            return None
+
+        # The rebase of an interrupted run may not have been committed yet
+        rebase_inputs = dict(inputs, distgit=head)
+        rebased = checkpoints.completed(key, "rebased", rebase_inputs)
+        if rebased is not None:
+            (real_version, real_release) = (rebased["version"], rebased["release"])
+            self.source_sha = rebased["source_sha"]
+        else:
+            (real_version, real_release) = self.rebase_dir(version, release)
+            checkpoints.record(key, "rebased", rebase_inputs,
+                               version=real_version, release=real_release, source_sha=self.source_sha)
+
+        sha = self.commit(message, log_diff=True)
+        self.tag(real_version, real_release)
+        checkpoints.record(key, "committed", inputs, sha=sha)
+        return sha
+
+    def _rebase_dir(self, version, release):
 
         with Dir(self.distgit_dir):
 
+            dockerfile_path = os.path.join(self.distgit_dir, "Dockerfile")
+
             if version is None:
                 # Extract the current version in order to preserve it
-                dfp = DockerfileParser("Dockerfile")
+                dfp = dockerfile_parse.DockerfileParser(dockerfile_path)
                 version = dfp.labels["version"]
 
             # Make our metadata directory if it does not exist
-            if not os.path.isdir(".oit"):
-                os.mkdir(".oit")
+            oit_dir = os.path.join(self.distgit_dir, ".oit")
+            if not os.path.isdir(oit_dir):
+                os.mkdir(oit_dir)
 
             # If content.source is defined, pull in content from local source directory
             if self.config.content.source is not Missing:
                 self._merge_source()
 
-            # Source or not, we should find a Dockerfile in the root at this point or something is wrong
-            assertion.isfile("Dockerfile", "Unable to find Dockerfile in distgit root")
-
-            if self.config.content.source.modifications is not Missing:
-                self._run_modifications()
-
-        (real_version, real_release) = self.update_distgit_dir(version, release)
+        # Modifications are applied by update_distgit_dir so that the Dockerfile is only rewritten once
+        (real_version, real_release) = self.update_distgit_dir(version, release, apply_modifications=True)
 
         return (real_version, real_release)
 
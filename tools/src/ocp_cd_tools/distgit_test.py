@@ -6,8 +6,21 @@ import unittest
 
 import StringIO
 import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from multiprocessing.dummy import Pool
+
+import mock
 
 import distgit
+from checkpoint import Checkpoints, input_hash
+from dockerfile import DockerfileTransform
+from model import Model
+from repos import Repos
+from pushd import Dir
 
 class MockDistgit(object):
     def __init__(self):
@@ -24,6 +37,7 @@ class MockRuntime(object):
         self.branch = None
         self.distgits_dir = "distgits_dir"
         self.logger = logger
+        self.checkpoints = Checkpoints()
         
 class MockMetadata(object):
 
@@ -79,6 +93,338 @@ class TestDistgit(unittest.TestCase):
         self.assertEquals(actual, expected)
 
     
+    def test_concurrent_rebase_file_ops(self):
+        """
+        Ensure that many images rebased at once from the same source each modify only
+        their own distgit and never change the working directory of the process
+        """
+        test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-distgit")
+        self.addCleanup(shutil.rmtree, test_dir)
+        cwd = os.getcwd()
+
+        source = os.path.join(test_dir, "source")
+        os.makedirs(os.path.join(source, "scripts"))
+        with open(os.path.join(source, "Dockerfile"), "w") as df:
+            df.write('FROM base\nLABEL name="@ID@" io.openshift.id="@ID@" version="v1"\nRUN /scripts/run.sh\n')
+        with open(os.path.join(source, "scripts", "run.sh"), "w") as f:
+            f.write("echo @ID@\n")
+        subprocess.check_output(["git", "init", "-q", source])
+        subprocess.check_output(["git", "add", "-A"], cwd=source)
+        subprocess.check_output(["git", "-c", "user.name=x", "-c", "user.email=x@redhat.com",
+                                 "commit", "-q", "-m", "source"], cwd=source)
+
+        runtime = MockRuntime(self.logger)
+        runtime.uuid = "20190101.000000"
+        runtime.ignore_missing_base = False
+        runtime.no_oit_comment = False
+        runtime.odcs_mode = False
+        runtime.arches = ["x86_64"]
+        runtime.group_config = Model({})
+        runtime.repos = Repos({"rhel-server-rpms": {
+            "conf": {"baseurl": "http://example.com/rhel"},
+            "content_set": {"default": "rhel-7-server-rpms"},
+        }}, ["x86_64"])
+        runtime.resolve_source_path = lambda alias, path: source
+        runtime.add_record = lambda record_type, **kwargs: None
+
+        def rebase(i):
+            md = MockMetadata(runtime)
+            md.name = md.distgit_key = "image-{}".format(i)
+            md.qualified_name = "containers/" + md.name
+            md.get_component_name = lambda: md.name + "-container"
+            md.config_filename = md.name + ".yml"
+            md.logger = self.logger
+            md.config = Model({
+                "name": "openshift3/" + md.name,
+                "content": {"source": {"alias": "ose", "modifications": [
+                    {"action": "replace", "match": "@ID@", "replacement": str(i)},
+                ]}},
+            })
+            d = distgit.ImageDistGitRepo.__new__(distgit.ImageDistGitRepo)
+            distgit.DistGitRepo.__init__(d, md, autoclone=False)
+            d.distgit_dir = os.path.join(test_dir, md.distgit_key)
+            os.mkdir(d.distgit_dir)
+
+            version, release = d.rebase_dir("v3.11.0", "1")
+            self.assertEqual((version, release), ("v3.11.0", "1"))
+            self.assertEqual(os.getcwd(), cwd)
+
+            with open(os.path.join(d.distgit_dir, "Dockerfile")) as df:
+                return df.read()
+
+        pool = Pool(50)
+        results = pool.map(rebase, range(50))
+        pool.close()
+        pool.join()
+
+        self.assertEqual(os.getcwd(), cwd)
+        for i, content in enumerate(results):
+            self.assertIn('name="openshift3/image-{}"'.format(i), content)
+            self.assertIn('com.redhat.component="image-{}-container"'.format(i), content)
+            self.assertIn('io.openshift.id="{}"'.format(i), content)
+            self.assertNotIn("@ID@", content)
+            with open(os.path.join(test_dir, "image-{}".format(i), "scripts", "run.sh")) as f:
+                self.assertEqual(f.read(), "echo @ID@\n")
+            self.assertTrue(os.path.isfile(os.path.join(test_dir, "image-{}".format(i), ".oit", "signed.repo")))
+        # The source is only read
+        with open(os.path.join(source, "Dockerfile")) as df:
+            self.assertIn("@ID@", df.read())
+
+    def test_fast_clone(self):
+        """
+        A fast clone fetches only the working branch, shallowly, and can fetch the rest on demand
+        """
+        test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-distgit")
+        self.addCleanup(shutil.rmtree, test_dir)
+        upstream = os.path.join(test_dir, "upstream")
+        os.mkdir(upstream)
+
+        def git(cwd, *args):
+            return subprocess.check_output(["git", "-c", "user.name=x", "-c", "user.email=x@redhat.com"] + list(args),
+                                           cwd=cwd).strip()
+
+        git(upstream, "init", "-q")
+        for i in range(3):
+            git(upstream, "commit", "-q", "--allow-empty", "-m", str(i))
+        git(upstream, "branch", "rhaos-3.11-rhel-7")
+
+        records = []
+        rt = MockRuntime(self.logger)
+        rt.fast_clone = True
+        rt.clone_depth = 1
+        rt.user = None
+        rt.add_record = lambda record_type, **kwargs: records.append((record_type, kwargs))
+        md = MockMetadata(rt)
+        md.logger = self.logger
+        md.qualified_name = "containers/test"
+        md.distgit_key = "test"
+        d = distgit.ImageDistGitRepo.__new__(distgit.ImageDistGitRepo)
+        distgit.DistGitRepo.__init__(d, md, autoclone=False)
+
+        with mock.patch.object(distgit.DistGitRepo, "_distgit_url", return_value="file://" + upstream), \
+                mock.patch.object(distgit.ImageDistGitRepo, "_read_master_data"):
+            d.clone(test_dir, "rhaos-3.11-rhel-7")
+
+        self.assertEqual(git(d.distgit_dir, "rev-parse", "--abbrev-ref", "HEAD"), "rhaos-3.11-rhel-7")
+        self.assertEqual(git(d.distgit_dir, "rev-list", "--count", "HEAD"), "1")
+        self.assertEqual(git(d.distgit_dir, "branch", "-r"), "origin/rhaos-3.11-rhel-7")
+        self.assertEqual(records[0][0], "distgit_clone")
+        self.assertEqual(records[0][1]["method"], "fast")
+        self.assertGreater(records[0][1]["bytes"], 0)
+
+        d.fetch_history("master")
+        self.assertEqual(git(d.distgit_dir, "rev-list", "--count", "HEAD"), "3")
+        self.assertIn("origin/master", git(d.distgit_dir, "branch", "-r"))
+
+    def test_resume_clone(self):
+        """
+        Resuming keeps distgit directories the journal does not know of unless they hold no commit
+        """
+        test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-distgit")
+        self.addCleanup(shutil.rmtree, test_dir)
+        upstream = os.path.join(test_dir, "upstream")
+        os.mkdir(upstream)
+
+        def git(cwd, *args):
+            return subprocess.check_output(["git", "-c", "user.name=x", "-c", "user.email=x@redhat.com"] + list(args),
+                                           cwd=cwd).strip()
+
+        git(upstream, "init", "-q")
+        git(upstream, "commit", "-q", "--allow-empty", "-m", "upstream")
+        git(upstream, "branch", "rhaos-3.11-rhel-7")
+
+        rt = MockRuntime(self.logger)
+        rt.checkpoints = Checkpoints(os.path.join(test_dir, "checkpoints.jsonl"), resume=True)
+        rt.fast_clone = True
+        rt.clone_depth = 1
+        rt.user = None
+        rt.add_record = lambda record_type, **kwargs: None
+        md = MockMetadata(rt)
+        md.logger = self.logger
+        md.qualified_name = "containers/test"
+        md.distgit_key = "test"
+        distgit_dir = os.path.join(test_dir, "namespace", "test")
+
+        def clone():
+            d = distgit.ImageDistGitRepo.__new__(distgit.ImageDistGitRepo)
+            distgit.DistGitRepo.__init__(d, md, autoclone=False)
+            with mock.patch.object(distgit.DistGitRepo, "_distgit_url", return_value="file://" + upstream), \
+                    mock.patch.object(distgit.ImageDistGitRepo, "_read_master_data"):
+                d.clone(test_dir, "rhaos-3.11-rhel-7")
+
+        # A clone with local work made before checkpoints were kept
+        os.makedirs(distgit_dir)
+        git(distgit_dir, "init", "-q")
+        git(distgit_dir, "checkout", "-q", "-b", "rhaos-3.11-rhel-7")
+        git(distgit_dir, "commit", "-q", "--allow-empty", "-m", "local")
+        with open(os.path.join(distgit_dir, "Dockerfile"), "w") as f:
+            f.write("FROM base\n")
+        clone()
+        self.assertTrue(os.path.isfile(os.path.join(distgit_dir, "Dockerfile")))
+        self.assertEqual(git(distgit_dir, "log", "--pretty=format:%s"), "local")
+
+        # A clone interrupted before anything was checked out
+        rt.checkpoints = Checkpoints(os.path.join(test_dir, "checkpoints2.jsonl"), resume=True)
+        shutil.rmtree(distgit_dir)
+        os.makedirs(distgit_dir)
+        git(distgit_dir, "init", "-q")
+        clone()
+        self.assertEqual(git(distgit_dir, "log", "--pretty=format:%s"), "upstream")
+
+        # Not a clone at all
+        rt.checkpoints = Checkpoints(os.path.join(test_dir, "checkpoints3.jsonl"), resume=True)
+        shutil.rmtree(distgit_dir)
+        os.makedirs(distgit_dir)
+        with open(os.path.join(distgit_dir, "Dockerfile"), "w") as f:
+            f.write("FROM base\n")
+        with self.assertRaises(IOError):
+            clone()
+        self.assertTrue(os.path.isfile(os.path.join(distgit_dir, "Dockerfile")))
+
+    def test_rebase_inputs_parents(self):
+        """
+        The brew builds a rebase takes parents which are not being built from are part of its inputs
+        """
+        rt = MockRuntime(self.logger)
+        rt.uuid = "20190101.000000"
+        rt.group_config = Model({})
+        rt.streams = {}
+        rt.stream_alias_overrides = {}
+        rt.ignore_missing_base = True
+        rt.latest_parent_version = True
+        rt.resolve_image = lambda name, required: object() if name == "ose-base" else None
+        parent = mock.Mock()
+        parent.get_latest_build_info.return_value = ("ose-cli-container", "v3.11.1", "2")
+        rt.late_resolve_image = lambda name: parent
+        md = MockMetadata(rt)
+        md.config = Model({"name": "openshift3/ose"})
+        md.parent_members = lambda: ["ose-base", "ose-cli"]
+        md.logger = self.logger
+        d = distgit.ImageDistGitRepo.__new__(distgit.ImageDistGitRepo)
+        distgit.DistGitRepo.__init__(d, md, autoclone=False)
+
+        inputs = d.rebase_inputs("v3.11.0", "1")
+        self.assertTrue(inputs["latest_parent_version"])
+        self.assertEqual(inputs["parents"], {"ose-base": "included", "ose-cli": "v3.11.1-2"})
+
+        # A new parent build means the image must be rebased again
+        parent.get_latest_build_info.return_value = ("ose-cli-container", "v3.11.1", "3")
+        self.assertNotEqual(input_hash(d.rebase_inputs("v3.11.0", "1")), input_hash(inputs))
+
+        rt.latest_parent_version = False
+        self.assertEqual(d.rebase_inputs("v3.11.0", "1")["parents"], {"ose-base": "included", "ose-cli": None})
+
+    def resumed_image_dgr(self, seed):
+        """
+        :param seed: A function recording the phases a previous run completed in the Checkpoints passed to it
+        :return: An ImageDistGitRepo whose runtime resumes from the phases seeded
+        """
+        test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-distgit")
+        self.addCleanup(shutil.rmtree, test_dir)
+        path = os.path.join(test_dir, "checkpoints.jsonl")
+        seed(Checkpoints(path))
+
+        rt = MockRuntime(self.logger)
+        rt.checkpoints = Checkpoints(path, resume=True)
+        rt.mutex = threading.Lock()
+        rt.records = []
+        rt.add_record = lambda record_type, **kwargs: rt.records.append((record_type, kwargs))
+        md = MockMetadata(rt)
+        md.config = Model({"name": "openshift3/ose"})
+        md.logger = self.logger
+        md.tag_exists = mock.Mock(return_value=False)
+        md.get_latest_build_info = mock.Mock(return_value=("ose-container", "v3.11.0", "2"))
+        d = distgit.ImageDistGitRepo.__new__(distgit.ImageDistGitRepo)
+        distgit.DistGitRepo.__init__(d, md, autoclone=False)
+        d.build_lock = threading.Lock()
+        d.build_lock.acquire()
+        d.org_image_name, d.org_version, d.org_release = "openshift3/ose", "v3.11.0", "2"
+
+        for name in ["rebase_dir", "commit", "tag", "push_image", "_build_container"]:
+            patcher = mock.patch.object(d, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(d, "rebase_inputs", return_value={"version": "v3.11.0", "release": "1"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(d, "head_sha", return_value="abc")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return d
+
+    def test_rebase_resume_committed(self):
+        """
+        An image a previous run committed from the same inputs is not rebased again
+        """
+        inputs = {"version": "v3.11.0", "release": "1", "message": "rebase"}
+        d = self.resumed_image_dgr(lambda c: c.record("distgit_key", "committed", inputs, sha="abc"))
+
+        self.assertIsNone(d.rebase_and_commit("v3.11.0", "1", "rebase"))
+        d.rebase_dir.assert_not_called()
+        d.commit.assert_not_called()
+        d.tag.assert_not_called()
+
+        # Once the distgit has moved on, the image is rebased again
+        d.head_sha.return_value = "def"
+        d.rebase_dir.return_value = ("v3.11.0", "1")
+        d.commit.return_value = "ghi"
+        self.assertEqual(d.rebase_and_commit("v3.11.0", "1", "rebase"), "ghi")
+        d.rebase_dir.assert_called_once_with("v3.11.0", "1")
+
+    def test_rebase_resume_uncommitted(self):
+        """
+        A rebase an interrupted run did not commit is committed without rebasing again
+        """
+        inputs = {"version": "v3.11.0", "release": "1", "message": "rebase", "distgit": "abc"}
+        d = self.resumed_image_dgr(lambda c: c.record(
+            "distgit_key", "rebased", inputs, version="v3.11.0", release="1.p0", source_sha="0123"))
+        d.commit.return_value = "def"
+
+        self.assertEqual(d.rebase_and_commit("v3.11.0", "1", "rebase"), "def")
+        d.rebase_dir.assert_not_called()
+        d.commit.assert_called_once_with("rebase", log_diff=True)
+        d.tag.assert_called_once_with("v3.11.0", "1.p0")
+        self.assertEqual(d.source_sha, "0123")
+        committed = d.runtime.checkpoints.completed(
+            "distgit_key", "committed", {"version": "v3.11.0", "release": "1", "message": "rebase"})
+        self.assertEqual(committed, {"sha": "def"})
+
+    def test_build_resume(self):
+        """
+        An image a previous run built and mirrored is neither built nor pushed again
+        """
+        build_inputs = dict(image="openshift3/ose:v3.11.0-2", distgit="abc", odcs=False, repo_type="signed",
+                            repo=[], scratch=False)
+        mirror_inputs = dict(version="v3.11.0", release="2", push_to_defaults=True, registries=[])
+
+        def seed(c):
+            c.record("distgit_key", "built", build_inputs, version="v3.11.0", release="2")
+            c.record("distgit_key", "mirrored", mirror_inputs)
+
+        d = self.resumed_image_dgr(seed)
+        self.assertTrue(d.build_container(False, "signed", [], True, [], threading.Event()))
+        d.metadata.tag_exists.assert_not_called()
+        d._build_container.assert_not_called()
+        d.metadata.get_latest_build_info.assert_not_called()
+        d.push_image.assert_not_called()
+        self.assertEqual(d.runtime.records[0][1]["status"], 0)
+
+    def test_build_resume_unmirrored(self):
+        """
+        An image a previous run built but did not mirror is pushed without being built again
+        """
+        build_inputs = dict(image="openshift3/ose:v3.11.0-2", distgit="abc", odcs=False, repo_type="signed",
+                            repo=[], scratch=False)
+        d = self.resumed_image_dgr(lambda c: c.record(
+            "distgit_key", "built", build_inputs, version="v3.11.0", release="2"))
+
+        self.assertTrue(d.build_container(False, "signed", [], True, [], threading.Event()))
+        d._build_container.assert_not_called()
+        d.metadata.get_latest_build_info.assert_not_called()
+        d.push_image.assert_called_once_with([], True, [], version_release_tuple=("v3.11.0", "2"))
+        mirror_inputs = dict(version="v3.11.0", release="2", push_to_defaults=True, registries=[])
+        self.assertIsNotNone(d.runtime.checkpoints.completed("distgit_key", "mirrored", mirror_inputs))
+
     def test_pull_image_logging(self):
         """
         Ensure that pull_image logs properly
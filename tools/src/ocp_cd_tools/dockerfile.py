@@ -0,0 +1,112 @@
+"""
+In-memory Dockerfile transformations.
+
+DockerfileParser rewrites its file every time a label or parent image is
+assigned, and our distgit update used to parse and rewrite the Dockerfile
+several more times afterwards (modifications, repo cleanup, comment
+stripping, label reflow). A DockerfileTransform reads the Dockerfile once,
+applies every edit to an in-memory copy and writes the result once.
+
+Example:
+
+  df = DockerfileTransform.load(path)
+  df.content = df.content.replace("foo", "bar")
+  df.labels["version"] = "v3.10.0"
+  df.parent_images = ["openshift/ose-base:v3.10.0"]
+  df.save(path)
+"""
+
+import io
+
+from lazyimport import LazyModule
+
+dockerfile_parse = LazyModule("dockerfile_parse")
+
+
+class DockerfileTransform(object):
+
+    def __init__(self, content):
+        self.dfp = dockerfile_parse.DockerfileParser(fileobj=io.BytesIO())
+        self.dfp.content = content
+        self._labels = None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(f.read())
+
+    @property
+    def content(self):
+        """
+        :return: The Dockerfile content as it stands, without any label edits.
+        """
+        return self.dfp.content
+
+    @content.setter
+    def content(self, content):
+        self.dfp.content = content
+
+    @property
+    def labels(self):
+        """
+        A plain dict of the labels of the final build stage, read from the
+        content the first time it is accessed. Edits to it do not touch the
+        content; on serialize() the LABEL instructions of the final stage are
+        replaced by its contents. Any edit of the content which adds or changes
+        labels must therefore happen before the labels are first accessed.
+        """
+        if self._labels is None:
+            self._labels = dict(self.dfp.labels)
+        return self._labels
+
+    @property
+    def parent_images(self):
+        return self.dfp.parent_images
+
+    @parent_images.setter
+    def parent_images(self, parents):
+        self.dfp.parent_images = parents
+
+    @property
+    def structure(self):
+        return self.dfp.structure
+
+    @property
+    def lines(self):
+        return self.dfp.lines
+
+    @lines.setter
+    def lines(self, lines):
+        self.content = "".join(lines)
+
+    def serialize(self):
+        """
+        :return: The transformed Dockerfile with the LABEL instructions of the final
+        build stage removed and all of its labels appended in a single statement.
+        """
+        lines = self.dfp.lines
+
+        # Labels in earlier build stages do not apply to the image; leave them be.
+        final_stage_labels = []
+        for insn in self.dfp.structure:
+            if insn["instruction"] == "FROM":
+                final_stage_labels = []
+            elif insn["instruction"] == "LABEL":
+                final_stage_labels.append(insn)
+
+        for insn in reversed(final_stage_labels):
+            del lines[insn["startline"]:insn["endline"] + 1]
+
+        out = ["%s\n\n" % "".join(lines).strip()]
+        if self.labels:
+            out.append("LABEL")
+            for k, v in self.labels.iteritems():
+                out.append(" \\\n")  # All but the last line should have line extension backslash "\"
+                escaped_v = ("%s" % v).replace('"', '\\"')  # Escape any " with \"
+                out.append("        %s=\"%s\"" % (k, escaped_v))
+            out.append("\n\n")
+        return "".join(out)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            f.write(self.serialize())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Test the in-memory Dockerfile transformations
+"""
+
+import unittest
+
+import __builtin__
+import os
+import shutil
+import tempfile
+
+import mock
+from dockerfile_parse import DockerfileParser
+
+from dockerfile import DockerfileTransform
+
+DOCKERFILE = """FROM builder:1 AS build
+LABEL stage=builder
+RUN make
+FROM base:1
+ENV FOO=bar
+LABEL name="x" \\
+      version="v1" release="3" Architecture="x86_64"
+RUN yum install -y a && yum clean all
+LABEL io.k8s.description="some $FOO thing"
+CMD ["run"]
+"""
+
+
+def edit_labels(dfp):
+    dfp.labels["name"] = "newname"
+    dfp.labels["version"] = "v2"
+    del dfp.labels["Architecture"]
+    dfp.labels["extra"] = 'a "q"'
+    dfp.parent_images = ["builder:2", "base:2"]
+
+
+class DockerfileTransformTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-dockerfile")
+        self.path = os.path.join(self.test_dir, "Dockerfile")
+        with open(self.path, "w") as f:
+            f.write(DOCKERFILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_serialize(self):
+        """
+        Labels of the final stage are collected into a single trailing statement,
+        while labels of earlier build stages are left alone
+        """
+        df = DockerfileTransform.load(self.path)
+        self.assertEqual(df.labels["io.k8s.description"], "some bar thing")
+        edit_labels(df)
+        df.content = "#oit## comment\n" + df.content
+        out = df.serialize()
+
+        expected_body = """#oit## comment
+FROM builder:2 AS build
+LABEL stage=builder
+RUN make
+FROM base:2
+ENV FOO=bar
+RUN yum install -y a && yum clean all
+CMD ["run"]
+
+LABEL"""
+        self.assertTrue(out.startswith(expected_body))
+        self.assertEqual(out.count("LABEL"), 2)
+        for label in ['name="newname"', 'version="v2"', 'release="3"', 'extra="a \\"q\\""',
+                      'io.k8s.description="some bar thing"']:
+            self.assertIn(label, out)
+        self.assertNotIn("Architecture", out)
+
+        # Nothing is written to disk until the transform is saved
+        with open(self.path) as f:
+            self.assertEqual(f.read(), DOCKERFILE)
+        df.save(self.path)
+        with open(self.path) as f:
+            self.assertEqual(f.read(), out)
+
+    def count_io(self, f):
+        """
+        :return: (files opened, DockerfileParsers created, Dockerfile parses) while running f()
+        """
+        real_open = __builtin__.open
+        real_init = DockerfileParser.__init__
+        real_structure = DockerfileParser.structure
+        parses = [0]
+
+        def structure(dfp):
+            parses[0] += 1
+            return real_structure.fget(dfp)
+
+        with mock.patch("__builtin__.open", side_effect=real_open) as opens, \
+                mock.patch.object(DockerfileParser, "__init__", autospec=True, side_effect=real_init) as inits, \
+                mock.patch.object(DockerfileParser, "structure", property(structure)):
+            f()
+        return opens.call_count, inits.call_count, parses[0]
+
+    def test_file_io(self):
+        """
+        A transform reads the Dockerfile once, writes it once and parses it far less
+        often than the parse-and-rewrite sequence update_distgit_dir used to run
+        """
+        def legacy():
+            # _run_modifications
+            with open(self.path) as f:
+                content = f.read()
+            with open(self.path, "w") as f:
+                f.write(content.replace("make", "make all"))
+            # update_distgit_dir: edits through a parser backed by the file
+            dfp = DockerfileParser(path=self.path)
+            edit_labels(dfp)
+            content = dfp.content
+            with open(self.path, "w") as f:
+                f.write("#oit## comment\n" + content)
+            for label in ("io.openshift.source-repo-commit", "io.openshift.source-repo-url"):
+                if label in dfp.labels:
+                    del dfp.labels[label]
+            dfp.labels["io.openshift.source-repo-commit"] = "abc"
+            # _reflow_labels
+            dfp = DockerfileParser(path=self.path)
+            labels = dict(dfp.labels)
+            for key in labels:
+                del dfp.labels[key]
+            with open(self.path, "w") as f:
+                f.write(dfp.content.strip() + "\n\nLABEL " + " ".join('{}="{}"'.format(*kv) for kv in labels.items()))
+
+        def transform():
+            df = DockerfileTransform.load(self.path)
+            df.content = df.content.replace("make", "make all")
+            edit_labels(df)
+            df.content = "#oit## comment\n" + df.content
+            for label in ("io.openshift.source-repo-commit", "io.openshift.source-repo-url"):
+                df.labels.pop(label, None)
+            df.labels["io.openshift.source-repo-commit"] = "abc"
+            df.save(self.path)
+
+        legacy_opens, legacy_parsers, legacy_parses = self.count_io(legacy)
+        with open(self.path, "w") as f:
+            f.write(DOCKERFILE)
+        opens, parsers, parses = self.count_io(transform)
+
+        self.assertEqual(opens, 2)  # read once, write once
+        self.assertEqual(parsers, 1)
+        self.assertGreater(legacy_opens, 10 * opens)
+        self.assertGreater(legacy_parses, 5 * parses)
+        self.assertGreater(legacy_parsers, parsers)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -15,9 +15,9 @@ import json
 import constants
 import brew
 import exceptions
+from lazyimport import HTTPKerberosAuth
 
 import requests
-from requests_kerberos import HTTPKerberosAuth
 
 
 def get_erratum(id):
@@ -0,0 +1,176 @@
+"""
+Incremental synchronization of a directory tree into another.
+
+Rebasing a distgit repo used to delete its content and copy the whole
+source tree back in. That rewrites every file on every rebase, which costs
+I/O and defeats git's stat cache. sync_tree() makes the destination match
+the source by touching only what differs. Files whose size and mtime match
+are assumed unchanged, as rsync does. Files whose size matches but mtime
+does not are compared by hash. Changed files are copied with a reflink
+(copy-on-write clone) when the filesystem supports it.
+
+Hardlinks are deliberately not used: distgit files are rewritten in place
+after the sync (e.g. the Dockerfile), which would silently modify the
+shared source checkout through the link.
+"""
+
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import stat
+
+# ioctl request number of FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+
+class SyncStats(object):
+
+    def __init__(self):
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.files_unchanged = 0
+        self.entries_deleted = 0
+
+    def __str__(self):
+        return "{} files copied ({} bytes), {} unchanged, {} entries deleted".format(
+            self.files_copied, self.bytes_copied, self.files_unchanged, self.entries_deleted)
+
+
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _same_file(src, dest, src_st):
+    """
+    :return: True if dest already holds the same content as src
+    """
+    try:
+        dest_st = os.lstat(dest)
+    except OSError:
+        return False
+    if not stat.S_ISREG(dest_st.st_mode) or dest_st.st_size != src_st.st_size:
+        return False
+    if int(dest_st.st_mtime) == int(src_st.st_mtime):
+        return True
+    return _file_hash(src) == _file_hash(dest)
+
+
+def copy_file(src, dest):
+    """
+    Copies a file's content and metadata, cloning the data blocks instead of
+    copying them if the filesystem supports reflinks.
+    """
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        try:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+        except IOError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.EBADF):
+                raise
+            shutil.copyfileobj(fsrc, fdest, 1024 * 1024)
+    shutil.copystat(src, dest)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def sync_tree(src, dest, renames=None, exclude_f=None, keep_f=None):
+    """
+    Makes the content of dest match src.
+    :param src: The directory to copy from. .git directories are never copied.
+    :param dest: The directory to copy into.
+    :param renames: A dict of src relative path -> dest relative path for files which must
+        land under a different name.
+    :param exclude_f: f(dest relative path) -> True for entries which must not be copied
+        (and are deleted from dest if present).
+    :param keep_f: f(dest relative path) -> True for entries of dest which are not in src but
+        must be left alone (along with everything beneath them).
+    :return: A SyncStats describing the work done.
+    """
+    renames = renames or {}
+    # A file renamed onto the path of another source file takes its place
+    shadowed = set(renames.values()) - set(renames.keys())
+    stats = SyncStats()
+
+    # Map of dest relative path -> src path, for every directory, file and symlink wanted in dest
+    wanted = {}
+    for root, dirs, files in os.walk(src):
+        if ".git" in dirs:
+            dirs.remove(".git")
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            rel = os.path.relpath(src_path, src)
+            if rel in shadowed:
+                continue
+            rel = renames.get(rel, rel)
+            if exclude_f and exclude_f(rel):
+                if name in dirs:
+                    dirs.remove(name)
+                continue
+            wanted[rel] = src_path
+
+    # Delete anything in dest which is not wanted, or is the wrong kind of entry
+    for root, dirs, files in os.walk(dest):
+        for name in list(dirs) + files:
+            dest_path = os.path.join(root, name)
+            rel = os.path.relpath(dest_path, dest)
+            if rel not in wanted:
+                if keep_f and keep_f(rel):
+                    if name in dirs:
+                        dirs.remove(name)
+                    continue
+            else:
+                src_st = os.lstat(wanted[rel])
+                dest_st = os.lstat(dest_path)
+                if stat.S_IFMT(src_st.st_mode) == stat.S_IFMT(dest_st.st_mode):
+                    continue
+            if name in dirs:
+                dirs.remove(name)
+            _remove(dest_path)
+            stats.entries_deleted += 1
+
+    # Copy what differs; sorting guarantees parent directories are created first
+    for rel in sorted(wanted):
+        src_path = wanted[rel]
+        dest_path = os.path.join(dest, rel)
+        src_st = os.lstat(src_path)
+
+        if stat.S_ISLNK(src_st.st_mode):
+            target = os.readlink(src_path)
+            if os.path.islink(dest_path):
+                if os.readlink(dest_path) == target:
+                    stats.files_unchanged += 1
+                    continue
+                os.remove(dest_path)
+            os.symlink(target, dest_path)
+            stats.files_copied += 1
+
+        elif stat.S_ISDIR(src_st.st_mode):
+            if not os.path.isdir(dest_path):
+                os.makedirs(dest_path)
+
+        elif _same_file(src_path, dest_path, src_st):
+            if stat.S_IMODE(os.lstat(dest_path).st_mode) != stat.S_IMODE(src_st.st_mode):
+                os.chmod(dest_path, stat.S_IMODE(src_st.st_mode))
+            stats.files_unchanged += 1
+
+        else:
+            parent = os.path.dirname(dest_path)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            copy_file(src_path, dest_path)
+            stats.files_copied += 1
+            stats.bytes_copied += src_st.st_size
+
+    return stats
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Test the incremental synchronization of source trees into distgit repos
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+import filesync
+
+
+class FileSyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-filesync")
+        self.src = os.path.join(self.test_dir, "src")
+        self.dest = os.path.join(self.test_dir, "dest")
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write(self, root, rel, content):
+        path = os.path.join(root, rel)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def read(self, rel):
+        with open(os.path.join(self.dest, rel), "r") as f:
+            return f.read()
+
+    def test_sync(self):
+        self.write(self.src, "Dockerfile", "FROM a\n")
+        self.write(self.src, "scripts/run.sh", "echo hi\n")
+        os.symlink("run.sh", os.path.join(self.src, "scripts", "start.sh"))
+        self.write(self.src, ".git/HEAD", "ref\n")
+
+        stats = filesync.sync_tree(self.src, self.dest)
+        self.assertEqual(stats.files_copied, 3)
+        self.assertEqual(stats.bytes_copied, 15)
+        self.assertEqual(self.read("scripts/run.sh"), "echo hi\n")
+        self.assertEqual(os.readlink(os.path.join(self.dest, "scripts", "start.sh")), "run.sh")
+        self.assertFalse(os.path.exists(os.path.join(self.dest, ".git")))
+
+        # Nothing changed; nothing is rewritten
+        stats = filesync.sync_tree(self.src, self.dest)
+        self.assertEqual((stats.files_copied, stats.files_unchanged, stats.entries_deleted), (0, 3, 0))
+
+    def test_changes(self):
+        self.write(self.src, "a", "same\n")
+        self.write(self.src, "b", "old\n")
+        self.write(self.src, "gone/c", "c\n")
+        filesync.sync_tree(self.src, self.dest)
+
+        self.write(self.src, "a", "same\n")  # new mtime, same content
+        self.write(self.src, "b", "new content\n")
+        shutil.rmtree(os.path.join(self.src, "gone"))
+        self.write(self.src, "d", "d\n")
+
+        stats = filesync.sync_tree(self.src, self.dest)
+        self.assertEqual((stats.files_copied, stats.files_unchanged, stats.entries_deleted), (2, 1, 1))
+        self.assertEqual(self.read("b"), "new content\n")
+        self.assertEqual(sorted(os.listdir(self.dest)), ["a", "b", "d"])
+
+    def test_rename_exclude_keep(self):
+        """
+        The options used to reconcile an image's distgit with its source
+        """
+        self.write(self.src, "Dockerfile", "FROM upstream\n")
+        self.write(self.src, "Dockerfile.rhel", "FROM rhel\n")
+        self.write(self.src, "Dockerfile.centos", "FROM centos\n")
+        self.write(self.dest, "Dockerfile.old", "FROM old\n")
+        self.write(self.dest, ".oit/reconciled/x", "x\n")
+        self.write(self.dest, "additional-tags", "v1\n")
+        self.write(self.dest, "stale", "stale\n")
+
+        stats = filesync.sync_tree(
+            self.src, self.dest,
+            renames={"Dockerfile.rhel": "Dockerfile"},
+            exclude_f=lambda rel: rel.startswith("Dockerfile."),
+            keep_f=lambda rel: rel.startswith(".") or rel == "additional-tags")
+
+        self.assertEqual(sorted(os.listdir(self.dest)), [".oit", "Dockerfile", "additional-tags"])
+        self.assertEqual(self.read("Dockerfile"), "FROM rhel\n")
+        self.assertEqual(self.read(".oit/reconciled/x"), "x\n")
+        self.assertEqual(stats.entries_deleted, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
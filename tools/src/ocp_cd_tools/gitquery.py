@@ -0,0 +1,313 @@
+"""
+Read-only queries against local git repositories without forking git.
+
+Doozer asks the same few questions of its source and distgit clones over and
+over: which branch is checked out, what HEAD points to, where origin is, and
+who last touched a Dockerfile. Forking git for each of them adds up when a
+hundred images share the same source alias. A GitRepo answers the common
+questions by reading HEAD, refs, packed-refs and config straight from the
+git directory, and reads commit objects through a single persistent
+`git cat-file --batch` process. Anything derived from HEAD is cached
+against the commit HEAD resolves to, so it is recomputed only if HEAD moves.
+
+Use get_repo(path) to share a GitRepo per repository across the process.
+"""
+
+import atexit
+import os
+import re
+import subprocess
+from multiprocessing import Lock
+
+import exectools
+import logutil
+from pushd import Dir
+
+logger = logutil.getLogger(__name__)
+
+SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+def find_git_dir(path):
+    """
+    :return: (worktree, git_dir) for the repository containing path. Raises an IOError if
+        path is not within a git repository.
+    """
+    path = os.path.abspath(path)
+    while True:
+        dot_git = os.path.join(path, ".git")
+        if os.path.isdir(dot_git):
+            return path, dot_git
+        if os.path.isfile(dot_git):
+            # Worktrees and submodules point at their git directory
+            with open(dot_git, "r") as f:
+                content = f.read().strip()
+            if content.startswith("gitdir:"):
+                return path, os.path.normpath(os.path.join(path, content[len("gitdir:"):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise IOError("Not within a git repository: {}".format(path))
+        path = parent
+
+
+def parse_config(content):
+    """
+    Parses the subset of the git config format used in repository config files.
+    :return: A dict of lowercase "section.subsection.key" -> value (the last value wins)
+    """
+    ret = {}
+    section = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line[0] in "#;":
+            continue
+        m = re.match(r'^\[\s*([\w.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]', line)
+        if m:
+            section = m.group(1).lower()
+            if m.group(2) is not None:
+                section += "." + re.sub(r"\\(.)", r"\1", m.group(2))
+            continue
+        if section is None:
+            continue
+        key, _, value = line.partition("=")
+        value = value.strip()
+        # Strip trailing comments outside of quotes, then the quotes themselves
+        out = []
+        quoted = False
+        i = 0
+        while i < len(value):
+            c = value[i]
+            if c == '"':
+                quoted = not quoted
+            elif c == "\\" and i + 1 < len(value):
+                i += 1
+                out.append({"n": "\n", "t": "\t"}.get(value[i], value[i]))
+            elif c in "#;" and not quoted:
+                break
+            else:
+                out.append(c)
+            i += 1
+        ret["{}.{}".format(section, key.strip().lower())] = "".join(out).strip()
+    return ret
+
+
+class GitRepo(object):
+
+    def __init__(self, path):
+        """
+        :param path: Any directory within the repository's work tree
+        """
+        self.worktree, self.git_dir = find_git_dir(path)
+        self.common_dir = self.git_dir
+        commondir_file = os.path.join(self.git_dir, "commondir")
+        if os.path.isfile(commondir_file):
+            with open(commondir_file, "r") as f:
+                self.common_dir = os.path.normpath(os.path.join(self.git_dir, f.read().strip()))
+
+        self.lock = Lock()
+        self._config = None
+        self._config_mtime = None
+        # Map of (query, HEAD sha, args...) -> result for values derived from HEAD
+        self._head_cache = {}
+        # Map of commit sha -> dict of header name -> value
+        self._commits = {}
+        self._cat_file = None
+
+    def _read(self, path):
+        try:
+            with open(path, "r") as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    def _packed_refs(self):
+        ret = {}
+        content = self._read(os.path.join(self.common_dir, "packed-refs"))
+        for line in (content or "").splitlines():
+            if line.startswith("#") or line.startswith("^"):
+                continue
+            parts = line.split(" ", 1)
+            if len(parts) == 2:
+                ret[parts[1]] = parts[0]
+        return ret
+
+    def resolve_ref(self, ref):
+        """
+        :param ref: A full ref name (e.g. "HEAD" or "refs/heads/master")
+        :return: The sha the ref points to or None if it does not exist.
+        """
+        for _ in range(10):  # follow symbolic refs, but not forever
+            base = self.git_dir if ref == "HEAD" else self.common_dir
+            content = self._read(os.path.join(base, ref))
+            if content is None:
+                return self._packed_refs().get(ref)
+            if content.startswith("ref:"):
+                ref = content[len("ref:"):].strip()
+                continue
+            return content if SHA_RE.match(content) else None
+        return None
+
+    def head_ref(self):
+        """
+        :return: The ref HEAD points to (e.g. "refs/heads/master") or None if HEAD is detached.
+        """
+        content = self._read(os.path.join(self.git_dir, "HEAD")) or ""
+        if content.startswith("ref:"):
+            return content[len("ref:"):].strip()
+        return None
+
+    def head_sha(self):
+        """
+        :return: The full sha of HEAD (like `git rev-parse HEAD`) or None if there are no commits.
+        """
+        return self.resolve_ref("HEAD")
+
+    def branch(self):
+        """
+        :return: The checked out branch name or "HEAD" if detached (like `git rev-parse --abbrev-ref HEAD`)
+        """
+        ref = self.head_ref()
+        if ref is None:
+            return "HEAD"
+        return ref[len("refs/heads/"):] if ref.startswith("refs/heads/") else ref
+
+    def config(self, key):
+        """
+        :param key: e.g. "remote.origin.url"
+        :return: The value from the repository's config file or None if it is not set.
+        """
+        path = os.path.join(self.common_dir, "config")
+        with self.lock:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                return None
+            if self._config is None or mtime != self._config_mtime:
+                self._config = parse_config(self._read(path) or "")
+                self._config_mtime = mtime
+            section, _, name = key.rpartition(".")
+            first, _, sub = section.partition(".")
+            lookup = first.lower() + ("." + sub if sub else "") + "." + name.lower()
+            return self._config.get(lookup)
+
+    def _cached(self, key, f):
+        """
+        Returns f() for the current HEAD, computing it only once per HEAD.
+        """
+        key = (key, self.head_sha())
+        with self.lock:
+            if key in self._head_cache:
+                return self._head_cache[key]
+        value = f()
+        with self.lock:
+            self._head_cache[key] = value
+        return value
+
+    def _git(self, *args):
+        with Dir(self.worktree):
+            rc, out, err = exectools.cmd_gather(["git"] + list(args))
+        if rc != 0:
+            raise IOError("git {} failed in {}: {}".format(" ".join(args), self.worktree, err))
+        return out.strip()
+
+    def short_sha(self):
+        """
+        :return: The abbreviated sha of HEAD, as chosen by `git rev-parse --short HEAD`.
+        """
+        # The length git picks depends on the number of objects in the repository
+        return self._cached("short_sha", lambda: self._git("rev-parse", "--short", "HEAD"))
+
+    def last_commit(self, path):
+        """
+        :param path: A file path, absolute or relative to the work tree
+        :return: The sha of the last commit reachable from HEAD which touched the file,
+            or None if it has never been committed.
+        """
+        path = os.path.relpath(os.path.join(self.worktree, path), self.worktree)
+        return self._cached(("last_commit", path),
+                            lambda: self._git("log", "-n", "1", "--pretty=format:%H", "--", path) or None)
+
+    def _read_commit(self, sha):
+        """
+        Reads a commit object through the persistent cat-file process.
+        :return: A dict of header name -> value
+        """
+        with self.lock:
+            if sha in self._commits:
+                return self._commits[sha]
+            if self._cat_file is None or self._cat_file.poll() is not None:
+                # The process outlives any command other threads run meanwhile; it must not
+                # hold their pipes open or they would never see the end of their output.
+                self._cat_file = subprocess.Popen(
+                    ["git", "--git-dir", self.git_dir, "cat-file", "--batch"],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+            proc = self._cat_file
+            proc.stdin.write(sha + "\n")
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            if len(header) != 3 or header[1] != "commit":
+                raise IOError("Unable to read commit {} in {}".format(sha, self.git_dir))
+            body = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # trailing newline
+
+            headers = {}
+            for line in body.split("\n"):
+                if not line:
+                    break  # end of headers; the message follows
+                name, _, value = line.partition(" ")
+                headers.setdefault(name, value)
+            self._commits[sha] = headers
+            return headers
+
+    def author_email(self, sha):
+        """
+        :return: The author email of the commit (like `git show -s --pretty=format:%ae`).
+        """
+        author = self._read_commit(sha).get("author", "")
+        m = re.search(r"<([^>]*)>", author)
+        return m.group(1) if m else ""
+
+    def close(self):
+        with self.lock:
+            if self._cat_file is not None and self._cat_file.poll() is None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+            self._cat_file = None
+
+
+_lock = Lock()
+# Map of git_dir -> GitRepo
+_repos = {}
+
+
+def get_repo(path):
+    """
+    Returns the GitRepo for the repository containing path, shared by all callers.
+    Raises an IOError if path is not within a git repository.
+    """
+    worktree, git_dir = find_git_dir(path)
+    with _lock:
+        if git_dir not in _repos:
+            _repos[git_dir] = GitRepo(worktree)
+        return _repos[git_dir]
+
+
+def forget(path):
+    """
+    Closes and drops the GitRepos of the repositories beneath path (e.g. a working
+    directory about to be removed), so a long running process does not keep them.
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        git_dirs = [git_dir for git_dir, repo in _repos.items()
+                    if repo.worktree == path or repo.worktree.startswith(path + os.sep)]
+        repos = [_repos.pop(git_dir) for git_dir in git_dirs]
+    for repo in repos:
+        repo.close()
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        for repo in _repos.values():
+            repo.close()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Test the in-process git query layer against the answers git itself gives
+"""
+
+import unittest
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import gitquery
+
+
+class GitQueryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-gitquery")
+        self.git("init", "-q")
+        self.git("checkout", "-q", "-b", "release-3.10")
+        self.git("config", "user.name", "Someone")
+        self.git("config", "user.email", "someone@redhat.com")
+        self.git("config", "remote.origin.url", "git@github.com:openshift/origin.git")
+        os.makedirs(os.path.join(self.test_dir, "images", "base"))
+        self.commit("images/base/Dockerfile", "FROM a\n")
+        self.git("config", "user.email", "other@example.com")
+        self.commit("README", "readme\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def git(self, *args):
+        return subprocess.check_output(["git"] + list(args), cwd=self.test_dir).strip()
+
+    def commit(self, rel, content):
+        with open(os.path.join(self.test_dir, rel), "w") as f:
+            f.write(content)
+        self.git("add", rel)
+        self.git("commit", "-q", "-m", "update {}".format(rel))
+
+    def test_refs(self):
+        repo = gitquery.GitRepo(os.path.join(self.test_dir, "images", "base"))
+        self.assertEqual(repo.worktree, os.path.realpath(self.test_dir))
+        self.assertEqual(repo.branch(), self.git("rev-parse", "--abbrev-ref", "HEAD"))
+        self.assertEqual(repo.head_sha(), self.git("rev-parse", "HEAD"))
+        self.assertEqual(repo.short_sha(), self.git("rev-parse", "--short", "HEAD"))
+
+        # Refs are found after being packed, and HEAD changes are noticed
+        self.git("pack-refs", "--all")
+        self.assertEqual(repo.head_sha(), self.git("rev-parse", "HEAD"))
+        self.git("checkout", "-q", "HEAD~1")
+        self.assertEqual(repo.branch(), "HEAD")
+        self.assertEqual(repo.head_sha(), self.git("rev-parse", "HEAD"))
+        self.assertEqual(repo.short_sha(), self.git("rev-parse", "--short", "HEAD"))
+
+    def test_config(self):
+        repo = gitquery.get_repo(self.test_dir)
+        self.assertIs(gitquery.get_repo(os.path.join(self.test_dir, "images")), repo)
+        self.assertEqual(repo.config("remote.origin.url"), "git@github.com:openshift/origin.git")
+        self.assertEqual(repo.config("Remote.origin.URL"), "git@github.com:openshift/origin.git")
+        self.assertIsNone(repo.config("remote.upstream.url"))
+        self.assertEqual(gitquery.parse_config('[a "B"]\n\tk = "x # y" ; comment\n'), {"a.B.k": "x # y"})
+
+    def test_authors(self):
+        repo = gitquery.GitRepo(self.test_dir)
+        try:
+            sha = repo.last_commit(os.path.join(self.test_dir, "images", "base", "Dockerfile"))
+            self.assertEqual(sha, self.git("log", "-n", "1", "--pretty=format:%H", "images/base/Dockerfile"))
+            self.assertEqual(repo.author_email(sha), "someone@redhat.com")
+            self.assertEqual(repo.author_email(repo.head_sha()), "other@example.com")
+            self.assertIsNone(repo.last_commit("never-committed"))
+            self.assertRaises(IOError, repo.author_email, "0" * 40)
+        finally:
+            repo.close()
+
+    def test_not_a_repo(self):
+        self.assertRaises(IOError, gitquery.get_repo, "/")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,18 +1,23 @@
+import io
 import os
 import json
-import bashlex
-from dockerfile_parse import DockerfileParser
+from collections import namedtuple
 from distgit import pull_image
 from metadata import Metadata
-from model import Missing
-from pushd import Dir
+from model import Model, Missing
 
 import assertion
 import constants
 import logutil
 import exectools
+import shellfrag
 import container
+import rpmdb
+import verifycache
 import logutil
+from lazyimport import LazyModule
+
+dockerfile_parse = LazyModule("dockerfile_parse")
 
 logger = logutil.getLogger(__name__)
 
@@ -54,20 +59,52 @@ class ImageMetadata(Metadata):
         """
         return self.config.base_only
 
-    def get_rpm_install_list(self, valid_pkg_list=None):
+    def parent_members(self):
+        """
+        :return: The names of the group members this image is built from (FROM and builders)
+        """
+        image_from = Model(self.config.get('from', None))
+        members = []
+        if image_from.member is not Missing:
+            members.append(image_from.member)
+        for builder in image_from.get('builder', []):
+            if 'member' in builder:
+                members.append(builder['member'])
+        return members
+
+    def build_dependencies(self):
+        """
+        :return: The names of the group members which must be built before this image
+                 (parents, builders and wait_for)
+        """
+        members = self.parent_members()
+        if self.config.wait_for is not Missing:
+            members.append(self.config.wait_for)
+        return members
+
+    def get_rpm_install_list(self, valid_pkg_list=None, dfp=None):
         """Parse dockerfile and find any RPMs that are being installed
-        It will automatically do any bash variable replacement during this parse
+        It will automatically do any bash variable replacement during this parse.
+        Results are cached in the runtime's RPM index, keyed by Dockerfile content.
+        :param dfp: A DockerfileParser to read instead of the distgit (or cgit) Dockerfile
         """
-        if self._distgit_repo:
-            # Already cloned, load from there
-            with Dir(self._distgit_repo.distgit_dir):
-                dfp = DockerfileParser('Dockerfile')
+        if dfp is None:
+            if self._distgit_repo:
+                # Already cloned, load from there
+                dfp = dockerfile_parse.DockerfileParser(os.path.join(self._distgit_repo.distgit_dir, 'Dockerfile'))
 
-        else:
-            # not yet cloned, just download it
-            dfp = DockerfileParser()
-            dfp.content = self.fetch_cgit_file("Dockerfile")
+            else:
+                # not yet cloned, just download it
+                dfp = dockerfile_parse.DockerfileParser(fileobj=io.BytesIO())
+                dfp.content = self.fetch_cgit_file("Dockerfile")
+
+        if self.runtime.rpm_index is None:
+            return self._parse_rpm_install_list(dfp)
+        return self.runtime.rpm_index.lookup(
+            self.distgit_key, dfp.content, lambda: self._parse_rpm_install_list(dfp))
 
+    @staticmethod
+    def _parse_rpm_install_list(dfp):
         def env_replace(envs, val):
             # find $VAR and ${VAR} style replacements
             for k, v in envs.iteritems():
@@ -77,23 +114,6 @@ class ImageMetadata(Metadata):
                         val = val.replace(opt, v)
             return val
 
-        def is_assignment(line):
-            # if this is an assignment node we need to add
-            # to env dict for later replacement in commands
-            try:
-                parts = bashlex.parse(line)
-            except:
-                # bashlex does not get along well with some inline
-                # conditionals and may emit ParsingError
-                # if that's the case, it's not an assigment, so move along
-                return None
-            for ast in parts:
-                if ast.kind != 'compound':  # ignore multi part commands
-                    for part in ast.parts:
-                        if part.kind == 'assignment':
-                            return part.word.split('=')
-            return None
-
         envs = dict(dfp.envs)
         run_lines = []
         for entry in json.loads(dfp.json):
@@ -103,14 +123,16 @@ class ImageMetadata(Metadata):
                     line = line.strip()
                     if line:
                         line = env_replace(envs, line)
-                        assign = is_assignment(line)
+                        # if this is an assignment we need to add
+                        # to env dict for later replacement in commands
+                        assign = shellfrag.assignment(line)
                         if assign:
                             envs[assign[0]] = assign[1]
                         run_lines.append(line)
 
         rpms = []
         for line in run_lines:
-            split = list(bashlex.split(line))
+            split = shellfrag.split(line)
             if 'yum' in split and 'install' in split:
                 # remove as to not mess with checking below
                 split.remove('yum')
@@ -294,12 +316,52 @@ def create_image_verify_repo_file(runtime, repo_type='signed'):
     return repo_file
 
 
+# One row of an image's RPM database
+InstalledPackage = namedtuple('InstalledPackage', ['name', 'version', 'release', 'arch', 'vendor', 'sig'])
+
+# Dumps every installed package as a tab separated InstalledPackage row
+RPMDB_QUERY = "rpm -qa --qf '{}\\n'".format('\\t'.join([
+    '%{NAME}', '%{VERSION}', '%{RELEASE}', '%{ARCH}', '%{VENDOR}', '%{SIGPGP:pgpsig}',
+]))
+
+
+def parse_rpmdb(output):
+    """
+    :param string output: The output of RPMDB_QUERY
+    :return: A list of InstalledPackage
+    """
+    packages = []
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) == len(InstalledPackage._fields):
+            packages.append(InstalledPackage(*[f.strip() for f in fields]))
+    return packages
+
+
+def unsigned_packages(packages):
+    """
+    :param list packages: InstalledPackage rows
+    :return: name-version-release of each package without a signature
+    """
+    return ['{}-{}-{}'.format(p.name, p.version, p.release) for p in packages
+            # Don't worry about it, these aren't always signed
+            if p.sig == '(none)' and p.name != 'gpg-pubkey']
+
+
+def installed_versions(packages, name):
+    """
+    :param list packages: InstalledPackage rows
+    :return: The versions of the named package which are installed
+    """
+    return [p.version for p in packages if p.name == name]
+
+
 class Image(object):
     """This is an image. We're going to launch a container from it and
     verify the contents.
     """
 
-    def __init__(self, runtime, pull_url, repo_file, enabled_checks, distgit=''):
+    def __init__(self, runtime, pull_url, repo_file, enabled_checks, distgit='', cache=None, offline=False):
         """
         :param Runtime runtime: Program runtime object
 
@@ -310,12 +372,19 @@ class Image(object):
 
         :param list enabled_checks: List of check names to run on the
         image. Each check is an Image() method.
+
+        :param VerifyCache cache: If given, results of earlier
+        verifications of the same image are reused
+
+        :param bool offline: Read the image's RPM database from its
+        layers instead of starting a container (always the case for
+        docker-archive: references). Only rpm based checks can run.
         """
         self.runtime = runtime
         self.pull_url = pull_url
         self.enabled_checks = enabled_checks
         # registry.redhat.com:8888/openshift3/ose:v3.4.1.44.38-12 => ose:v3.4.1.44.38-12
-        self.name_tag = pull_url.split('/')[-1]
+        self.name_tag = rpmdb.image_name_tag(pull_url)
         self.logger = logutil.EntityLoggingAdapter(logger=logger, extra={'entity': '{}'.format(self.name_tag)})
         self.distgit = distgit
 
@@ -323,15 +392,37 @@ class Image(object):
         # possible leaving 'v' characters, split on hyphen to isolate
         # the image release (-NN), take first item
         self.image_version = self.name_tag.split(':')[-1].lstrip('v').split('-')[0]
-        self.container = container.DockerContainer(pull_url)
+        if offline or rpmdb.parse_archive_ref(pull_url):
+            self.container = rpmdb.OfflineContainer(pull_url, os.path.join(runtime.working_dir, 'verify-offline'))
+        else:
+            self.container = container.DockerContainer(pull_url)
         # Full and abbreviated container IDs once started
         self.cid = None
         self.failures = {}
         self.repo_file = repo_file
         self.status = 'passed'
+        self.cache = cache
+        # The image's RPM database, read once and shared by the checks
+        self.packages = None
+        self.rpmdb_error = None
+        # Set when a check could not run (as opposed to finding a problem);
+        # such results are not cached
+        self.check_error = False
 
     def verify_image(self):
         """Verify this container image by running the provided checks"""
+        cache_key = None
+        if self.cache is not None:
+            image_id = self.container.image_id()
+            if image_id:
+                cache_key = self.cache.key(image_id, self.enabled_checks, self.image_version)
+                cached = self.cache.get(cache_key)
+                if cached:
+                    self.logger.info("[Verify] Unchanged since last verified ({status}): {img}".format(
+                        status=cached['status'], img=self.name_tag))
+                    cached.update({'image': self.pull_url, 'distgit': self.distgit})
+                    return cached
+
         self.init_container()
         for check in self.enabled_checks:
             # Scan this Image object for a method matching the given
@@ -360,7 +451,14 @@ class Image(object):
         #         }
         #     }
         # }
-        return {'image': self.pull_url, 'failures': self.failures, 'status': self.status, 'distgit': self.distgit}
+        result = {'image': self.pull_url, 'failures': self.failures, 'status': self.status, 'distgit': self.distgit}
+        # Errors running a check say nothing about the image. Orphans
+        # depend on what the repos contain, which changes without the
+        # repo file changing, so those results expire.
+        if cache_key is not None and not self.check_error:
+            self.cache.put(cache_key, result,
+                           ttl=verifycache.REPO_CONTENT_TTL if 'check_orphans' in self.enabled_checks else None)
+        return result
 
     def init_container(self):
         """Run basic initializion tasks"""
@@ -369,34 +467,36 @@ class Image(object):
         # Install that repo file
         self.container.copy_into(self.repo_file, '/etc/yum.repos.d/')
 
+    def installed_packages(self):
+        """
+        :return: The InstalledPackage rows of the image, queried from
+        the container on first use
+        """
+        if self.packages is None:
+            self.logger.debug("[Verify: {name}] Reading the RPM database".format(name=self.name_tag))
+            rc, stdout, stderr = self.container.execute(RPMDB_QUERY)
+            if rc != 0:
+                self.rpmdb_error = str(stdout) + str(stderr)
+                self.check_error = True
+            self.packages = parse_rpmdb(stdout)
+        return self.packages
+
     def check_sigs(self):
         """Ensure installed packages are signed using a valid key"""
-        self.logger.debug("[Verify: {name}] Grabbing package signature list".format(name=self.name_tag))
-        # If anything is broke here it will be specific to the RPM database.
-        rc, rpm_sigs, stderr = self.container.execute("rpm -qa --qf '%{name}-%{VERSION}-%{RELEASE} %{SIGPGP:pgpsig}\n'")
+        packages = self.installed_packages()
         res = {
             'description': 'Installed packages without valid signatures',
             'items': [],
         }
 
-        if rc != 0:
+        # If anything is broke here it will be specific to the RPM database.
+        if self.rpmdb_error is not None:
             res['items'].append('Error querying the RPM database for package signatures')
-            res['items'].append(str(rpm_sigs) + str(stderr))
-
-        for line in rpm_sigs.split('\n'):
-            l = line.strip()
-
-            # Don't worry about it, these aren't always signed
-            if l == 'gpg-pubkey' or l.startswith('gpg-pubkey-'):
-                continue
+            res['items'].append(self.rpmdb_error)
 
-            if l.endswith('(none)'):
-                # These results are coming back with two leading
-                # single-quotes and the trailing string ' (none)'.
-                # Let's normalize that.
-                clean_pkg_name = l[:-7]
-                res['items'].append(clean_pkg_name)
-                self.logger.info("[Verify: {name}] Unsigned package: {pkg}".format(pkg=clean_pkg_name, name=self.name_tag))
+        for pkg in unsigned_packages(packages):
+            res['items'].append(pkg)
+            self.logger.info("[Verify: {name}] Unsigned package: {pkg}".format(pkg=pkg, name=self.name_tag))
 
         if len(res['items']) > 0:
             self.status = 'failed'
@@ -409,37 +509,44 @@ class Image(object):
             'items': [],
         }
         self.logger.info("[Verify: {name}] Checking atomic openshift version".format(name=self.name_tag))
-        # rc check not required as atomic-openshift may not always be
-        # installed (rc=1 for non-installed packages)
-        _, ver, _ = self.container.execute('rpm -q --qf %{VERSION} atomic-openshift')
-        ver = ver.rstrip()
-
-        if not ver.endswith('not installed'):
+        # atomic-openshift may not always be installed
+        for ver in installed_versions(self.installed_packages(), 'atomic-openshift'):
             if ver != self.image_version:
                 res['items'].append("Installed AOS version: '{ver}' does not expected version '{expected}'".format(ver=ver, expected=self.image_version))
-                self.failures['check_versions'] = res
-                self.status = 'failed'
+
+        if len(res['items']) > 0:
+            self.failures['check_versions'] = res
+            self.status = 'failed'
 
     def check_orphans(self):
+        """Ensure every installed package is available from the enabled repos"""
+        # Which repo could provide a package is not recorded in the
+        # RPM database; package-cleanup resolves it from the repo
+        # metadata, so this check still runs in the container.
         res = {
             'description': 'Installed packages without valid source repositories',
             'items': [],
         }
 
-        # It is not very useful to check the RC here. Orphans will
-        # return rc=0, no orphans return the same rc=0.
+        # Orphans will return rc=0, no orphans return the same rc=0.
         #
         # Any errors with the package-cleanup command will return
         # non-0. We identify bad repo configs (rc=1) and we note them
-        # in the results. A bad repo config counts as an error so it
-        # is not overlooked.
-        _, orphaned_packages, _ = self.container.execute('package-cleanup --orphans')
+        # in the results. Any error counts as a failure so it is not
+        # overlooked (or taken for a pass when nothing is printed).
+        rc, orphaned_packages, err = self.container.execute('package-cleanup --orphans')
+        if rc != 0:
+            self.check_error = True
+            res['items'].append("Could not check orphan package status: package-cleanup exited with {}".format(rc))
+            if err.strip():
+                res['items'].append(err.strip())
 
         for line in orphaned_packages.split('\n'):
             l = line.strip()
             # Line with space separated words, empty length strip()d
             # line, or a line with just a help article in it
             if l.endswith('HTTP Error 404 - Not Found'):
+                self.check_error = True
                 res['items'].append("Could not check orphan package status due to invalid repository configuration")
                 res['items'].append(l)
             elif ' ' in l or '' == l or 'https://access.redhat.com' in l:
@@ -4,11 +4,16 @@ Test the ImageMetadata class
 """
 import unittest
 
+import io
+import json
 import os
 import logging
+import tarfile
 import tempfile
 import shutil
 
+import mock
+
 import image
 
 TEST_YAML = """---
@@ -109,5 +114,68 @@ class TestImageMetadata(unittest.TestCase):
         self.assertFalse(md.base_only)
         self.assertTrue(md_base.base_only)
 
+
+RPMDB_OUTPUT = """\
+gpg-pubkey\t2fa658e0\t45700c69\t(none)\t(none)\t(none)
+bash\t4.2.46\t30.el7\tx86_64\tRed Hat, Inc.\tRSA/SHA256, Wed 08 Aug 2018, Key ID 199e2f91fd431d51
+atomic-openshift\t3.11.0\t0.28.0.git.0.1f19e1a.el7\tx86_64\tRed Hat, Inc.\t(none)
+not a package row
+"""
+
+
+class TestImageChecks(unittest.TestCase):
+
+    def test_parse_rpmdb(self):
+        packages = image.parse_rpmdb(RPMDB_OUTPUT)
+        self.assertEqual([p.name for p in packages], ['gpg-pubkey', 'bash', 'atomic-openshift'])
+        self.assertEqual(packages[1].vendor, 'Red Hat, Inc.')
+        self.assertEqual(packages[1].arch, 'x86_64')
+
+    def test_unsigned_packages(self):
+        packages = image.parse_rpmdb(RPMDB_OUTPUT)
+        self.assertEqual(image.unsigned_packages(packages), ['atomic-openshift-3.11.0-0.28.0.git.0.1f19e1a.el7'])
+
+    def test_installed_versions(self):
+        packages = image.parse_rpmdb(RPMDB_OUTPUT)
+        self.assertEqual(image.installed_versions(packages, 'atomic-openshift'), ['3.11.0'])
+        self.assertEqual(image.installed_versions(packages, 'atomic-openshift-node'), [])
+
+    def test_check_orphans_error(self):
+        # package-cleanup cannot run on a saved image; that must not pass
+        runtime = MockRuntime(logging.getLogger())
+        runtime.working_dir = '/tmp'
+        img = image.Image(runtime, 'docker-archive:/tmp/ose.tar', '/tmp/verify.repo', ['check_orphans'])
+        img.check_orphans()
+        self.assertEqual(img.status, 'failed')
+        self.assertIn('package-cleanup exited with 1', img.failures['check_orphans']['items'][0])
+        self.assertTrue(img.check_error)
+
+    def test_check_versions_archive(self):
+        # The expected version of a saved image comes from its name:tag, not the file name
+        test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-image")
+        self.addCleanup(shutil.rmtree, test_dir)
+        archive = os.path.join(test_dir, "ose.tar")
+        manifest = json.dumps([{"Config": "abc123.json", "RepoTags": ["openshift3/ose:v3.11.0-2"], "Layers": []}])
+        with tarfile.open(archive, "w") as tar:
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(manifest)
+            tar.addfile(info, io.BytesIO(manifest))
+
+        runtime = MockRuntime(logging.getLogger())
+        runtime.working_dir = test_dir
+        img = image.Image(runtime, 'docker-archive:' + archive, '/tmp/verify.repo', ['check_versions'])
+        self.assertEqual(img.name_tag, 'ose:v3.11.0-2')
+        with mock.patch.object(img.container, 'execute', return_value=(0, RPMDB_OUTPUT, '')):
+            img.check_versions()
+        self.assertEqual(img.status, 'passed')
+
+        img = image.Image(runtime, 'docker-archive:{}:ose:v3.10.0-1'.format(archive), '/tmp/verify.repo',
+                          ['check_versions'])
+        with mock.patch.object(img.container, 'execute', return_value=(0, RPMDB_OUTPUT, '')):
+            img.check_versions()
+        self.assertEqual(img.status, 'failed')
+        self.assertIn("expected version '3.10.0'", img.failures['check_versions']['items'][0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,42 @@
+"""
+Deferred imports of heavy third party modules.
+
+Every command (even --help) imports doozer, the runtime and, through them,
+most of this package. Importing koji, dockerfile_parse, bashlex, pykwalify
+or yaml at module load made all of them pay for dependencies only a few
+subsystems use. A LazyModule stands in for such a module at module level
+and imports it the first time one of its attributes is used:
+
+  yaml = LazyModule("yaml")
+  ...
+  data = yaml.safe_load(f)  # yaml is imported here
+"""
+
+import importlib
+
+
+class LazyModule(object):
+
+    def __init__(self, name):
+        """
+        :param name: The full name of the module to import on first use (e.g. "koji_cli.lib")
+        """
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        # Only called for attributes not found on the proxy itself
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+    def __repr__(self):
+        return "<LazyModule {}{}>".format(self.__name, "" if self.__module is None else " (loaded)")
+
+
+def HTTPKerberosAuth(*args, **kwargs):
+    """
+    Constructs a requests_kerberos.HTTPKerberosAuth, importing requests_kerberos on first use.
+    """
+    import requests_kerberos
+    return requests_kerberos.HTTPKerberosAuth(*args, **kwargs)
@@ -1,4 +1,3 @@
-import yaml
 import os
 import urllib
 
@@ -9,6 +8,9 @@ import exectools
 import logutil
 
 from model import Model, Missing
+from lazyimport import LazyModule
+
+yaml = LazyModule("yaml")
 
 #
 # These are used as labels to index selection of a subclass.
@@ -70,8 +72,7 @@ class Metadata(object):
 
         self.runtime.logger.debug("Loading metadata from {}".format(self.config_filename))
 
-        assertion.isfile(os.path.join(os.getcwd(), self.config_filename),
-                         "Unable to find configuration file")
+        assertion.isfile(self.full_config_path, "Unable to find configuration file")
 
         with open(self.full_config_path, "r") as f:
             config_yml_content = f.read()
@@ -0,0 +1,116 @@
+"""
+Concurrent, deduplicated image pulls.
+
+Commands which pull a group's images used to pull them one after another.
+A PullManager pulls each distinct reference once, with a bounded number of
+pulls in flight, and orders them so an image is not pulled until the group
+images it is built from have been: the shared layers are then already
+present when the child is pulled and are not transferred twice.
+"""
+
+import time
+from multiprocessing import Lock
+from multiprocessing.dummy import Pool as ThreadPool
+import threading
+
+import logutil
+from distgit import pull_image
+
+logger = logutil.getLogger(__name__)
+
+
+class PullResult(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.seconds = None
+        self.error = None
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+class PullManager(object):
+
+    def __init__(self, n_threads=4, pull_f=pull_image):
+        """
+        :param n_threads: The maximum number of pulls in flight
+        :param pull_f: f(url) which pulls an image, raising an exception on failure
+        """
+        self.n_threads = n_threads
+        self.pull_f = pull_f
+        self.lock = Lock()
+        # Map of url -> set of urls it is built from
+        self.parents = {}
+
+    def add(self, url, parents=()):
+        """
+        Adds an image to pull. Adding the same url again only merges its parents.
+        :param url: The pull spec of the image
+        :param parents: The pull specs of the images it is built from
+        """
+        self.parents.setdefault(url, set()).update(p for p in parents if p != url)
+
+    def _depth(self, url, seen=()):
+        parents = [p for p in self.parents[url] if p in self.parents and p not in seen]
+        if not parents:
+            return 0
+        return 1 + max(self._depth(p, seen + (url,)) for p in parents)
+
+    def order(self):
+        """
+        :return: The urls to pull, every image after the images it is built from
+        """
+        return sorted(self.parents, key=lambda url: (self._depth(url), url))
+
+    def pull_all(self, on_pulled=None):
+        """
+        Pulls every image added.
+        :param on_pulled: If given, f(PullResult) is called as soon as each pull finishes,
+                          successfully or not, from the thread which pulled it
+        :return: A list of PullResult in pull order
+        """
+        order = self.order()
+        position = dict((url, i) for i, url in enumerate(order))
+        done = dict((url, threading.Event()) for url in order)
+        results = dict((url, PullResult(url)) for url in order)
+        progress = [0]
+
+        def pull(url):
+            # Work is handed out in order, so every earlier parent has already been started
+            for parent in self.parents[url]:
+                if parent in position and position[parent] < position[url]:
+                    done[parent].wait()
+
+            result = results[url]
+            start = time.time()
+            try:
+                self.pull_f(url)
+            except Exception as e:
+                result.error = e
+            finally:
+                result.seconds = time.time() - start
+                done[url].set()
+
+            with self.lock:
+                progress[0] += 1
+                if result.success:
+                    logger.info("[{}/{}] Pulled {} in {:.1f}s".format(progress[0], len(order), url, result.seconds))
+                else:
+                    logger.error("[{}/{}] Failed pulling {} after {:.1f}s: {}".format(
+                        progress[0], len(order), url, result.seconds, result.error))
+
+            if on_pulled is not None:
+                on_pulled(result)
+
+        logger.info("Pulling {} images with up to {} at once".format(len(order), self.n_threads))
+        pool = ThreadPool(max(1, min(self.n_threads, len(order))))
+        try:
+            for _ in pool.imap(pull, order):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+        return [results[url] for url in order]
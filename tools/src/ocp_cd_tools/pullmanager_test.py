@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Test the ordering and concurrency of image pulls
+"""
+
+import unittest
+
+import threading
+import time
+
+from pullmanager import PullManager
+
+
+class PullManagerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.pulled = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # If set, pulls are held until this many are in flight at once
+        self.hold_until = None
+        self.all_started = threading.Event()
+
+    def pull(self, url):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            if self.in_flight == self.hold_until:
+                self.all_started.set()
+        if self.hold_until:
+            self.all_started.wait(5)
+        else:
+            time.sleep(0.05)
+        with self.lock:
+            self.in_flight -= 1
+            self.pulled.append(url)
+        if url == "bad":
+            raise IOError("pull failed")
+
+    def test_order(self):
+        manager = PullManager(n_threads=4, pull_f=self.pull)
+        manager.add("node", ["base"])
+        manager.add("ose", ["base"])
+        manager.add("cli", ["ose"])
+        manager.add("base")
+        manager.add("ose", ["base", "ose"])  # duplicates merge
+        self.assertEqual(manager.order(), ["base", "node", "ose", "cli"])
+
+        results = manager.pull_all()
+        self.assertEqual([r.url for r in results], ["base", "node", "ose", "cli"])
+        self.assertTrue(all(r.success and r.seconds >= 0.05 for r in results))
+        # Children are only pulled once their parents have finished
+        self.assertEqual(self.pulled[0], "base")
+        self.assertEqual(self.pulled[-1], "cli")
+
+    def test_bounded_concurrency(self):
+        self.hold_until = 3
+        manager = PullManager(n_threads=3, pull_f=self.pull)
+        for i in range(10):
+            manager.add("image-{}".format(i))
+        manager.add("bad")
+        manager.add("child", ["image-9"])
+
+        results = manager.pull_all()
+        self.assertEqual(self.max_in_flight, 3)
+        self.assertEqual(len(self.pulled), 12)
+        self.assertLess(self.pulled.index("image-9"), self.pulled.index("child"))
+        self.assertEqual([r.url for r in results if not r.success], ["bad"])
+
+    def test_on_pulled(self):
+        manager = PullManager(n_threads=2, pull_f=self.pull)
+        manager.add("cli", ["base"])
+        manager.add("base")
+        manager.add("bad")
+        reported = []
+        results = manager.pull_all(on_pulled=lambda r: reported.append((r.url, r.success, r.seconds is not None)))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sorted(reported), [("bad", False, True), ("base", True, True), ("cli", True, True)])
+        self.assertLess(reported.index(("base", True, True)), reported.index(("cli", True, True)))
+
+
+if __name__ == "__main__":
+    unittest.main()
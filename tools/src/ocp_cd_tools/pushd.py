@@ -7,16 +7,22 @@ clause.  The context manager idiom allows the user to execute some commands
 in a working directory other than the CWD and return without needing to
 explicitly handle it.
 
+The directory is only tracked per thread; the process-wide current directory
+(`os.getcwd()`) is never changed. Commands executed through `exectools` run
+in the directory in effect, while file operations must use explicit paths
+(e.g. `os.path.join(Dir.getcwd(), "Dockerfile")`).
+
 Example:
 
-  # os.getcwd() returns /tmp/somewhere
+  # Dir.getcwd() returns /tmp/somewhere
   with Dir("/tmp/somewhere/else"):
-      # os.getcwd() returns /tmp/somewhere/else
+      # Dir.getcwd() returns /tmp/somewhere/else
       ....
 
-  # os.getcwd() returns /tmp/somewhere
+  # Dir.getcwd() returns /tmp/somewhere
 """
 
+import errno
 import os
 import threading
 
@@ -25,12 +31,13 @@ class Dir(object):
     """
     Context manager to handle directory changes safely.
 
-    On `__enter__`, `chdir`s to the given directory and on `__exit__`, `chdir`s
-    back to restore the previous `cwd`.
+    On `__enter__`, makes the given directory the current directory of the
+    calling thread and on `__exit__`, restores the previous one. The
+    process-wide `cwd` is not changed, so multiple threads can each work in
+    their own directory at the same time.
 
-    The current directory is also kept on thread-local storage and can be
-    accessed (e.g. by multi-threaded programs that cannot rely on `chdir`) via
-    the `getcwd` static method.
+    The current directory is kept on thread-local storage and can be accessed
+    via the `getcwd` static method. Relative paths are resolved against it.
 
     The `assert_exec` and `gather_exec` member functions use the directory in
     effect automatically.
@@ -43,12 +50,13 @@ class Dir(object):
 
     def __enter__(self):
         self.previous_dir = self.getcwd()
-        os.chdir(self.dir)
+        self.dir = os.path.join(self.previous_dir, self.dir)
+        if not os.path.isdir(self.dir):
+            raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), self.dir)
         self._tl.cwd = self.dir
         return self.dir
 
     def __exit__(self, *args):
-        os.chdir(self.previous_dir)
         self._tl.cwd = self.previous_dir
 
     @classmethod
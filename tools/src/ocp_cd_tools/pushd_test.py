@@ -23,16 +23,26 @@ class DirTestCase(unittest.TestCase):
     def test_chdir(self):
         """
         Verify that when a Dir is created and used in a `with` context, the
-        CWD changes from current to new and back after exiting the context
+        thread's directory changes from current to new and back after exiting
+        the context, while the process CWD is never changed
         """
         cwd = os.getcwd()
         with pushd.Dir("/"):
-            self.assertEqual(os.getcwd(), "/")
-            with pushd.Dir("/dev"):
-                self.assertEqual(os.getcwd(), "/dev")
-            self.assertEqual(os.getcwd(), "/")
+            self.assertEqual(pushd.Dir.getcwd(), "/")
+            with pushd.Dir("dev"):
+                self.assertEqual(pushd.Dir.getcwd(), "/dev")
+                self.assertEqual(os.getcwd(), cwd)
+            self.assertEqual(pushd.Dir.getcwd(), "/")
         self.assertEqual(os.getcwd(), cwd)
 
+    def test_missing_dir(self):
+        """
+        Verify that entering a directory which does not exist fails
+        """
+        with self.assertRaises(OSError):
+            with pushd.Dir("/does/not/exist"):
+                pass
+
     def test_getcwd(self, concurrent=False):
         """
         Verify that the directory locking for concurrency is working
@@ -0,0 +1,298 @@
+"""
+Indexed yum repository metadata.
+
+Asking `repoquery --repofrompath ... --whatprovides` about one package at a
+time makes repoquery download and parse the repository metadata for every
+question. A RepoData instead fetches a repository's repomd.xml and primary
+metadata once, and answers name, version and "which packages provide X"
+queries from an sqlite store. The stores are shared by all threads for the
+life of the process, so every image in a group is answered from the same
+index for a given branch and arch.
+
+When a cache directory has been set (see set_cache_dir), stores are also
+kept on disk and reused across runs: only repomd.xml is downloaded, and the
+primary metadata is fetched and indexed again only when its checksum there
+changes.
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import os
+import re
+import sqlite3
+import tempfile
+import urlparse
+import xml.etree.cElementTree as ElementTree
+from multiprocessing import Lock
+
+import requests
+
+import constants
+import exectools
+import logutil
+
+logger = logutil.getLogger(__name__)
+
+REPO_NS = "{http://linux.duke.edu/metadata/repo}"
+COMMON_NS = "{http://linux.duke.edu/metadata/common}"
+RPM_NS = "{http://linux.duke.edu/metadata/rpm}"
+
+STORE_VERSION = "1"
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE packages (pkgkey INTEGER PRIMARY KEY, name TEXT, arch TEXT, epoch TEXT, version TEXT, release TEXT);
+CREATE TABLE provides (name TEXT, pkgkey INTEGER);
+CREATE INDEX packages_name ON packages (name);
+CREATE INDEX provides_name ON provides (name);
+"""
+
+# Directory in which stores are persisted; None keeps them in memory only
+_cache_dir = None
+
+
+def set_cache_dir(path):
+    """
+    Persists repository stores under path from now on.
+    """
+    global _cache_dir
+    _cache_dir = path
+
+
+def fetch_url(url):
+    """
+    :return: The content found at the given URL. Raises an IOError if it cannot be retrieved.
+    """
+    def get():
+        try:
+            return requests.get(url, timeout=300)
+        except requests.RequestException as e:
+            logger.info("Error fetching {}: {}".format(url, e))
+            return None
+
+    try:
+        res = exectools.retry(3, get, check_f=lambda r: r is not None and r.status_code == 200)
+    except exectools.RetryException:
+        raise IOError("Unable to fetch {}".format(url))
+    return res.content
+
+
+def _decompress(href, content):
+    if href.endswith(".gz"):
+        return gzip.GzipFile(fileobj=io.BytesIO(content)).read()
+    if href.endswith(".bz2"):
+        return bz2.decompress(content)
+    return content
+
+
+def _version_segments(v):
+    return re.findall(r"\d+|[a-zA-Z]+", v or "")
+
+
+def rpmvercmp(a, b):
+    """
+    Compares two version (or release) strings the way rpm does.
+    :return: <0, 0 or >0 as a is older than, the same as, or newer than b
+    """
+    sa, sb = _version_segments(a), _version_segments(b)
+    for x, y in zip(sa, sb):
+        if x.isdigit() and y.isdigit():
+            c = cmp(int(x), int(y))
+        elif x.isdigit() or y.isdigit():
+            # Numeric segments are newer than alphabetic ones
+            c = 1 if x.isdigit() else -1
+        else:
+            c = cmp(x, y)
+        if c:
+            return c
+    return cmp(len(sa), len(sb))
+
+
+def compare_evr(a, b):
+    """
+    Compares two (epoch, version, release) tuples the way rpm does.
+    """
+    c = cmp(int(a[0] or 0), int(b[0] or 0))
+    return c or rpmvercmp(a[1], b[1]) or rpmvercmp(a[2], b[2])
+
+
+class RepoData(object):
+
+    def __init__(self, baseurl, arches=None, fetch_f=fetch_url, cache_dir=None):
+        """
+        :param baseurl: The URL of the repository (the directory containing repodata/)
+        :param arches: Only answer with packages built for these arches (all by default)
+        :param fetch_f: Function used to retrieve a URL's content
+        :param cache_dir: If given, the store is kept in this directory and reused
+                          for as long as the repository's primary metadata is unchanged
+        """
+        self.baseurl = baseurl.rstrip("/") + "/"
+        self.arches = sorted(arches) if arches else None
+        self.fetch_f = fetch_f
+        self.cache_dir = cache_dir
+        self.lock = Lock()
+        self.db = None
+        self.load()
+
+    def _primary(self):
+        """
+        :return: (href, checksum) of the repository's primary metadata
+        """
+        repomd = ElementTree.fromstring(self.fetch_f(urlparse.urljoin(self.baseurl, "repodata/repomd.xml")))
+        for data in repomd.findall(REPO_NS + "data"):
+            if data.get("type") == "primary":
+                return data.find(REPO_NS + "location").get("href"), data.findtext(REPO_NS + "checksum")
+        raise IOError("No primary metadata listed in {}repodata/repomd.xml".format(self.baseurl))
+
+    def _index(self, db, href, checksum):
+        """
+        Fetches the primary metadata and fills an empty store with it.
+        """
+        primary = _decompress(href, self.fetch_f(urlparse.urljoin(self.baseurl, href)))
+
+        db.executescript(SCHEMA)
+        count = 0
+        for _, elem in ElementTree.iterparse(io.BytesIO(primary)):
+            if elem.tag != COMMON_NS + "package":
+                continue
+            name = elem.findtext(COMMON_NS + "name")
+            ver = elem.find(COMMON_NS + "version")
+            evr = ver.attrib if ver is not None else {}
+            pkgkey = db.execute(
+                "INSERT INTO packages (name, arch, epoch, version, release) VALUES (?, ?, ?, ?, ?)",
+                (name, elem.findtext(COMMON_NS + "arch"), evr.get("epoch"), evr.get("ver"), evr.get("rel"))
+            ).lastrowid
+            provides = set([name])
+            fmt = elem.find(COMMON_NS + "format")
+            if fmt is not None:
+                provides.update(entry.get("name") for entry in fmt.iterfind(RPM_NS + "provides/" + RPM_NS + "entry"))
+                provides.update(f.text for f in fmt.iterfind(COMMON_NS + "file"))
+            db.executemany("INSERT INTO provides (name, pkgkey) VALUES (?, ?)", ((p, pkgkey) for p in provides))
+            count += 1
+            elem.clear()
+
+        db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+            ("version", STORE_VERSION), ("baseurl", self.baseurl), ("checksum", checksum),
+        ])
+        db.commit()
+        logger.info("Indexed {} packages from {}".format(count, self.baseurl))
+
+    def _open_cached(self, path, checksum):
+        """
+        :return: A connection to the store at path if it is current, else None
+        """
+        if not os.path.isfile(path):
+            return None
+        db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            meta = dict(db.execute("SELECT key, value FROM meta"))
+        except sqlite3.DatabaseError:
+            meta = {}
+        if checksum and meta.get("version") == STORE_VERSION and meta.get("checksum") == checksum:
+            return db
+        db.close()
+        return None
+
+    def load(self):
+        href, checksum = self._primary()
+
+        if self.cache_dir is None:
+            self.db = sqlite3.connect(":memory:", check_same_thread=False)
+            self._index(self.db, href, checksum)
+            return
+
+        path = os.path.join(self.cache_dir, "{}.sqlite".format(hashlib.sha256(self.baseurl).hexdigest()))
+        self.db = self._open_cached(path, checksum)
+        if self.db is not None:
+            logger.info("Using cached repodata for {}".format(self.baseurl))
+            return
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Build aside and rename into place, so other processes never see a partial store
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path), suffix=".tmp", dir=self.cache_dir)
+        os.close(fd)
+        db = sqlite3.connect(tmp_path)
+        try:
+            self._index(db, href, checksum)
+        finally:
+            db.close()
+        os.rename(tmp_path, path)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+
+    def _query(self, sql, args=()):
+        if self.arches:
+            sql += " AND p.arch IN ({})".format(", ".join("?" * len(self.arches)))
+            args = tuple(args) + tuple(self.arches)
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def whatprovides(self, name):
+        """
+        :return: The sorted names of the packages which provide the capability or file.
+        """
+        rows = self._query("SELECT DISTINCT p.name FROM provides v JOIN packages p ON p.pkgkey = v.pkgkey"
+                           " WHERE v.name = ?", (name,))
+        return sorted(row[0] for row in rows)
+
+    def packages(self, name):
+        """
+        :return: A list of (epoch, version, release, arch) for each package of the given name
+        """
+        return self._query("SELECT p.epoch, p.version, p.release, p.arch FROM packages p WHERE p.name = ?", (name,))
+
+    def latest(self, name):
+        """
+        :return: The newest (epoch, version, release, arch) of the named package, or None if it is not present
+        """
+        latest = None
+        for pkg in self.packages(name):
+            if latest is None or compare_evr(pkg, latest) > 0:
+                latest = pkg
+        return latest
+
+
+_lock = Lock()
+# Map of (baseurl, arches) -> RepoData
+_repos = {}
+# Map of (baseurl, arches) -> Lock held while that repo is being loaded
+_loading = {}
+
+
+def get_repodata(baseurl, arches=None):
+    """
+    Returns the RepoData for a repository, loading it the first time it is
+    requested. Concurrent requests for the same repository wait for a single load.
+    """
+    key = (baseurl, tuple(sorted(arches)) if arches else None)
+    with _lock:
+        if key in _repos:
+            return _repos[key]
+        load_lock = _loading.setdefault(key, Lock())
+
+    with load_lock:
+        with _lock:
+            if key in _repos:
+                return _repos[key]
+        repo = RepoData(baseurl, arches, fetch_f=fetch_url, cache_dir=_cache_dir)
+        with _lock:
+            _repos[key] = repo
+        return repo
+
+
+def forget():
+    """
+    Drops the loaded repositories, so the next get_repodata() checks repomd.xml
+    again (reopening the on-disk store if the primary metadata is unchanged).
+    """
+    with _lock:
+        _repos.clear()
+
+
+def buildroot(branch, arch):
+    """
+    :return: The RepoData of the buildroot used by ODCS for the branch and arch.
+    """
+    return get_repodata(constants.BREW_BUILDROOT_REPO_URL.format(branch=branch, arch=arch), [arch, "noarch"])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Test the indexes built from yum repository metadata
+"""
+
+import unittest
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+from multiprocessing.dummy import Pool
+
+import mock
+
+import repodata
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <data type="other"><location href="repodata/abc-other.xml.gz"/></data>
+  <data type="primary"><location href="repodata/abc-primary.xml.gz"/></data>
+</repomd>
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">
+<package type="rpm">
+  <name>python-requests</name>
+  <arch>noarch</arch>
+  <format>
+    <rpm:provides>
+      <rpm:entry name="python-requests" flags="EQ" epoch="0" ver="2.6.0" rel="1.el7_1"/>
+      <rpm:entry name="python2-requests"/>
+    </rpm:provides>
+  </format>
+</package>
+<package type="rpm">
+  <name>iproute</name>
+  <arch>x86_64</arch>
+  <format>
+    <rpm:provides><rpm:entry name="iproute"/></rpm:provides>
+    <file>/usr/sbin/ip</file>
+  </format>
+</package>
+<package type="rpm">
+  <name>iproute-s390x</name>
+  <arch>s390x</arch>
+  <format>
+    <rpm:provides><rpm:entry name="iproute"/></rpm:provides>
+  </format>
+</package>
+</metadata>
+"""
+
+OCP_REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo" xmlns:rpm="http://linux.duke.edu/metadata/rpm">
+  <data type="primary">
+    <checksum type="sha256">{checksum}</checksum>
+    <location href="repodata/{checksum}-primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+OCP_PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="3">
+<package type="rpm">
+  <name>atomic-openshift</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="3.11.9" rel="1.git.0.ae3a7f1.el7"/>
+</package>
+<package type="rpm">
+  <name>atomic-openshift</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="3.11.10" rel="1.git.0.0c5a6c3.el7"/>
+</package>
+<package type="rpm">
+  <name>atomic-openshift</name>
+  <arch>x86_64</arch>
+  <version epoch="0" ver="3.11.10" rel="1.git.0.0c5a6c3.el7_6"/>
+</package>
+</metadata>
+"""
+
+
+def gz(content):
+    out = io.BytesIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb")
+    f.write(content)
+    f.close()
+    return out.getvalue()
+
+
+FILES = {
+    "http://repo/x86_64/repodata/repomd.xml": REPOMD,
+    "http://repo/x86_64/repodata/abc-primary.xml.gz": gz(PRIMARY),
+}
+
+
+class RepoDataTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.fetched = []
+
+    def fetch(self, url):
+        self.fetched.append(url)
+        return FILES[url]
+
+    def test_whatprovides(self):
+        repo = repodata.RepoData("http://repo/x86_64", ["x86_64", "noarch"], fetch_f=self.fetch)
+        self.assertEqual(repo.whatprovides("python2-requests"), ["python-requests"])
+        self.assertEqual(repo.whatprovides("iproute"), ["iproute"])
+        self.assertEqual(repo.whatprovides("/usr/sbin/ip"), ["iproute"])
+        self.assertEqual(repo.whatprovides("missing"), [])
+
+        repo = repodata.RepoData("http://repo/x86_64/", fetch_f=self.fetch)
+        self.assertEqual(repo.whatprovides("iproute"), ["iproute", "iproute-s390x"])
+
+    def test_shared(self):
+        """
+        Concurrent lookups against the same repository load its metadata once
+        """
+        with mock.patch.object(repodata, "fetch_url", side_effect=self.fetch):
+            pool = Pool(8)
+            repos = pool.map(lambda _: repodata.get_repodata("http://repo/x86_64", ["x86_64"]), range(16))
+            pool.close()
+            pool.join()
+
+        self.assertEqual(len(set(id(r) for r in repos)), 1)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_latest(self):
+        self.assertLess(repodata.rpmvercmp("3.11.9", "3.11.10"), 0)
+        self.assertGreater(repodata.rpmvercmp("1.el7_6", "1.el7"), 0)
+        self.assertGreater(repodata.rpmvercmp("1.0", "1.beta"), 0)
+        self.assertEqual(repodata.rpmvercmp("1.0", "1_0"), 0)
+        self.assertGreater(repodata.compare_evr(("1", "1.0", "1"), ("0", "2.0", "1")), 0)
+
+        FILES["http://repo/ocp/repodata/repomd.xml"] = OCP_REPOMD.format(checksum="aaa")
+        FILES["http://repo/ocp/repodata/aaa-primary.xml.gz"] = gz(OCP_PRIMARY)
+        repo = repodata.RepoData("http://repo/ocp", fetch_f=self.fetch)
+        self.assertEqual(repo.latest("atomic-openshift"), ("0", "3.11.10", "1.git.0.0c5a6c3.el7_6", "x86_64"))
+        self.assertEqual(len(repo.packages("atomic-openshift")), 3)
+        self.assertIsNone(repo.latest("missing"))
+
+    def test_cache_dir(self):
+        """
+        Stores are reused across runs until the primary metadata's checksum changes
+        """
+        cache_dir = tempfile.mkdtemp(prefix="ocp-cd-test-repodata")
+        self.addCleanup(shutil.rmtree, cache_dir)
+        FILES["http://repo/ocp/repodata/repomd.xml"] = OCP_REPOMD.format(checksum="aaa")
+        FILES["http://repo/ocp/repodata/aaa-primary.xml.gz"] = gz(OCP_PRIMARY)
+        FILES["http://repo/ocp/repodata/bbb-primary.xml.gz"] = gz(OCP_PRIMARY.replace("3.11.10", "3.11.11"))
+
+        repodata.RepoData("http://repo/ocp", fetch_f=self.fetch, cache_dir=cache_dir)
+        self.assertEqual(len(self.fetched), 2)
+        self.assertEqual([f for f in os.listdir(cache_dir) if not f.endswith(".sqlite")], [])
+
+        repo = repodata.RepoData("http://repo/ocp", fetch_f=self.fetch, cache_dir=cache_dir)
+        self.assertEqual(self.fetched[2:], ["http://repo/ocp/repodata/repomd.xml"])
+        self.assertEqual(repo.latest("atomic-openshift")[1], "3.11.10")
+
+        FILES["http://repo/ocp/repodata/repomd.xml"] = OCP_REPOMD.format(checksum="bbb")
+        repo = repodata.RepoData("http://repo/ocp", fetch_f=self.fetch, cache_dir=cache_dir)
+        self.assertEqual(self.fetched[-1], "http://repo/ocp/repodata/bbb-primary.xml.gz")
+        self.assertEqual(repo.latest("atomic-openshift")[1], "3.11.11")
+
+
+if __name__ == "__main__":
+    unittest.main()
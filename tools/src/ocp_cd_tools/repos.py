@@ -1,10 +1,23 @@
 from model import Model, ModelException, Missing
-import yaml
+from multiprocessing import Lock
+from multiprocessing.dummy import Pool as ThreadPool
+import os
+import time
 import requests
 import json
 
+import logutil
+from lazyimport import LazyModule
+
+yaml = LazyModule("yaml")
+
+logger = logutil.getLogger(__name__)
+
 DEFAULT_REPOTYPE = 'signed'
 
+# Content sets are rarely removed; Pulp is asked again about a valid name after this many seconds
+CONTENT_SET_CACHE_TTL = 24 * 60 * 60
+
 
 class Repo(object):
     """Represents a single yum repository and provides sane ways to
@@ -171,6 +184,9 @@ class Repos(object):
             repotypes.extend(self._repos[name].repotypes)
         self.names = tuple(names)
         self.repotypes = list(set(repotypes))  # leave only unique values
+        self._lock = Lock()
+        # Map of (kind, arguments, repo state) -> generated repo file or content_sets.yml
+        self._generated = {}
 
     def __getitem__(self, item):
         """Allows getting a Repo() object simply by name via repos[repo_name]"""
@@ -185,12 +201,34 @@ class Repos(object):
         """Mainly for debugging to dump a dict representation of the collection"""
         return str(self._repos)
 
+    def _state(self):
+        """
+        :return: A hashable snapshot of everything repo files and content sets are generated from
+        which can change after construction
+        """
+        return tuple(sorted((name, r.enabled, frozenset(r._invalid_cs_arches)) for name, r in self._repos.iteritems()))
+
+    def _memoized(self, key, generate):
+        """
+        Returns generate(), computed once for each distinct key and repo state.
+        Most images enable one of a few sets of repos, so this saves
+        regenerating the same output for each of them.
+        """
+        key = key + (self._state(),)
+        with self._lock:
+            if key not in self._generated:
+                self._generated[key] = generate()
+            return self._generated[key]
+
     def repo_file(self, repo_type, enabled_repos=[], empty_repos=[]):
         """Returns the string contents of a yum .repo file for the given
         type, enabled repos, and dummy 'emtpy' repos. Contents written to file
         by external accessor.
         """
+        return self._memoized(('repo_file', repo_type, frozenset(enabled_repos), tuple(empty_repos)),
+                              lambda: self._repo_file(repo_type, enabled_repos, empty_repos))
 
+    def _repo_file(self, repo_type, enabled_repos, empty_repos):
         result = ''
         for r in self._repos.itervalues():
             result += r.conf_section(repo_type, enabled=(r.name in enabled_repos))
@@ -225,7 +263,10 @@ class Repos(object):
         """Generates a valid content_sets.yml file based on the currently
         configured and enabled repos in the collection. Using the correct
         name for each arch."""
+        return self._memoized(('content_sets', frozenset(enabled_repos)),
+                              lambda: self._content_sets(enabled_repos))
 
+    def _content_sets(self, enabled_repos):
         result = {}
         for a in self._arches:
             result[a] = []
@@ -274,23 +315,85 @@ class Repos(object):
 
         return set(result)
 
-    def validate_content_sets(self):
+    @staticmethod
+    def _load_content_set_cache(cache_file):
+        """
+        :return: The content set names Pulp found valid and when: {arch: {name: timestamp}}
+        """
+        if cache_file and os.path.isfile(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    cache = json.load(f)
+                # Drop entries in any other format
+                return dict((arch, dict((cs, t) for cs, t in names.iteritems() if isinstance(t, (int, float))))
+                            for arch, names in cache.iteritems())
+            except (ValueError, AttributeError):
+                logger.warning('Ignoring unreadable content set cache: {}'.format(cache_file))
+        return {}
+
+    @staticmethod
+    def _save_content_set_cache(cache_file, cache):
+        cache_dir = os.path.dirname(cache_file)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.rename(tmp_file, cache_file)
+
+    def validate_content_sets(self, cache_file=None, refresh=False):
+        """
+        Marks each repo's content sets which Pulp does not know as invalid, and
+        raises a ValueError if any of them are not optional. Pulp is queried
+        for all arches at once.
+
+        :param cache_file: If given, content set names Pulp knows are remembered
+        here for CONTENT_SET_CACHE_TTL seconds. Other names are always queried,
+        so a content set created in Pulp is found by the next run.
+        :param refresh: Query Pulp for every name, ignoring cached results
+        """
+        start = time.time()
+        cache = {} if refresh else self._load_content_set_cache(cache_file)
+
+        # Map of arch -> {repo name: content set}
+        cs_names = {}
+        # Map of arch -> content set names Pulp must be asked about
+        pending = {}
+        for arch in self._arches:
+            cs_names[arch] = dict((name, repo.content_set(arch)) for name, repo in self._repos.iteritems())
+            cached = cache.get(arch, {})
+            stale = [cs for cs in set(cs_names[arch].values())
+                     if cs is not None and (cs not in cached or start - cached[cs] > CONTENT_SET_CACHE_TTL)]
+            if stale:  # no point in making empty call
+                pending[arch] = stale
+
+        if pending:
+            pool = ThreadPool(len(pending))
+            try:
+                results = pool.map(lambda arch: self._validate_content_sets(arch, pending[arch]), pending.keys())
+            finally:
+                pool.close()
+                pool.join()
+            for arch, valid in zip(pending.keys(), results):
+                arch_cache = cache.setdefault(arch, {})
+                for cs in pending[arch]:
+                    if cs in valid:
+                        arch_cache[cs] = start
+                    else:
+                        arch_cache.pop(cs, None)
+            if cache_file:
+                self._save_content_set_cache(cache_file, cache)
+
         invalid = []
         for arch in self._arches:
-            cs_names = {}
-            for name, repo in self._repos.iteritems():
-                cs = repo.content_set(arch)
-                cs_names[name] = cs
-
-            arch_cs_values = cs_names.values()
-            if arch_cs_values:
-                # no point in making empty call
-                valid = self._validate_content_sets(arch, arch_cs_values)
-                for name, cs in cs_names.iteritems():
-                    if cs not in valid:
-                        if not self._repos[name].cs_optional:
-                            invalid.append('{}/{}'.format(arch, cs))
-                        self._repos[name].set_invalid_cs_arch(arch)
+            for name, cs in cs_names[arch].iteritems():
+                if cs is None or cs not in cache.get(arch, {}):
+                    if not self._repos[name].cs_optional:
+                        invalid.append('{}/{}'.format(arch, cs))
+                    self._repos[name].set_invalid_cs_arch(arch)
+
+        logger.info('Validated content sets for {} arches in {:.1f}s ({} queried from Pulp)'.format(
+            len(self._arches), time.time() - start, sum(len(names) for names in pending.values())))
 
         if invalid:
             cs_lst = ', '.join(invalid)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Test content set validation of the group's repos
+"""
+
+import unittest
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+
+import repos
+
+REPOS = {
+    'rhel-server-rpms': {
+        'conf': {'baseurl': 'http://example.com/rhel'},
+        'content_set': {'default': 'rhel-7-server-rpms', 'ppc64le': 'rhel-7-for-power-le-rpms'},
+    },
+    'rhel-server-ose-rpms': {
+        'conf': {'baseurl': 'http://example.com/ose'},
+        'content_set': {'default': 'rhel-7-server-ose-3.11-rpms', 'optional': True},
+    },
+    'rhel-server-extras-rpms': {
+        'conf': {'baseurl': 'http://example.com/extras'},
+        'content_set': {'default': 'rhel-7-server-extras-rpms'},
+    },
+}
+
+VALID = {
+    'x86_64': {'rhel-7-server-rpms', 'rhel-7-server-extras-rpms'},
+    'ppc64le': {'rhel-7-for-power-le-rpms', 'rhel-7-server-extras-rpms'},
+}
+
+
+class ReposTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-repos")
+        self.cache_file = os.path.join(self.test_dir, "cache", "content-sets.json")
+        self.lock = threading.Lock()
+        self.queries = []
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def query(self, arch, names):
+        with self.lock:
+            self.queries.append((arch, sorted(names)))
+        return VALID[arch] & set(names)
+
+    def validate(self, **kwargs):
+        r = repos.Repos(REPOS, ['x86_64', 'ppc64le'])
+        with mock.patch.object(repos.Repos, '_validate_content_sets', side_effect=self.query):
+            r.validate_content_sets(self.cache_file, **kwargs)
+        return r
+
+    def test_validate(self):
+        r = self.validate()
+        self.assertEqual(sorted(self.queries), [
+            ('ppc64le', ['rhel-7-for-power-le-rpms', 'rhel-7-server-extras-rpms', 'rhel-7-server-ose-3.11-rpms']),
+            ('x86_64', ['rhel-7-server-extras-rpms', 'rhel-7-server-ose-3.11-rpms', 'rhel-7-server-rpms']),
+        ])
+        # The optional, unknown content set is dropped rather than failing validation
+        self.assertIsNone(r['rhel-server-ose-rpms'].content_set('x86_64'))
+        self.assertEqual(r['rhel-server-rpms'].content_set('ppc64le'), 'rhel-7-for-power-le-rpms')
+
+        # Valid names are answered from the cache; unknown ones are asked about again
+        r = self.validate()
+        self.assertEqual(sorted(self.queries[2:]), [
+            ('ppc64le', ['rhel-7-server-ose-3.11-rpms']),
+            ('x86_64', ['rhel-7-server-ose-3.11-rpms']),
+        ])
+        self.assertIsNone(r['rhel-server-ose-rpms'].content_set('ppc64le'))
+
+        self.validate(refresh=True)
+        self.assertEqual(len(self.queries), 6)
+
+    def test_ttl(self):
+        self.validate()
+        with open(self.cache_file) as f:
+            cache = json.load(f)
+        cache['x86_64']['rhel-7-server-rpms'] -= repos.CONTENT_SET_CACHE_TTL + 1
+        with open(self.cache_file, 'w') as f:
+            json.dump(cache, f)
+
+        del self.queries[:]
+        self.validate()
+        self.assertEqual(sorted(self.queries), [
+            ('ppc64le', ['rhel-7-server-ose-3.11-rpms']),
+            ('x86_64', ['rhel-7-server-ose-3.11-rpms', 'rhel-7-server-rpms']),
+        ])
+
+    def test_invalid(self):
+        VALID['x86_64'].remove('rhel-7-server-extras-rpms')
+        try:
+            with self.assertRaises(ValueError) as cm:
+                self.validate()
+        finally:
+            VALID['x86_64'].add('rhel-7-server-extras-rpms')
+        self.assertIn('x86_64/rhel-7-server-extras-rpms', str(cm.exception))
+        self.assertNotIn('ppc64le', str(cm.exception))
+
+        # Once the content set exists, the next run finds it without refresh=True
+        del self.queries[:]
+        r = self.validate()
+        self.assertIn(('x86_64', ['rhel-7-server-extras-rpms', 'rhel-7-server-ose-3.11-rpms']), self.queries)
+        self.assertEqual(r['rhel-server-extras-rpms'].content_set('x86_64'), 'rhel-7-server-extras-rpms')
+
+    def test_memoized(self):
+        r = repos.Repos(REPOS, ['x86_64', 'ppc64le'])
+        with mock.patch.object(repos.Repos, '_content_sets', wraps=r._content_sets) as generate:
+            content = r.content_sets(enabled_repos=['rhel-server-rpms', 'rhel-server-extras-rpms'])
+            self.assertIs(r.content_sets(enabled_repos=['rhel-server-extras-rpms', 'rhel-server-rpms']), content)
+            self.assertEqual(generate.call_count, 1)
+            self.assertIn('rhel-7-server-extras-rpms', content)
+
+            r.content_sets(enabled_repos=['rhel-server-rpms'])
+            self.assertEqual(generate.call_count, 2)
+
+            # Content sets found to be invalid change the output
+            r['rhel-server-extras-rpms'].set_invalid_cs_arch('x86_64')
+            content = r.content_sets(enabled_repos=['rhel-server-rpms', 'rhel-server-extras-rpms'])
+            self.assertEqual(generate.call_count, 3)
+            self.assertEqual(content.count('rhel-7-server-extras-rpms'), 1)
+
+        repo_file = r.repo_file('unsigned', enabled_repos=['rhel-server-rpms'])
+        self.assertIs(r.repo_file('unsigned', enabled_repos=['rhel-server-rpms']), repo_file)
+        self.assertIsNot(r.repo_file('signed', enabled_repos=['rhel-server-rpms']), repo_file)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,7 @@ import os
 import traceback
 
 import exectools
+import gitquery
 from pushd import Dir
 from brew import watch_task
 
@@ -41,26 +42,33 @@ class RPMMetadata(Metadata):
         self.commit_sha = None
         self.build_status = False
 
+        self.source_path = None
+        self.source_head = None
+        self.specfile = None
+
         if clone_source:
-            self.source_path = self.runtime.resolve_source(self.source.alias)
-            self.source_head = self.runtime.resolve_source_head(self.source.alias)
-            if self.source.specfile:
-                self.specfile = os.path.join(self.source_path, self.source.specfile)
-                if not os.path.isfile(self.specfile):
-                    raise ValueError('{} config specified a spec file that does not exist: {}'.format(
-                        config_filename, self.specfile
-                    ))
+            self.resolve_source()
+
+    def resolve_source(self):
+        """
+        Resolves the rpm's source alias (cloning it if necessary) and locates its spec file.
+        """
+        self.source_path = self.runtime.resolve_source(self.source.alias)
+        self.source_head = self.runtime.resolve_source_head(self.source.alias)
+        if self.source.specfile:
+            self.specfile = os.path.join(self.source_path, self.source.specfile)
+            if not os.path.isfile(self.specfile):
+                raise ValueError('{} config specified a spec file that does not exist: {}'.format(
+                    self.config_filename, self.specfile
+                ))
+        else:
+            specs = glob.glob(os.path.join(self.source_path, '*.spec'))
+            if len(specs) > 1:
+                raise ValueError('More than one spec file found. Specify correct file in config yaml')
+            elif len(specs) == 0:
+                raise ValueError('Unable to find any spec files in {}'.format(self.source_path))
             else:
-                with Dir(self.source_path):
-                    specs = []
-                    for spec in glob.glob('*.spec'):
-                        specs.append(spec)
-                    if len(specs) > 1:
-                        raise ValueError('More than one spec file found. Specify correct file in config yaml')
-                    elif len(specs) == 0:
-                        raise ValueError('Unable to find any spec files in {}'.format(self.source_path))
-                    else:
-                        self.specfile = os.path.join(self.source_path, specs[0])
+                self.specfile = specs[0]
 
     def set_nvr(self, version, release):
         self.version = version
@@ -74,8 +82,7 @@ class RPMMetadata(Metadata):
         with Dir(self.source_path):
             if not scratch:
                 exectools.cmd_assert('git tag {}'.format(self.tag))
-            rc, sha, err = exectools.cmd_gather('git rev-parse HEAD')
-            self.commit_sha = sha.strip()
+        self.commit_sha = gitquery.get_repo(self.source_path).head_sha()
 
     def push_tag(self):
         if not self.tag:
@@ -0,0 +1,247 @@
+"""
+Daemonless access to the RPM database of an image.
+
+Verifying an image with docker means starting a container, copying a repo
+file into it, running rpm inside it and removing it again, which dominates
+the cost of quick checks such as check_sigs and check_versions. Those
+checks only read the RPM database, so an OfflineContainer instead
+reconstructs /var/lib/rpm from the image's layers and runs the host's
+`rpm --dbpath` against it.
+
+Images are read as docker archives (the format written by `docker save`
+and `skopeo copy ... docker-archive:`). A reference of the form
+`docker-archive:PATH[:NAME:TAG]` names an archive on disk; any other
+reference is copied from its registry with skopeo first. Layers are
+applied in order, honoring whiteout files, but only entries beneath
+var/lib/rpm are extracted.
+"""
+
+import errno
+import json
+import os
+import posixpath
+import shlex
+import shutil
+import tarfile
+import tempfile
+
+import exectools
+import logutil
+
+logger = logutil.getLogger(__name__)
+
+ARCHIVE_PREFIX = "docker-archive:"
+RPMDB_PATH = "var/lib/rpm"
+WHITEOUT_PREFIX = ".wh."
+WHITEOUT_OPAQUE = ".wh..wh..opq"
+
+
+def parse_archive_ref(image):
+    """
+    :param image: An image reference
+    :return: (archive path, name:tag or None) for docker-archive: references, or None for other references
+    """
+    if not image.startswith(ARCHIVE_PREFIX):
+        return None
+    path, _, name = image[len(ARCHIVE_PREFIX):].partition(":")
+    return path, name or None
+
+
+def _normalize(name):
+    name = posixpath.normpath(name.lstrip("/"))
+    return "" if name == "." else name
+
+
+def _is_within(path, directory):
+    """
+    :return: True if path is directory or beneath it
+    """
+    return path == directory or path.startswith(directory + "/")
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _apply_layer(layer, root):
+    """
+    Applies the var/lib/rpm entries (and whiteouts affecting them) of a layer tarball to root.
+    """
+    members = layer.getmembers()
+
+    # Whiteouts hide what the lower layers hold, not what this layer adds, so apply them first
+    for member in members:
+        name = _normalize(member.name)
+        parent, base = posixpath.split(name)
+
+        if base == WHITEOUT_OPAQUE:
+            # Everything the lower layers put in this directory is hidden
+            if _is_within(RPMDB_PATH, parent) or _is_within(parent, RPMDB_PATH):
+                target = os.path.join(root, parent or ".")
+                if os.path.isdir(target):
+                    for ent in os.listdir(target):
+                        _remove(os.path.join(target, ent))
+            continue
+
+        if base.startswith(WHITEOUT_PREFIX):
+            deleted = posixpath.join(parent, base[len(WHITEOUT_PREFIX):])
+            if _is_within(RPMDB_PATH, deleted) or _is_within(deleted, RPMDB_PATH):
+                _remove(os.path.join(root, deleted))
+
+    for member in members:
+        name = _normalize(member.name)
+        if posixpath.basename(name).startswith(WHITEOUT_PREFIX) or not _is_within(name, RPMDB_PATH):
+            continue
+
+        dest = os.path.join(root, name)
+        if member.isdir():
+            if not os.path.isdir(dest):
+                _remove(dest)
+                os.makedirs(dest)
+        elif member.isfile():
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            _remove(dest)
+            src = layer.extractfile(member)
+            with open(dest, "wb") as f:
+                shutil.copyfileobj(src, f, 1024 * 1024)
+
+
+def read_manifest(archive):
+    """
+    :return: The manifest entry of the (single) image in a docker archive
+    """
+    with tarfile.open(archive, "r") as tar:
+        return json.load(tar.extractfile("manifest.json"))[0]
+
+
+def image_name_tag(image):
+    """
+    :param image: An image reference (a registry pull spec or docker-archive:PATH[:NAME:TAG])
+    :return: The name:tag of the image without registry or namespace (e.g. ose:v3.11.0-2).
+             For archives it comes from the reference, or else the archive's manifest.
+    """
+    archive_ref = parse_archive_ref(image)
+    if archive_ref:
+        path, image = archive_ref
+        if image is None:
+            try:
+                tags = read_manifest(path).get("RepoTags") or []
+            except (IOError, KeyError, ValueError, tarfile.TarError):
+                # Reported when the image is read
+                tags = []
+            image = tags[0] if tags else posixpath.basename(path)
+    return image.split('/')[-1]
+
+
+def archive_image_id(archive):
+    """
+    :return: The image ID (digest of the image config) of the image in a docker archive
+    """
+    config = read_manifest(archive)["Config"]
+    return "sha256:" + posixpath.basename(config).split(".")[0]
+
+
+def extract_rpmdb(archive, root):
+    """
+    Reconstructs the RPM database of the image in a docker archive.
+    :param archive: The path of the docker archive
+    :param root: The directory to extract into
+    :return: The path of the RPM database (for rpm --dbpath)
+    """
+    manifest = read_manifest(archive)
+    with tarfile.open(archive, "r") as tar:
+        for layer_name in manifest["Layers"]:
+            # Layers may or may not be compressed
+            with tarfile.open(fileobj=tar.extractfile(layer_name), mode="r:*") as layer:
+                _apply_layer(layer, root)
+    return os.path.join(root, RPMDB_PATH)
+
+
+class OfflineContainer(object):
+    """
+    A stand-in for container.DockerContainer which answers rpm queries from the
+    image's RPM database without starting a container. Commands other than rpm
+    cannot be run.
+    """
+
+    def __init__(self, image, work_dir):
+        """
+        :param image: The image reference (a registry pull spec or docker-archive:PATH[:NAME:TAG])
+        :param work_dir: The directory under which images are fetched and unpacked
+        """
+        self.image = image
+        self.name_tag = image_name_tag(image)
+        self.logger = logutil.EntityLoggingAdapter(logger, {'entity': '{}'.format(self.name_tag)})
+        self.work_dir = work_dir
+        self.cid = None
+        self.root = None
+        self.dbpath = None
+
+        archive_ref = parse_archive_ref(image)
+        self.archive = archive_ref[0] if archive_ref else None
+
+    def _fetch(self):
+        """
+        Copies a registry image into a docker archive with skopeo
+        """
+        archive = os.path.join(self.root, "image.tar")
+        self.logger.info("[Verify] Fetching image layers: {img}".format(img=self.image))
+        exectools.cmd_assert(["skopeo", "copy", "docker://{}".format(self.image),
+                              "{}{}".format(ARCHIVE_PREFIX, archive)], retries=3)
+        return archive
+
+    def image_id(self):
+        """
+        :return: The image ID for archives, or the manifest digest of registry images; None if unavailable
+        """
+        if self.archive:
+            return archive_image_id(self.archive)
+        rc, stdout, stderr = exectools.cmd_gather(["skopeo", "inspect", "docker://{}".format(self.image)])
+        if rc != 0:
+            return None
+        return json.loads(stdout).get("Digest")
+
+    def start(self):
+        """Unpack the image's RPM database"""
+        try:
+            os.makedirs(self.work_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.root = tempfile.mkdtemp(prefix="rpmdb-", dir=self.work_dir)
+        self.cid = os.path.basename(self.root)
+        self.logger.info("[Verify] image (offline): {img}".format(img=self.name_tag))
+        archive = self.archive or self._fetch()
+        self.dbpath = extract_rpmdb(archive, self.root)
+        if not self.archive:
+            # Only the RPM database is needed from here on
+            os.remove(archive)
+
+    def execute(self, cmd):
+        """Run an rpm query against the image's RPM database
+
+        :param string cmd: An rpm command line, as it would be run in
+        the container
+        """
+        argv = shlex.split(cmd)
+        if not argv or argv[0] != "rpm":
+            return 1, "", "Command cannot be run in offline verification: {}".format(cmd)
+        return exectools.cmd_gather(["rpm", "--dbpath", self.dbpath] + argv[1:])
+
+    def copy_into(self, source, dest):
+        """Nothing runs inside the image, so files need not be copied into it"""
+        return 0, "", ""
+
+    def stop(self):
+        return 0, "", ""
+
+    def rm(self):
+        """Erase the unpacked RPM database"""
+        if self.root and os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+        self.root = None
+        return 0, "", ""
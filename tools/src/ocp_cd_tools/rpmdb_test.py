@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Test reading an image's RPM database from its layers
+"""
+
+import unittest
+
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+import mock
+
+import rpmdb
+
+
+def make_layer(entries):
+    """
+    :param entries: A list of (name, content) where content None makes a directory
+    :return: The bytes of a layer tarball
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name, content in entries:
+            info = tarfile.TarInfo(name)
+            if content is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            else:
+                info.size = len(content)
+                tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+class RpmdbTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-rpmdb")
+        self.archive = os.path.join(self.test_dir, "image.tar")
+        self.root = os.path.join(self.test_dir, "root")
+        os.makedirs(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_archive(self, layers):
+        layer_names = ["{}/layer.tar".format(i) for i in range(len(layers))]
+        manifest = [{"Config": "abc123.json", "RepoTags": ["ose:v3.11"], "Layers": layer_names}]
+        with tarfile.open(self.archive, "w") as tar:
+            for name, data in [("manifest.json", json.dumps(manifest))] + zip(layer_names, layers):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), "rb") as f:
+            return f.read()
+
+    def test_parse_archive_ref(self):
+        self.assertIsNone(rpmdb.parse_archive_ref("reg.example.com/openshift3/ose:v3.11"))
+        self.assertEqual(rpmdb.parse_archive_ref("docker-archive:/tmp/ose.tar"), ("/tmp/ose.tar", None))
+        self.assertEqual(rpmdb.parse_archive_ref("docker-archive:/tmp/ose.tar:ose:v3.11"),
+                         ("/tmp/ose.tar", "ose:v3.11"))
+
+    def test_extract_rpmdb(self):
+        self.write_archive([
+            make_layer([
+                ("var", None), ("var/lib", None), ("var/lib/rpm", None),
+                ("var/lib/rpm/Packages", b"base"),
+                ("var/lib/rpm/__db.001", b"stale"),
+                ("var/lib/rpm/Obsolete", b"old"),
+                ("etc/passwd", b"root"),
+            ]),
+            make_layer([
+                ("var/lib/rpm/.wh.Obsolete", b""),
+                ("var/lib/rpm/Packages", b"updated"),
+            ]),
+            make_layer([
+                ("var/lib/rpm/.wh..wh..opq", b""),
+                ("var/lib/rpm/Packages", b"rebuilt"),
+                ("var/lib/rpm/Name", b"names"),
+            ]),
+        ])
+
+        dbpath = rpmdb.extract_rpmdb(self.archive, self.root)
+        self.assertEqual(dbpath, os.path.join(self.root, "var/lib/rpm"))
+        self.assertEqual(sorted(os.listdir(dbpath)), ["Name", "Packages"])
+        self.assertEqual(self.read("var/lib/rpm/Packages"), b"rebuilt")
+        self.assertFalse(os.path.exists(os.path.join(self.root, "etc")))
+        self.assertEqual(rpmdb.archive_image_id(self.archive), "sha256:abc123")
+
+    def test_whiteout_of_directory(self):
+        self.write_archive([
+            make_layer([("var/lib/rpm/Packages", b"base")]),
+            make_layer([("var/lib/.wh.rpm", b"")]),
+            make_layer([("var/lib/rpm/Basenames", b"new")]),
+        ])
+
+        dbpath = rpmdb.extract_rpmdb(self.archive, self.root)
+        self.assertEqual(os.listdir(dbpath), ["Basenames"])
+
+    def test_execute(self):
+        self.write_archive([make_layer([("var/lib/rpm/Packages", b"base")])])
+        work_dir = os.path.join(self.test_dir, "work")
+        offline = rpmdb.OfflineContainer("docker-archive:" + self.archive, work_dir)
+        offline.start()
+        self.assertTrue(os.path.isfile(os.path.join(offline.dbpath, "Packages")))
+        self.assertEqual(offline.image_id(), "sha256:abc123")
+
+        with mock.patch.object(rpmdb.exectools, "cmd_gather", return_value=(0, "3.11.0", "")) as gather:
+            self.assertEqual(offline.execute("rpm -q --qf %{VERSION} atomic-openshift"), (0, "3.11.0", ""))
+            gather.assert_called_once_with(
+                ["rpm", "--dbpath", offline.dbpath, "-q", "--qf", "%{VERSION}", "atomic-openshift"])
+
+            rc, _, _ = offline.execute("package-cleanup --orphans")
+            self.assertEqual(rc, 1)
+            self.assertEqual(gather.call_count, 1)
+
+        offline.rm()
+        self.assertEqual(os.listdir(work_dir), [])
+        # The archive itself is left alone
+        self.assertTrue(os.path.isfile(self.archive))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+A persistent index of the RPMs installed by each image's Dockerfile.
+
+Working out which packages a Dockerfile installs means walking its RUN
+instructions with ENV substitution, which is too slow to repeat for every
+image each time ODCS needs a package list or someone asks which images
+install a given package. The index records the packages found for each
+image along with the sha256 of the Dockerfile content they were derived
+from, so an image is only re-analyzed when its Dockerfile changes. It is
+stored as JSON in the runtime's cache directory and shared across runs.
+"""
+
+import hashlib
+import json
+import os
+from multiprocessing import Lock
+
+import logutil
+
+logger = logutil.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+
+def dockerfile_sha256(content):
+    if isinstance(content, unicode):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+class RPMIndex(object):
+
+    def __init__(self, path):
+        """
+        :param path: The JSON file in which the index is persisted. It is loaded if it exists.
+        """
+        self.path = path
+        self.lock = Lock()
+        self.dirty = False
+        # Map of distgit_key -> {"dockerfile_sha256": ..., "packages": [...]}
+        self.images = {}
+
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == INDEX_VERSION:
+                    self.images = data.get("images", {})
+            except ValueError:
+                logger.warning("Ignoring unreadable RPM index: {}".format(path))
+
+    def lookup(self, distgit_key, dockerfile_content, parse_f):
+        """
+        Returns the packages installed by an image's Dockerfile.
+        :param distgit_key: The image to look up
+        :param dockerfile_content: The current content of the image's Dockerfile
+        :param parse_f: Called without arguments to compute the package list if the
+            index has nothing for this content
+        :return: A list of package names
+        """
+        sha = dockerfile_sha256(dockerfile_content)
+        with self.lock:
+            entry = self.images.get(distgit_key)
+            if entry and entry["dockerfile_sha256"] == sha:
+                return list(entry["packages"])
+
+        packages = list(parse_f())
+        with self.lock:
+            self.images[distgit_key] = {"dockerfile_sha256": sha, "packages": packages}
+            self.dirty = True
+        return list(packages)
+
+    def packages(self, distgit_key):
+        """
+        :return: The packages last recorded for the image or None if it has not been indexed.
+        """
+        with self.lock:
+            entry = self.images.get(distgit_key)
+            return list(entry["packages"]) if entry else None
+
+    def package_map(self, distgit_keys=None):
+        """
+        :param distgit_keys: Limit the map to these images (all indexed images by default)
+        :return: A dict mapping each package to the sorted list of images installing it.
+        """
+        ret = {}
+        with self.lock:
+            for key, entry in self.images.iteritems():
+                if distgit_keys is not None and key not in distgit_keys:
+                    continue
+                for package in entry["packages"]:
+                    ret.setdefault(package, set()).add(key)
+        return dict((p, sorted(keys)) for p, keys in ret.iteritems())
+
+    def images_installing(self, package):
+        """
+        :return: The sorted list of indexed images which install the package.
+        """
+        return self.package_map().get(package, [])
+
+    def save(self):
+        """
+        Writes the index back to its file if anything has changed.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            index_dir = os.path.dirname(self.path)
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump({"version": INDEX_VERSION, "images": self.images}, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+            self.dirty = False
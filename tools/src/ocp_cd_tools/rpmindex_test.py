@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Test the persistent index of RPMs installed by image Dockerfiles
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from rpmindex import RPMIndex
+
+
+class RPMIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-rpmindex")
+        self.path = os.path.join(self.test_dir, "index", "group.json")
+        self.parsed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def parse_f(self, packages):
+        def parse():
+            self.parsed.append(packages)
+            return packages
+        return parse
+
+    def test_lookup(self):
+        """
+        A Dockerfile is only analyzed again when its content changes
+        """
+        index = RPMIndex(self.path)
+        self.assertEqual(index.lookup("a", "FROM x\n", self.parse_f(["tar"])), ["tar"])
+        self.assertEqual(index.lookup("a", "FROM x\n", self.parse_f(["wrong"])), ["tar"])
+        self.assertEqual(index.lookup("a", "FROM y\n", self.parse_f(["git"])), ["git"])
+        self.assertEqual(self.parsed, [["tar"], ["git"]])
+
+    def test_persistence(self):
+        index = RPMIndex(self.path)
+        index.lookup("a", "FROM x\n", self.parse_f(["tar", "git"]))
+        index.lookup("b", "FROM x\n", self.parse_f(["git"]))
+        index.save()
+
+        index = RPMIndex(self.path)
+        self.assertEqual(index.packages("a"), ["tar", "git"])
+        self.assertIsNone(index.packages("c"))
+        self.assertEqual(index.lookup("b", "FROM x\n", self.parse_f(["wrong"])), ["git"])
+        self.assertEqual(index.images_installing("git"), ["a", "b"])
+        self.assertEqual(index.package_map(["b"]), {"git": ["b"]})
+        self.assertEqual(len(self.parsed), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,6 @@
 from multiprocessing import Lock
 from multiprocessing.dummy import Pool as ThreadPool
-from pykwalify.core import Core
+import copy
 import os
 import sys
 import tempfile
@@ -9,7 +9,6 @@ import shutil
 import atexit
 import datetime
 import re
-import yaml
 import click
 import logging
 import functools
@@ -19,6 +18,8 @@ import urlparse
 import logutil
 import assertion
 import exectools
+import gitquery
+import sourceclone
 from pushd import Dir
 
 from image import ImageMetadata
@@ -26,8 +27,16 @@ from rpmcfg import RPMMetadata
 from model import Model, Missing
 from multiprocessing import Lock
 from repos import Repos
+from rpmindex import RPMIndex
+from checkpoint import Checkpoints
 import brew
+import repodata
 import constants
+import tracing
+from lazyimport import LazyModule
+
+pykwalify_core = LazyModule("pykwalify.core")
+yaml = LazyModule("yaml")
 
 
 # Registered atexit to close out debug/record logs
@@ -46,6 +55,26 @@ def flatten_comma_delimited_entries(l):
     return nl
 
 
+# Runtimes with cleanup registered through at_exit which has not run yet
+_unfinished = []
+_unfinished_lock = Lock()
+
+
+@atexit.register
+def finish_all():
+    with _unfinished_lock:
+        runtimes = list(_unfinished)
+    for runtime in runtimes:
+        runtime.finish()
+
+
+# Map of group.yml path -> (mtime, parsed group config). Validating and
+# parsing group.yml is only repeated when it changes, which matters to
+# processes which run many commands (see service.py).
+_group_configs = {}
+_group_configs_lock = Lock()
+
+
 def remove_tmp_working_dir(runtime):
     if runtime.remove_tmp_working_dir:
         shutil.rmtree(runtime.working_dir)
@@ -89,6 +118,12 @@ class Runtime(object):
     # Serialize access to the console, and record log
     log_lock = Lock()
 
+    # Protects the creation of the per-alias locks used by resolve_source
+    source_resolve_lock = Lock()
+
+    # Log handlers installed by the last Runtime to initialize logging
+    log_handlers = []
+
     def __init__(self, **kwargs):
 
         self.include = []
@@ -99,6 +134,15 @@ class Runtime(object):
         self.wip = False
         self.disabled = False
         self.metadata_dir = None
+        self.working_dir = None
+        self.trace_file = None
+        self.cache_dir = None
+        self.partial_sources = False
+        self.sparse_sources = False
+        self.source_jobs = 4
+        self.fast_clone = False
+        self.clone_depth = None
+        self.refresh_content_sets = False
 
         for key, val in kwargs.items():
             self.__dict__[key] = val
@@ -106,6 +150,12 @@ class Runtime(object):
         if self.latest_parent_version:
             self.ignore_missing_base = True
 
+        if self.sparse_sources:
+            self.partial_sources = True
+
+        if self.clone_depth is None:
+            self.clone_depth = 1
+
         self._remove_tmp_working_dir = False
         self.group_config = None
 
@@ -123,6 +173,13 @@ class Runtime(object):
 
         self.flags_dir = None
 
+        # Index of the RPMs installed by each image's Dockerfile. Created when the group is loaded.
+        self.rpm_index = None
+
+        # Journal of the phases images have completed in the working dir. Replaced by one
+        # kept in the working dir when the runtime is initialized.
+        self.checkpoints = Checkpoints()
+
         # Map of dist-git repo name -> ImageMetadata object. Populated when group is set.
         self.image_map = {}
 
@@ -133,6 +190,15 @@ class Runtime(object):
         # See registry_repo.
         self.source_paths = {}
 
+        # Map of source alias -> Lock. Prevents two threads from cloning the same source at once.
+        self.source_alias_locks = {}
+
+        # Map of source alias -> set of directories in its sparse checkout (--sparse-sources only)
+        self.sparse_source_paths = {}
+
+        # The mode passed to initialize(); determines which metadata is loaded
+        self.mode = None
+
         # Map of stream alias to image name.
         self.stream_alias_overrides = {}
 
@@ -148,36 +214,83 @@ class Runtime(object):
         self.rpm_list = None
         self.rpm_search_tree = None
 
+        # (f, args) to call when this Runtime is finished; see at_exit
+        self._exit_callbacks = []
+
+    def at_exit(self, f, *args):
+        """
+        Arranges for f(*args) to be called when this Runtime is finished: at
+        process exit, or when finish() is called by a process which runs many
+        commands. Callbacks run in the reverse order of registration.
+        """
+        if not self._exit_callbacks:
+            with _unfinished_lock:
+                _unfinished.append(self)
+        self._exit_callbacks.append((f, args))
+
+    def finish(self):
+        """
+        Runs the callbacks registered with at_exit and closes the git repositories
+        queried in the working directory.
+        """
+        with _unfinished_lock:
+            if self in _unfinished:
+                _unfinished.remove(self)
+        if self.working_dir is not None:
+            gitquery.forget(self.working_dir)
+        callbacks, self._exit_callbacks = self._exit_callbacks, []
+        for f, args in reversed(callbacks):
+            try:
+                f(*args)
+            except Exception:
+                traceback.print_exc()
+
     def get_group_config(self, group_dir):
-        with Dir(group_dir):
-
-            group_schema_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schema_group.yml")
-            c = Core(source_file="group.yml", schema_files=[group_schema_path])
-            c.validate(raise_exception=True)
-
-            with open("group.yml", "r") as f:
-                group_yml = f.read()
-
-            # group.yml can contain a `vars` section which should be a
-            # single level dict containing keys to str.format(**dict) replace
-            # into the YAML content. If `vars` found, the format will be
-            # preformed and the YAML model will reloaded from that result
-            tmp_config = Model(yaml.load(group_yml))
-            replace_vars = tmp_config.vars
-            if replace_vars is not Missing:
-                try:
-                    tmp_config = Model(yaml.load(group_yml.format(**replace_vars)))
-                except KeyError as e:
-                    raise ValueError('group.yml contains template key `{}` but no value was provided'.format(e.args[0]))
-            return tmp_config
+        group_yml_path = os.path.join(group_dir, "group.yml")
+        mtime = os.path.getmtime(group_yml_path)
+        with _group_configs_lock:
+            cached = _group_configs.get(group_yml_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self._load_group_config(group_yml_path))
+            with _group_configs_lock:
+                _group_configs[group_yml_path] = cached
+        # Callers may modify the config they are given
+        return Model(copy.deepcopy(cached[1]))
+
+    def _load_group_config(self, group_yml_path):
+        """
+        :return: The validated content of group.yml (with vars replaced) as plain dicts and lists
+        """
+        group_schema_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schema_group.yml")
+        c = pykwalify_core.Core(source_file=group_yml_path, schema_files=[group_schema_path])
+        c.validate(raise_exception=True)
+
+        with open(group_yml_path, "r") as f:
+            group_yml = f.read()
+
+        # group.yml can contain a `vars` section which should be a
+        # single level dict containing keys to str.format(**dict) replace
+        # into the YAML content. If `vars` found, the format will be
+        # preformed and the YAML model will reloaded from that result
+        data = yaml.load(group_yml)
+        replace_vars = data.get('vars')
+        if replace_vars is not None:
+            try:
+                data = yaml.load(group_yml.format(**replace_vars))
+            except KeyError as e:
+                raise ValueError('group.yml contains template key `{}` but no value was provided'.format(e.args[0]))
+        return data
 
     def initialize(self, mode='images', clone_distgits=True,
                    validate_content_sets=False,
-                   no_group=False, clone_source=True, disabled=None):
+                   no_group=False, clone_source=True, disabled=None,
+                   resolve_image_sources=False, resume=False):
 
         if self.initialized:
             return
 
+        self.mode = mode
+
         if self.quiet and self.verbose:
             click.echo("Flags --quiet and --verbose are mutually exclusive")
             exit(1)
@@ -190,10 +303,12 @@ class Runtime(object):
             exit(1)
 
         if self.working_dir is None:
+            if resume:
+                click.echo("Nothing to resume without --working-dir; running every phase")
             self.working_dir = tempfile.mkdtemp(".tmp", "oit-")
             # This can be set to False by operations which want the working directory to be left around
             self.remove_tmp_working_dir = True
-            atexit.register(remove_tmp_working_dir, self)
+            self.at_exit(remove_tmp_working_dir, self)
         else:
             self.working_dir = os.path.abspath(self.working_dir)
             if not os.path.isdir(self.working_dir):
@@ -211,9 +326,22 @@ class Runtime(object):
         if not os.path.isdir(self.sources_dir):
             os.mkdir(self.sources_dir)
 
+        # Data which can be reused across runs (and working directories) is kept here
+        if self.cache_dir is None:
+            self.cache_dir = os.path.join(self.working_dir, "cache")
+        else:
+            self.cache_dir = os.path.abspath(self.cache_dir)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        repodata.set_cache_dir(os.path.join(self.cache_dir, "repodata"))
+
         if disabled is not None:
             self.disabled = disabled
 
+        if self.trace_file:
+            tracing.enable()
+            self.at_exit(tracing.write, os.path.abspath(self.trace_file))
+
         self.initialize_logging()
 
         self.resolve_metadata()
@@ -223,7 +351,7 @@ class Runtime(object):
 
         self.record_log_path = os.path.join(self.working_dir, "record.log")
         self.record_log = open(self.record_log_path, 'a')
-        atexit.register(close_file, self.record_log)
+        self.at_exit(close_file, self.record_log)
 
         # Directory where brew-logs will be downloaded after a build
         self.brew_logs_dir = os.path.join(self.working_dir, "brew-logs")
@@ -235,6 +363,14 @@ class Runtime(object):
         if not os.path.isdir(self.flags_dir):
             os.mkdir(self.flags_dir)
 
+        # Phases completed by images in this working-dir; skipped when resuming
+        self.checkpoints = Checkpoints(os.path.join(self.working_dir, "checkpoints.jsonl"), resume=resume)
+        # Dockerfiles refer to their parents by the uuid tag of the run which rebased them
+        previous_run = self.checkpoints.completed("runtime", "run", {})
+        if previous_run is not None:
+            self.uuid = previous_run["uuid"]
+        self.checkpoints.record("runtime", "run", {}, uuid=self.uuid)
+
         # Try first that the user has given the proper full path to the
         # groups database directory
         group_dir = os.path.join(self.metadata_dir, self.group)
@@ -249,6 +385,9 @@ class Runtime(object):
 
         self.group_dir = group_dir
 
+        self.rpm_index = RPMIndex(os.path.join(self.cache_dir, "rpm-index", "{}.json".format(self.group)))
+        self.at_exit(self.rpm_index.save)
+
         self.images_dir = images_dir = os.path.join(self.group_dir, 'images')
         self.rpms_dir = rpms_dir = os.path.join(self.group_dir, 'rpms')
 
@@ -272,7 +411,8 @@ class Runtime(object):
             self.repos = Repos(self.group_config.repos, self.arches)
 
             if validate_content_sets:
-                self.repos.validate_content_sets()
+                self.repos.validate_content_sets(os.path.join(self.cache_dir, "content-sets.json"),
+                                                 refresh=self.refresh_content_sets)
 
             if self.group_config.name != self.group:
                 raise IOError(
@@ -297,15 +437,13 @@ class Runtime(object):
             # Initially populated with all .yml files found in the images directory.
             images_filename_list = []
             if os.path.isdir(images_dir):
-                with Dir(images_dir):
-                    images_filename_list = [x for x in os.listdir(".") if os.path.isfile(x)]
+                images_filename_list = [x for x in os.listdir(images_dir) if os.path.isfile(os.path.join(images_dir, x))]
             else:
                 self.logger.debug('{} does not exist. Skipping image processing for group.'.format(images_dir))
 
             rpms_filename_list = []
             if os.path.isdir(rpms_dir):
-                with Dir(rpms_dir):
-                    rpms_filename_list = [x for x in os.listdir(".") if os.path.isfile(x)]
+                rpms_filename_list = [x for x in os.listdir(rpms_dir) if os.path.isfile(os.path.join(rpms_dir, x))]
             else:
                 self.logger.debug('{} does not exist. Skipping RPM processing for group.'.format(rpms_dir))
 
@@ -365,7 +503,8 @@ class Runtime(object):
                     self.image_map[metadata.distgit_key] = metadata
 
             def gen_RPMMetadata(base_dir, config_filename, force):
-                metadata = RPMMetadata(self, base_dir, config_filename, clone_source=clone_source)
+                # Sources are resolved for all rpms at once, once every config is loaded
+                metadata = RPMMetadata(self, base_dir, config_filename, clone_source=False)
                 if force or metadata.enabled:
                     self.rpm_map[metadata.distgit_key] = metadata
 
@@ -400,7 +539,7 @@ class Runtime(object):
 
                         try:
                             schema_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "schema_{}.yml".format(search_type))
-                            c = Core(source_file=config_filename, schema_files=[schema_path])
+                            c = pykwalify_core.Core(source_file=os.path.join(search_dir, config_filename), schema_files=[schema_path])
                             c.validate(raise_exception=True)
 
                             gen(search_dir, config_filename, self.disabled or is_include or is_wip)
@@ -418,6 +557,21 @@ class Runtime(object):
                 if not self.rpm_map:
                     self.logger.warning("No rpm metadata directories found for given options within: {}".format(self.group_dir))
 
+            # Clone every source the selected configs need concurrently, rather than one
+            # after another as each config asks for it.
+            aliases = set()
+            if clone_source:
+                aliases.update(meta.source.alias for meta in self.rpm_map.values())
+            if resolve_image_sources:
+                for meta in self.image_map.values():
+                    if meta.config.content.source.alias is not Missing:
+                        aliases.add(meta.config.content.source.alias)
+            self.resolve_sources(aliases)
+
+            if clone_source:
+                for meta in self.rpm_map.values():
+                    meta.resolve_source()
+
         # Make sure that the metadata is not asking us to check out the same exact distgit & branch.
         # This would almost always indicate someone has checked in duplicate metadata into a group.
         no_collide_check = {}
@@ -455,18 +609,25 @@ class Runtime(object):
         default_log_formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
 
         root_logger = logging.getLogger()
+        # Get a reference to the logger for ocp_cd_tools
+        self.logger = logutil.getLogger()
+
+        # A process which runs several commands must not log each line once per command so far
+        self.remove_log_handlers()
+
         root_logger.setLevel(logging.WARN)
         root_stream_handler = logging.StreamHandler()
         root_stream_handler.setFormatter(default_log_formatter)
         root_logger.addHandler(root_stream_handler)
+        Runtime.log_handlers.append((root_logger, root_stream_handler))
 
         # If in debug mode, let all modules log
         if not self.debug:
             # Otherwise, only allow children of ocp to log
-            root_logger.addFilter(logging.Filter("ocp"))
+            ocp_filter = logging.Filter("ocp")
+            root_logger.addFilter(ocp_filter)
+            Runtime.log_handlers.append((root_logger, ocp_filter))
 
-        # Get a reference to the logger for ocp_cd_tools
-        self.logger = logutil.getLogger()
         self.logger.propagate = False
 
         # levels will be set at the handler level. Make sure master level is low.
@@ -476,6 +637,7 @@ class Runtime(object):
         main_stream_handler.setFormatter(default_log_formatter)
         main_stream_handler.setLevel(log_level)
         self.logger.addHandler(main_stream_handler)
+        Runtime.log_handlers.append((self.logger, main_stream_handler))
 
         self.debug_log_path = os.path.join(self.working_dir, "debug.log")
         debug_log_handler = logging.FileHandler(self.debug_log_path)
@@ -483,6 +645,22 @@ class Runtime(object):
         debug_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s (%(thread)d) %(message)s'))
         debug_log_handler.setLevel(logging.DEBUG)
         self.logger.addHandler(debug_log_handler)
+        Runtime.log_handlers.append((self.logger, debug_log_handler))
+        self.at_exit(self.remove_log_handlers)
+
+    @classmethod
+    def remove_log_handlers(cls):
+        """
+        Removes (and closes) the log handlers and filters installed by initialize_logging.
+        """
+        with cls.log_lock:
+            installed, cls.log_handlers[:] = list(cls.log_handlers), []
+        for logger, handler in installed:
+            if isinstance(handler, logging.Handler):
+                logger.removeHandler(handler)
+                handler.close()
+            else:
+                logger.removeFilter(handler)
 
     @staticmethod
     def timestamp():
@@ -502,11 +680,15 @@ class Runtime(object):
         path = os.path.abspath(path)
         assertion.isdir(path, "Error registering source alias %s" % alias)
         self.source_paths[alias] = path
-        with Dir(path):
-            origin_url = "?"
-            rc1, out_origin, err_origin = exectools.cmd_gather(
-                ["git", "config", "--get", "remote.origin.url"])
-            if rc1 == 0:
+        origin_url = "?"
+        branch = "?"
+        try:
+            repo = gitquery.get_repo(path)
+        except IOError as e:
+            self.logger.error("Failed reading git repository for source alias %s: %s" % (alias, e))
+        else:
+            out_origin = repo.config("remote.origin.url")
+            if out_origin is not None:
                 origin_url = out_origin.strip()
                 # Usually something like "git@github.com:openshift/origin.git"
                 # But we want an https hyperlink like http://github.com/openshift/origin
@@ -516,17 +698,11 @@ class Runtime(object):
                     origin_url = origin_url.replace(":", "/", 1)  # replace first colon with /
                     origin_url = "https://%s" % origin_url
             else:
-                self.logger.error("Failed acquiring origin url for source alias %s: %s" % (alias, err_origin))
+                self.logger.error("Failed acquiring origin url for source alias %s" % alias)
 
-            branch = "?"
-            rc2, out_branch, err_branch = exectools.cmd_gather(
-                ["git", "rev-parse", "--abbrev-ref", "HEAD"])
-            if rc2 == 0:
-                branch = out_branch.strip()
-            else:
-                self.logger.error("Failed acquiring origin branch for source alias %s: %s" % (alias, err_branch))
+            branch = repo.branch()
 
-            self.add_record("source_alias", alias=alias, origin_url=origin_url, branch=branch, path=path)
+        self.add_record("source_alias", alias=alias, origin_url=origin_url, branch=branch, path=path)
 
     def register_stream_alias(self, alias, image):
         self.logger.info("Registering image stream alias override %s: %s" % (alias, image))
@@ -580,6 +756,15 @@ class Runtime(object):
             self.record_log.write("%s\n" % record)
             self.record_log.flush()
 
+    def add_record_lines(self, lines):
+        """
+        Adds records already formatted by add_record (e.g. in another process's record.log).
+        """
+        with self.log_lock:
+            for line in lines:
+                self.record_log.write("%s\n" % line.rstrip("\n"))
+            self.record_log.flush()
+
     def add_distgits_diff(self, distgit, diff):
         """
         Records the diff of changes applied to a distgit repo.
@@ -627,6 +812,14 @@ class Runtime(object):
         :return: Returns the source path or None (if required=False)
         """
 
+        # Images being rebased concurrently may share a source; only one of them should clone it.
+        with self.source_resolve_lock:
+            alias_lock = self.source_alias_locks.setdefault(alias, Lock())
+
+        with alias_lock:
+            return self._resolve_source(alias, required)
+
+    def _resolve_source(self, alias, required):
         self.logger.debug("Resolving local source directory for alias {}".
                           format(alias))
         if alias in self.source_paths:
@@ -660,6 +853,10 @@ class Runtime(object):
         source_config = self.group_config.sources[alias]
         url = source_config["url"]
         branches = source_config['branch']
+
+        if self.partial_sources:
+            return self._clone_source_partial(alias, url, branches, source_dir, required)
+
         self.logger.info("Cloning source '%s' from %s as specified by group into: %s" % (alias, url, source_dir))
         exectools.cmd_assert(
             cmd=["git", "clone", url, source_dir],
@@ -714,6 +911,112 @@ class Runtime(object):
                 else:
                     return None
 
+    def resolve_sources(self, aliases, required=True):
+        """
+        Resolves several source aliases at once, with up to source_jobs clones in flight.
+        :param aliases: The source aliases to resolve
+        :param required: If True, raise an exception if any alias cannot be resolved
+        :return: A dict of alias -> source path (or None, if required=False)
+        """
+        aliases = sorted(set(aliases))
+        pending = [a for a in aliases if a not in self.source_paths]
+        if pending:
+            self.logger.info("Resolving {} sources: {}".format(len(pending), ", ".join(pending)))
+        start = datetime.datetime.now()
+
+        errors = {}
+        for alias, _, error in self.parallel_imap(lambda a: self.resolve_source(a, required),
+                                                  pending, n_threads=max(1, min(self.source_jobs, len(pending)))):
+            if error is not None:
+                self.logger.error("Failed resolving source {}: {}".format(alias, error))
+                errors[alias] = error
+        if errors:
+            raise IOError("Unable to resolve sources: {}".format(", ".join(sorted(errors))))
+
+        if pending:
+            self.logger.info("Resolved sources in {}".format(datetime.datetime.now() - start))
+        return dict((a, self.source_paths.get(a)) for a in aliases)
+
+    def _sparse_paths(self, alias):
+        """
+        :return: The sorted union of the content.source.path of the images using the source
+            alias, or None if the whole source must be checked out.
+        """
+        # rpms are built from the whole source tree
+        if not self.sparse_sources or self.mode != 'images':
+            return None
+        paths = set()
+        for meta in self.image_map.values():
+            source = meta.config.content.source
+            if source.alias != alias:
+                continue
+            if source.path is Missing:
+                return None
+            paths.add(source.path.strip("/"))
+        return sorted(paths) or None
+
+    def _clone_source_partial(self, alias, url, branches, source_dir, required):
+        """
+        Clones a single branch of a group source without blobs, using a persistent mirror
+        in the cache directory for everything already fetched by earlier runs.
+        """
+        mirror = sourceclone.mirror_path(self.cache_dir, url)
+        with tracing.span("source_mirror", alias=alias):
+            sourceclone.update_mirror(mirror, url)
+
+        stage_branch = branches.get('stage', None)
+        fallback_branch = branches.get("fallback", None)
+        if self.stage and stage_branch:
+            self.logger.info('Normal branch overridden by --stage option, using "{}"'.format(stage_branch))
+            if not sourceclone.branch_exists(mirror, stage_branch):
+                raise IOError('--stage option specified and no stage branch named "{}" exists for {}|{}'.format(stage_branch, alias, url))
+            branch = stage_branch
+        else:
+            branch = branches["target"]
+            if not sourceclone.branch_exists(mirror, branch):
+                if fallback_branch is None or not sourceclone.branch_exists(mirror, fallback_branch):
+                    self.logger.error("Failed finding branch %s (fallback %s) of source '%s'" % (branch, fallback_branch, alias))
+                    if required:
+                        raise IOError("Error checking out target branch of source '%s' in: %s" % (alias, source_dir))
+                    return None
+                self.logger.info("Unable to find branch %s ; using fallback %s" % (branch, fallback_branch))
+                branch = fallback_branch
+
+        sparse_paths = self._sparse_paths(alias)
+        self.logger.info("Cloning source '%s' branch %s from %s as specified by group into: %s" % (alias, branch, url, source_dir))
+        with tracing.span("source_clone", alias=alias):
+            sourceclone.clone(url, mirror, branch, source_dir, sparse_paths=sparse_paths)
+        if sparse_paths:
+            self.sparse_source_paths[alias] = set(sparse_paths)
+
+        # Store so that the next attempt to resolve the source hits the map
+        self.register_source_alias(alias, source_dir)
+        return source_dir
+
+    def resolve_source_path(self, alias, path=Missing):
+        """
+        Resolves a source alias like resolve_source and returns the location of a
+        path within it. With --sparse-sources, the path is added to the sparse checkout
+        if an image not known when the source was cloned needs it.
+        :param alias: The source alias to resolve
+        :param path: A path relative to the source root (the root itself if Missing)
+        :return: The absolute path
+        """
+        source_root = self.resolve_source(alias)
+        if path is Missing:
+            return source_root
+
+        full_path = os.path.join(source_root, path)
+        with self.source_resolve_lock:
+            alias_lock = self.source_alias_locks[alias]
+        with alias_lock:
+            sparse = self.sparse_source_paths.get(alias)
+            if sparse is not None and not os.path.exists(full_path):
+                self.logger.info("Adding %s to the sparse checkout of source '%s'" % (path, alias))
+                sourceclone.add_sparse_paths(source_root, [path.strip("/")])
+                sparse.add(path.strip("/"))
+        return full_path
+
     def resolve_source_head(self, alias, required=True):
         """
         Attempts to resolve the branch a given source alias has checked out. If not on a branch
@@ -727,16 +1030,13 @@ class Runtime(object):
         if not source_dir:
             return None
 
-        with open(os.path.join(source_dir, '.git/HEAD')) as f:
-            head_content = f.read().strip()
-            # This will either be:
-            # a SHA like: "52edbcd8945af0dc728ad20f53dcd78c7478e8c2"
-            # a local branch name like: "ref: refs/heads/master"
-            if head_content.startswith("ref:"):
-                return head_content.split('/', 2)[2]  # limit split in case branch name contains /
+        repo = gitquery.get_repo(source_dir)
+        head_ref = repo.head_ref()
+        if head_ref is not None:
+            return head_ref.split('/', 2)[2]  # limit split in case branch name contains /
 
-            # Otherwise, just return SHA
-            return head_content
+        # Otherwise, just return SHA
+        return repo.head_sha()
 
     def export_sources(self, output):
         self.logger.info('Writing sources to {}'.format(output))
@@ -773,20 +1073,14 @@ class Runtime(object):
                 repo_url)
         )
 
-        # create a randomish repo name to avoid erroneous cache hits
-        repoid = "oit" + datetime.datetime.now().strftime("%s")
-        version_query = ["/usr/bin/repoquery", "--quiet", "--tempcache",
-                         "--repoid", repoid,
-                         "--repofrompath", repoid + "," + repo_url,
-                         "--queryformat", "%{VERSION}",
-                         "atomic-openshift"]
-        rc, auto_version, err = exectools.cmd_gather(version_query)
-        if rc != 0:
-            raise RuntimeError(
-                "Unable to get OCP version from RPM repository: {}".format(err)
-            )
-
-        version = "v" + auto_version.strip()
+        try:
+            latest = repodata.get_repodata(repo_url).latest("atomic-openshift")
+        except IOError as e:
+            raise RuntimeError("Unable to get OCP version from RPM repository: {}".format(e))
+        if latest is None:
+            raise RuntimeError("Unable to get OCP version from RPM repository: no atomic-openshift package in {}".format(repo_url))
+
+        version = "v" + latest[1]
 
         self.logger.info("Auto-detected OCP version: {}".format(version))
         return version
@@ -804,10 +1098,29 @@ class Runtime(object):
         """
         return re.match("^v\d+((\.\d+)+)?$", version) is not None
 
+    @staticmethod
+    def _trace_name(item):
+        """
+        :return: Returns the name of the trace track for an item processed by
+        one of the parallel_exec methods (a Metadata or DistGitRepo object).
+        """
+        meta = getattr(item, 'metadata', item)
+        return getattr(meta, 'distgit_key', str(item))
+
+    @classmethod
+    def _traced(cls, f, name_f):
+        """ Decorate a function so that each invocation is recorded on its own trace track. """
+        @functools.wraps(f)
+        def wrapper(arg):
+            name = cls._trace_name(name_f(arg))
+            with tracing.track(name), tracing.span('parallel_exec', item=name):
+                return f(arg)
+        return wrapper
+
     @classmethod
     def _parallel_exec(self, f, args, n_threads):
         pool = ThreadPool(n_threads)
-        ret = pool.map_async(wrap_exception(f), args)
+        ret = pool.map_async(wrap_exception(self._traced(f, lambda a: a)), args)
         pool.close()
         pool.join()
         return ret
@@ -829,7 +1142,7 @@ class Runtime(object):
         terminate_event = threading.Event()
         pool = ThreadPool(n_threads)
         ret = pool.map_async(
-            wrap_exception(f),
+            wrap_exception(self._traced(f, lambda a: a[0])),
             [(a, terminate_event) for a in args])
         pool.close()
         try:
@@ -842,6 +1155,27 @@ class Runtime(object):
         pool.join()
         return ret
 
+    def parallel_imap(self, f, args, n_threads=1):
+        """
+        Runs f on each arg with at most n_threads invocations in flight and
+        yields (arg, result, error) tuples in the order the invocations complete.
+        An exception raised by f is returned as error (a WrapException) instead
+        of aborting the remaining work.
+        """
+        def run(arg):
+            try:
+                return arg, f(arg), None
+            except Exception:
+                return arg, None, WrapException()
+
+        pool = ThreadPool(n_threads)
+        try:
+            for r in pool.imap_unordered(self._traced(run, lambda a: a), args):
+                yield r
+        finally:
+            pool.close()
+            pool.join()
+
     def resolve_metadata(self):
         """
         The group control data can be on a local filesystem, in a git
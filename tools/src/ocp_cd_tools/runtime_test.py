@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 import unittest
+
+import logging
+import threading
+
 from runtime import Runtime
 
 
@@ -8,6 +12,72 @@ class RuntimeTestCase(unittest.TestCase):
         ret = Runtime._parallel_exec(lambda x: x * 2, xrange(5), n_threads=20)
         self.assertEqual(ret.get(), [0, 2, 4, 6, 8])
 
+    def test_parallel_imap(self):
+        def f(x):
+            if x == 3:
+                raise ValueError("bad item")
+            return x * 2
+
+        rt = Runtime(latest_parent_version=False)
+        ret = list(rt.parallel_imap(f, xrange(5), n_threads=3))
+        self.assertEqual(len(ret), 5)
+        results = dict((x, r) for x, r, e in ret if e is None)
+        self.assertEqual(results, {0: 0, 1: 2, 2: 4, 4: 8})
+        errors = [(x, e) for x, r, e in ret if e is not None]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 3)
+        self.assertIsInstance(errors[0][1].exception, ValueError)
+
+    def test_resolve_sources(self):
+        """
+        Sources are cloned concurrently and each alias only once
+        """
+        calls = []
+        lock = threading.Lock()
+        in_flight = [0, 0]  # current, peak
+        # Released once all four clones are running at the same time
+        all_started = threading.Event()
+
+        def resolve(alias, required):
+            with lock:
+                calls.append(alias)
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight)
+                if in_flight[0] == 4:
+                    all_started.set()
+            all_started.wait(5)
+            with lock:
+                in_flight[0] -= 1
+            if alias == "bad":
+                raise IOError("clone failed")
+            rt.source_paths[alias] = "/sources/" + alias
+            return rt.source_paths[alias]
+
+        rt = Runtime(latest_parent_version=False, source_jobs=4)
+        rt.logger = logging.getLogger()
+        rt._resolve_source = resolve
+        rt.source_paths["local"] = "/local"
+
+        ret = rt.resolve_sources(["ose", "origin", "ose", "local", "cli", "web"])
+        self.assertEqual(in_flight[1], 4)
+        self.assertEqual(sorted(calls), ["cli", "origin", "ose", "web"])
+        self.assertEqual(ret["ose"], "/sources/ose")
+        self.assertEqual(ret["local"], "/local")
+
+        self.assertRaises(IOError, rt.resolve_sources, ["bad", "ose"])
+
+    def test_finish(self):
+        """
+        Cleanup registered with at_exit runs once, in reverse order
+        """
+        calls = []
+        rt = Runtime(latest_parent_version=False)
+        rt.at_exit(calls.append, "first")
+        rt.at_exit(calls.append, "second")
+        rt.finish()
+        rt.finish()
+        self.assertEqual(calls, ["second", "first"])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,196 @@
+"""
+A long running doozer process which runs commands sent over a Unix socket.
+
+Every doozer invocation pays for interpreter startup, imports, parsing and
+validating group.yml, and for cold caches: the git repositories queried
+(gitquery), analyzed shell fragments (shellfrag) and so on are all rebuilt
+by each command. `doozer serve` keeps one process, and those process wide
+caches, alive between commands. Yum repositories (repodata) can change
+under a long running process, so each command checks their repomd.xml
+again, as a fresh doozer would; unchanged ones are reopened from the
+on-disk store. The git repositories of a command's working directory are
+closed and forgotten when the command finishes.
+
+A client (see doozerc.py) connects and sends a single JSON line:
+
+  {"argv": ["--group", "openshift-3.11", "images:list"], "cwd": "/home/me", "env": {...}}
+
+The command line is run as if doozer had been started with it, in the
+client's directory and environment. Its output is sent back as JSON lines
+({"stdout": "..."} or {"stderr": "..."}), followed by {"exit": <code>}.
+
+Commands are run one at a time, each in a fresh thread (so per-thread state
+such as pushd.Dir starts from the request's cwd) and with its own Runtime,
+working directory and record log unless --working-dir is given.
+"""
+
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import traceback
+
+import click
+
+import repodata
+from runtime import Runtime
+
+DEFAULT_SOCKET = os.path.expanduser("~/.doozer.sock")
+
+
+class ClientStream(object):
+    """
+    A file-like object which forwards writes to a client as JSON lines.
+    """
+
+    def __init__(self, conn, name, lock):
+        self.conn = conn
+        self.name = name
+        self.lock = lock
+        self.closed = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.decode("utf-8", "replace")
+        if not data:
+            return
+        line = json.dumps({self.name: data}) + "\n"
+        with self.lock:
+            try:
+                self.conn.sendall(line)
+            except socket.error:
+                # The client went away; keep running the command to completion
+                self.closed = True
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def run_command(cli, argv, out, err):
+    """
+    Runs a doozer command line to completion.
+    :param cli: The doozer click group
+    :param argv: The command line arguments (without the program name)
+    :param out: File-like object to use as stdout
+    :param err: File-like object to use as stderr
+    :return: The exit code of the command
+    """
+    result = {"exit": 1}
+
+    def run():
+        ctx = None
+        try:
+            ctx = cli.make_context("doozer", list(argv), obj={})
+            with ctx:
+                cli.invoke(ctx)
+            result["exit"] = 0
+        except SystemExit as e:
+            # Commands exit() with the number of failures
+            if e.code is None or isinstance(e.code, int):
+                result["exit"] = e.code or 0
+            else:
+                click.echo(e.code, err=True)
+        except click.exceptions.Exit as e:
+            result["exit"] = e.exit_code
+        except click.ClickException as e:
+            e.show()
+            result["exit"] = e.exit_code
+        except click.Abort:
+            click.echo("Aborted!", err=True)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            runtime = ctx.obj if ctx is not None else None
+            if isinstance(runtime, Runtime):
+                runtime.finish()
+
+    # Repositories may have been updated since the last command
+    repodata.forget()
+
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        thread = threading.Thread(target=run, name="doozer-request")
+        thread.start()
+        thread.join()
+    finally:
+        sys.stdout, sys.stderr = saved
+    return result["exit"]
+
+
+def handle(cli, conn, default_args):
+    """
+    Reads one request from a client connection and runs it.
+    """
+    request = json.loads(conn.makefile("rb").readline())
+    argv = [str(a) for a in request["argv"]]
+    lock = threading.Lock()
+
+    if "serve" in argv:
+        ClientStream(conn, "stderr", lock).write("doozer serve cannot be run by the service\n")
+        conn.sendall(json.dumps({"exit": 2}) + "\n")
+        return
+
+    saved_cwd, saved_env = os.getcwd(), dict(os.environ)
+    try:
+        os.chdir(request.get("cwd", saved_cwd))
+        if "env" in request:
+            os.environ.clear()
+            os.environ.update(request["env"])
+        click.echo("Running: {}".format(" ".join(argv)), err=True)
+        rc = run_command(cli, default_args + argv,
+                         ClientStream(conn, "stdout", lock), ClientStream(conn, "stderr", lock))
+    finally:
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_env)
+
+    click.echo("Finished with exit code {}: {}".format(rc, " ".join(argv)), err=True)
+    try:
+        conn.sendall(json.dumps({"exit": rc}) + "\n")
+    except socket.error:
+        pass
+
+
+def serve(cli, socket_path, default_args=()):
+    """
+    Accepts and runs commands, one at a time, until interrupted.
+    :param cli: The doozer click group
+    :param socket_path: The Unix socket to listen on (only the current user may connect)
+    :param default_args: Arguments placed before each command line (e.g. a shared --cache-dir);
+                         options the client gives override them
+    """
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    server.listen(8)
+    # Remove the socket when stopped with kill
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    click.echo("Serving doozer commands on {}".format(socket_path), err=True)
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                handle(cli, conn, list(default_args))
+            except Exception:
+                click.echo("Error handling request: {}".format(traceback.format_exc()), err=True)
+            finally:
+                conn.close()
+    finally:
+        server.close()
+        os.remove(socket_path)
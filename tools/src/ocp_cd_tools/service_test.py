@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Test running commands in the doozer service
+"""
+
+import unittest
+
+import io
+import shutil
+import subprocess
+import tempfile
+
+import click
+
+import gitquery
+import repodata
+import service
+from runtime import Runtime
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("hello")
+@click.argument("name")
+def hello(name):
+    click.echo("hello {}".format(name))
+    click.echo("done", err=True)
+
+
+@cli.command("fail")
+def fail():
+    click.echo("failing")
+    exit(3)
+
+
+@cli.command("crash")
+def crash():
+    raise ValueError("crashed")
+
+
+@click.group()
+@click.option("--working-dir")
+@click.pass_context
+def doozer(ctx, working_dir):
+    ctx.obj = Runtime(working_dir=working_dir, latest_parent_version=False)
+
+
+# cat-file processes started by the query command
+cat_files = []
+
+
+@doozer.command("query")
+@click.pass_obj
+def query(runtime):
+    repo = gitquery.get_repo(runtime.working_dir)
+    click.echo(repo.author_email(repo.head_sha()))
+    cat_files.append(repo._cat_file)
+
+
+class Output(io.BytesIO):
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode("utf-8")
+        return io.BytesIO.write(self, data)
+
+
+class ServiceTestCase(unittest.TestCase):
+
+    def run_command(self, *argv):
+        out, err = Output(), Output()
+        rc = service.run_command(cli, argv, out, err)
+        return rc, out.getvalue(), err.getvalue()
+
+    def test_run_command(self):
+        self.assertEqual(self.run_command("hello", "world"), (0, "hello world\n", "done\n"))
+
+        rc, out, err = self.run_command("fail")
+        self.assertEqual((rc, out), (3, "failing\n"))
+
+        rc, out, err = self.run_command("crash")
+        self.assertEqual(rc, 1)
+        self.assertIn("ValueError: crashed", err)
+
+        rc, out, err = self.run_command("hello")
+        self.assertEqual(rc, 2)
+        self.assertIn("Missing argument", err)
+
+        rc, out, err = self.run_command("--help")
+        self.assertEqual(rc, 0)
+        self.assertIn("Usage:", out)
+
+    def test_git_repos_closed(self):
+        working_dir = tempfile.mkdtemp(prefix="ocp-cd-test-service")
+        self.addCleanup(shutil.rmtree, working_dir)
+        subprocess.check_output(["git", "init", "-q", working_dir])
+        subprocess.check_output(["git", "-c", "user.name=x", "-c", "user.email=x@redhat.com",
+                                 "commit", "-q", "--allow-empty", "-m", "init"], cwd=working_dir)
+
+        out, err = Output(), Output()
+        rc = service.run_command(doozer, ["--working-dir", working_dir, "query"], out, err)
+        self.assertEqual((rc, out.getvalue()), (0, "x@redhat.com\n"))
+        # The command's repositories are neither kept nor left with a git process running
+        self.assertFalse([r for r in gitquery._repos.values() if r.worktree.startswith(working_dir)])
+        self.assertIsNotNone(cat_files[0].poll())
+
+    def test_repodata_rechecked(self):
+        repodata._repos[("http://example.com/repo", None)] = object()
+        self.run_command("hello", "world")
+        self.assertEqual(repodata._repos, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+Analysis of the shell fragments found in Dockerfile RUN instructions.
+
+bashlex is a complete bash parser written in pure Python, which makes it
+slow, and the same fragments (yum install preambles, cleanup commands...)
+appear in the RUN instructions of hundreds of images. The functions in
+this module tokenize fragments made of plain words with str.split and only
+hand anything involving quoting, expansion or control operators to
+bashlex, which is only imported then. Results are memoized by fragment
+content for the life of the process, so each unique fragment is analyzed
+once per run.
+"""
+
+import re
+from multiprocessing import Lock
+
+# Fragments made only of these characters contain no quoting, expansion,
+# redirection, comments or control operators, so splitting on whitespace
+# yields exactly the words bash would.
+_SIMPLE_FRAGMENT = re.compile(r'^[\w \t./:=+,@%-]*$')
+_ASSIGNMENT_WORD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*\+?=')
+
+_lock = Lock()
+_split_cache = {}
+_assignment_cache = {}
+
+
+def _memoized(cache, fragment, compute_f):
+    with _lock:
+        if fragment in cache:
+            return cache[fragment]
+    # Compute outside of the lock; at worst two threads analyze the same fragment.
+    result = compute_f(fragment)
+    with _lock:
+        cache[fragment] = result
+    return result
+
+
+def _split(fragment):
+    if _SIMPLE_FRAGMENT.match(fragment):
+        return tuple(fragment.split())
+    import bashlex
+    return tuple(bashlex.split(fragment))
+
+
+def _assignment(fragment):
+    if _SIMPLE_FRAGMENT.match(fragment):
+        # A simple fragment is a single simple command; only its leading words can be assignments.
+        words = fragment.split()
+        if words and _ASSIGNMENT_WORD.match(words[0]):
+            return tuple(words[0].split('='))
+        return None
+
+    import bashlex
+    try:
+        parts = bashlex.parse(fragment)
+    except:
+        # bashlex does not get along well with some inline
+        # conditionals and may emit ParsingError
+        # if that's the case, it's not an assigment, so move along
+        return None
+    for ast in parts:
+        if ast.kind != 'compound':  # ignore multi part commands
+            for part in ast.parts:
+                if part.kind == 'assignment':
+                    return tuple(part.word.split('='))
+    return None
+
+
+def split(fragment):
+    """
+    Splits a shell fragment into words, like bashlex.split.
+    :return: A new list of words.
+    """
+    return list(_memoized(_split_cache, fragment, _split))
+
+
+def assignment(fragment):
+    """
+    Determines whether a shell fragment is a command that starts with a
+    variable assignment (e.g. "VERSION=1.0" or "A=b make").
+    :return: The assignment word split on '=' (e.g. ('VERSION', '1.0')) or None.
+    """
+    return _memoized(_assignment_cache, fragment, _assignment)
+
+
+def clear_cache():
+    with _lock:
+        _split_cache.clear()
+        _assignment_cache.clear()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Test the analysis of Dockerfile RUN shell fragments
+"""
+
+import unittest
+
+import bashlex
+import mock
+
+import shellfrag
+
+
+class ShellFragTestCase(unittest.TestCase):
+
+    def setUp(self):
+        shellfrag.clear_cache()
+
+    def test_split(self):
+        """
+        Simple and complex fragments split into the same words bashlex produces
+        """
+        for fragment in [
+            "yum install -y openssh-clients tar",
+            "  yum clean all ",
+            "yum --enablerepo=rhel-7-server-rpms install -y foo-1.2",
+            "",
+            'yum install -y "python-devel" \'tar\'',
+            "yum install -y $PKGS",
+            "ls ~/x # comment",
+        ]:
+            self.assertEqual(shellfrag.split(fragment), list(bashlex.split(fragment)), fragment)
+
+    def test_assignment(self):
+        self.assertEqual(shellfrag.assignment("VERSION=1.0"), ("VERSION", "1.0"))
+        self.assertEqual(shellfrag.assignment("A=b make install"), ("A", "b"))
+        self.assertEqual(shellfrag.assignment('A="b c" make'), ("A", "b c"))
+        self.assertIsNone(shellfrag.assignment("make A=b"))
+        self.assertIsNone(shellfrag.assignment("yum install -y tar"))
+        self.assertIsNone(shellfrag.assignment("if [ -f x ]; then"))
+
+    def test_memoized(self):
+        """
+        Each unique fragment is only handed to bashlex once
+        """
+        fragment = 'yum install -y "tar"'
+        with mock.patch.object(bashlex, "split", side_effect=bashlex.split) as split:
+            for _ in range(10):
+                words = shellfrag.split(fragment)
+                words.remove("yum")  # callers get their own copy
+            shellfrag.split("yum install -y tar")
+
+        self.assertEqual(split.call_count, 1)
+        self.assertEqual(shellfrag.split(fragment), ["yum", "install", "-y", "tar"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Partial and sparse clones of group sources backed by a persistent mirror.
+
+A full `git clone` of a large source alias (e.g. ose) downloads its entire
+history and every blob ever committed to it, then checks out the whole tree,
+even though most images only use a subdirectory. Instead, each source URL
+gets a bare mirror under the runtime's cache directory which survives across
+runs and is only brought up to date with an incremental fetch. Working
+clones are then made with --reference to the mirror, fetching a single
+branch without blobs, and can optionally check out only the directories the
+group's images use (a cone-mode sparse checkout).
+"""
+
+import fcntl
+import os
+import re
+import time
+
+import exectools
+import logutil
+from pushd import Dir
+
+logger = logutil.getLogger(__name__)
+
+
+def mirror_path(cache_dir, url):
+    """
+    :return: The directory of the mirror for url under cache_dir
+    """
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.split("://", 1)[-1]).strip("_")
+    if not name.endswith(".git"):
+        name += ".git"
+    return os.path.join(cache_dir, "source-mirrors", name)
+
+
+def update_mirror(mirror, url):
+    """
+    Creates the mirror of url or fetches what is new since it was last updated.
+    Another doozer process on the same host may be updating the same mirror, so
+    this holds an exclusive lock on it while working.
+    """
+    parent = os.path.dirname(mirror)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    with open(mirror + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        start = time.time()
+        if os.path.isdir(mirror):
+            logger.info("Fetching into source mirror: {}".format(mirror))
+            exectools.cmd_assert(["git", "--git-dir", mirror, "fetch", "--prune", "origin"], retries=3)
+        else:
+            logger.info("Creating source mirror of {}: {}".format(url, mirror))
+            exectools.cmd_assert(
+                cmd=["git", "clone", "--mirror", url, mirror],
+                retries=3,
+                on_retry=["rm", "-rf", mirror],
+            )
+            # Working clones borrow objects from the mirror; never let gc prune them away
+            exectools.cmd_assert(["git", "--git-dir", mirror, "config", "gc.auto", "0"])
+        logger.info("Source mirror {} up to date in {:.1f}s".format(mirror, time.time() - start))
+
+
+def branch_exists(mirror, branch):
+    rc, _, _ = exectools.cmd_gather(
+        ["git", "--git-dir", mirror, "rev-parse", "--verify", "-q", "refs/heads/{}".format(branch)])
+    return rc == 0
+
+
+def clone(url, mirror, branch, dest, sparse_paths=None):
+    """
+    Clones a single branch of url without blobs, borrowing objects from mirror.
+    :param sparse_paths: If set, only these directories (and top level files) are checked out.
+    """
+    start = time.time()
+    exectools.cmd_assert(
+        cmd=["git", "clone", "--filter=blob:none", "--single-branch", "--branch", branch,
+             "--no-checkout", "--reference", mirror, url, dest],
+        retries=3,
+        on_retry=["rm", "-rf", dest],
+    )
+    with Dir(dest):
+        if sparse_paths:
+            logger.info("Sparse checkout of {} in {}: {}".format(url, dest, ", ".join(sparse_paths)))
+            exectools.cmd_assert(["git", "sparse-checkout", "set", "--cone"] + list(sparse_paths))
+        exectools.cmd_assert(["git", "checkout", branch], retries=3)
+    logger.info("Cloned {} branch {} into {} in {:.1f}s".format(url, branch, dest, time.time() - start))
+
+
+def add_sparse_paths(dest, paths):
+    """
+    Adds directories to the sparse checkout of a clone made with sparse_paths.
+    """
+    with Dir(dest):
+        exectools.cmd_assert(["git", "sparse-checkout", "add"] + list(paths), retries=3)
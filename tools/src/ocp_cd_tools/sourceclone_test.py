@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Test partial and sparse source clones against a local upstream repository
+"""
+
+import unittest
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+import sourceclone
+
+
+class SourceCloneTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-sourceclone")
+        self.upstream = os.path.join(self.test_dir, "upstream")
+        self.url = "file://" + self.upstream
+        self.cache_dir = os.path.join(self.test_dir, "cache")
+
+        os.makedirs(os.path.join(self.upstream, "images", "base"))
+        os.makedirs(os.path.join(self.upstream, "images", "cli"))
+        self.git(self.upstream, "init", "-q")
+        self.git(self.upstream, "config", "uploadpack.allowFilter", "true")
+        for rel in ["README", "images/base/Dockerfile", "images/cli/Dockerfile"]:
+            with open(os.path.join(self.upstream, rel), "w") as f:
+                f.write("{}\n".format(rel))
+        self.git(self.upstream, "add", ".")
+        self.git(self.upstream, "-c", "user.name=x", "-c", "user.email=x@redhat.com", "commit", "-q", "-m", "init")
+        self.git(self.upstream, "branch", "release-3.11")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def git(self, cwd, *args):
+        return subprocess.check_output(["git"] + list(args), cwd=cwd).strip()
+
+    def test_mirror_path(self):
+        self.assertEqual(sourceclone.mirror_path("/c", "git@github.com:openshift/ose.git"),
+                         "/c/source-mirrors/git_github.com_openshift_ose.git")
+        self.assertEqual(sourceclone.mirror_path("/c", "https://github.com/openshift/ose"),
+                         "/c/source-mirrors/github.com_openshift_ose.git")
+
+    def test_sparse_clone(self):
+        mirror = sourceclone.mirror_path(self.cache_dir, self.url)
+        sourceclone.update_mirror(mirror, self.url)
+        self.git(mirror, "config", "uploadpack.allowFilter", "true")
+        self.assertTrue(sourceclone.branch_exists(mirror, "release-3.11"))
+        self.assertFalse(sourceclone.branch_exists(mirror, "release-4.0"))
+
+        dest = os.path.join(self.test_dir, "ose")
+        sourceclone.clone(self.url, mirror, "release-3.11", dest, sparse_paths=["images/base"])
+        self.assertEqual(self.git(dest, "rev-parse", "--abbrev-ref", "HEAD"), "release-3.11")
+        self.assertTrue(os.path.isfile(os.path.join(dest, "README")))
+        self.assertTrue(os.path.isfile(os.path.join(dest, "images", "base", "Dockerfile")))
+        self.assertFalse(os.path.exists(os.path.join(dest, "images", "cli")))
+        self.assertEqual(self.git(dest, "branch", "-r"), "origin/release-3.11")
+
+        sourceclone.add_sparse_paths(dest, ["images/cli"])
+        self.assertTrue(os.path.isfile(os.path.join(dest, "images", "cli", "Dockerfile")))
+
+        # A second update only fetches what is new
+        self.git(self.upstream, "branch", "release-4.0")
+        sourceclone.update_mirror(mirror, self.url)
+        self.assertTrue(sourceclone.branch_exists(mirror, "release-4.0"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Test that the CLI starts quickly, without loading heavy dependencies
+"""
+
+import unittest
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+DOOZER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "doozer.py")
+
+# Modules only the subsystems which need them may import
+HEAVY_MODULES = ["koji", "koji_cli", "requests_kerberos", "dockerfile_parse", "bashlex", "pykwalify", "yaml"]
+
+# Seconds a cold `doozer.py --help` may take
+HELP_BUDGET = 2.0
+
+# Reports the top level modules loaded by importing doozer, and how long that took
+IMPORT_REPORT = """
+import json, sys, time
+sys.path.insert(0, {src!r})
+start = time.time()
+import doozer
+print(json.dumps({{"seconds": time.time() - start,
+                  "modules": sorted(set(m.split(".")[0] for m in sys.modules if sys.modules[m] is not None))}}))
+"""
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_heavy_modules_not_imported(self):
+        src = os.path.dirname(DOOZER)
+        out = subprocess.check_output([sys.executable, "-B", "-c", IMPORT_REPORT.format(src=src)], cwd=src)
+        report = json.loads(out.splitlines()[-1])
+        loaded = [m for m in HEAVY_MODULES if m in report["modules"]]
+        self.assertEqual(loaded, [], "Importing doozer loaded {} (took {:.2f}s)".format(loaded, report["seconds"]))
+
+    def test_help_latency(self):
+        start = time.time()
+        with open(os.devnull, "w") as devnull:
+            rc = subprocess.call([sys.executable, "-B", DOOZER, "--help"], stdout=devnull)
+        elapsed = time.time() - start
+        self.assertEqual(rc, 0)
+        self.assertLess(elapsed, HELP_BUDGET, "doozer.py --help took {:.2f}s, over the {}s budget".format(
+            elapsed, HELP_BUDGET))
+
+
+if __name__ == "__main__":
+    unittest.main()
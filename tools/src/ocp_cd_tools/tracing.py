@@ -0,0 +1,146 @@
+"""
+This module records a timeline of the work performed during a doozer run
+and exports it in the Chrome trace-event JSON format. The resulting file
+can be loaded into chrome://tracing or https://ui.perfetto.dev to see
+where the time of a run went (cloning, rebasing, waiting on brew, waiting
+on parent images, pushing...).
+
+Tracing is disabled by default and every function in this module is a
+cheap no-op until `enable()` has been called.
+
+Example:
+
+  tracing.enable()
+  with tracing.track("openshift-enterprise-base"):
+      with tracing.span("clone"):
+          ....
+  tracing.write("/tmp/trace.json")
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import Lock
+
+_lock = Lock()
+_tl = threading.local()
+
+_enabled = False
+_epoch = time.time()
+_events = []
+# Map of track name -> tid used in the trace
+_tracks = {}
+
+
+def enable():
+    """
+    Start recording spans. Timestamps in the trace are relative to the
+    moment tracing was enabled.
+    """
+    global _enabled, _epoch
+    with _lock:
+        _enabled = True
+        _epoch = time.time()
+        del _events[:]
+        _tracks.clear()
+
+
+def enabled():
+    return _enabled
+
+
+def _now_us():
+    return int((time.time() - _epoch) * 1000000)
+
+
+def _track_id(name):
+    """
+    Allocates (or looks up) a trace tid for a named track. Must be called
+    while holding _lock.
+    """
+    if name not in _tracks:
+        tid = len(_tracks) + 1
+        _tracks[name] = tid
+        _events.append({
+            "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid,
+            "args": {"name": name},
+        })
+    return _tracks[name]
+
+
+def _current_tid():
+    tid = getattr(_tl, "tid", None)
+    if tid is None:
+        with _lock:
+            tid = _track_id(threading.current_thread().name)
+        _tl.tid = tid
+    return tid
+
+
+@contextmanager
+def track(name):
+    """
+    Context manager which directs all spans recorded by the current thread
+    to the track with the given name (e.g. an image's distgit_key). The
+    previous track is restored on exit.
+    """
+    if not _enabled:
+        yield
+        return
+
+    with _lock:
+        tid = _track_id(name)
+    previous = getattr(_tl, "tid", None)
+    _tl.tid = tid
+    try:
+        yield
+    finally:
+        _tl.tid = previous
+
+
+@contextmanager
+def span(name, cat="doozer", **args):
+    """
+    Context manager which records a complete ("X") event covering the
+    execution of its body on the current track.
+    :param name: The name of the span (e.g. "clone", "watch")
+    :param cat: The category of the span
+    :param args: Additional key/values shown with the span in the viewer
+    """
+    if not _enabled:
+        yield
+        return
+
+    tid = _current_tid()
+    start = _now_us()
+    try:
+        yield
+    finally:
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": os.getpid(), "tid": tid,
+            "ts": start, "dur": _now_us() - start,
+        }
+        if args:
+            event["args"] = dict((k, str(v)) for k, v in args.iteritems())
+        with _lock:
+            _events.append(event)
+
+
+def get_events_copy():
+    """
+    :return: Returns a copy of the events recorded so far in a thread safe way.
+    """
+    with _lock:
+        return list(_events)
+
+
+def write(path):
+    """
+    Writes all recorded events to the given path as Chrome trace-event JSON.
+    """
+    if not _enabled:
+        return
+    with open(path, "w") as f:
+        json.dump({"traceEvents": get_events_copy(), "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+Test the Chrome trace-event recording
+"""
+
+import unittest
+
+import json
+import os
+import shutil
+import tempfile
+from multiprocessing.dummy import Pool
+
+import tracing
+
+
+class TracingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-trace")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        tracing._enabled = False
+
+    def test_disabled(self):
+        """
+        Spans recorded before tracing is enabled are ignored
+        """
+        tracing._enabled = False
+        with tracing.track("image"), tracing.span("clone"):
+            pass
+        path = os.path.join(self.test_dir, "trace.json")
+        tracing.write(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_spans_on_tracks(self):
+        """
+        Spans recorded on different threads land on the track of the
+        image being processed and are written as valid trace JSON
+        """
+        tracing.enable()
+
+        def work(name):
+            with tracing.track(name):
+                with tracing.span("clone", branch="b"):
+                    with tracing.span("rebase"):
+                        pass
+
+        pool = Pool(4)
+        pool.map(work, ["a", "b", "c", "d"])
+        pool.close()
+        pool.join()
+
+        path = os.path.join(self.test_dir, "trace.json")
+        tracing.write(path)
+        with open(path) as f:
+            events = json.load(f)["traceEvents"]
+
+        tracks = dict((e["tid"], e["args"]["name"]) for e in events if e["ph"] == "M")
+        self.assertEqual(sorted(tracks.values()), ["a", "b", "c", "d"])
+
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual(len(spans), 8)
+        for e in spans:
+            self.assertIn(e["tid"], tracks)
+            self.assertGreaterEqual(e["dur"], 0)
+        clones = [e for e in spans if e["name"] == "clone"]
+        self.assertEqual(clones[0]["args"], {"branch": "b"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+A persistent cache of images:verify results.
+
+Verifying an image starts a container and runs rpm queries and the slow
+`package-cleanup --orphans` in it. The outcome can only change if the image
+content, the checks being run, the yum repositories the checks consult, or
+the version expected of the image change. Results are stored keyed by all
+of those: the image ID (the digest of the image's config, which changes
+with any layer), the sorted check names, the sha256 of the repo file and
+the expected version. Images which have not changed since they were last
+verified are then answered without starting a container.
+
+Results of checks which could not run (errors querying the RPM database or
+the repositories) are not stored. Orphaned packages also depend on what the
+repositories contain, which the repo file does not capture, so results of
+check_orphans expire after REPO_CONTENT_TTL.
+"""
+
+import hashlib
+import json
+import os
+import time
+from multiprocessing import Lock
+
+import logutil
+
+logger = logutil.getLogger(__name__)
+
+CACHE_VERSION = 2
+
+# Seconds results depending on the content of the repositories are kept
+REPO_CONTENT_TTL = 24 * 60 * 60
+
+
+class VerifyCache(object):
+
+    def __init__(self, path, repo_file, refresh=False):
+        """
+        :param path: The JSON file in which results are persisted. It is loaded if it exists.
+        :param repo_file: The repo file installed in the containers being verified
+        :param refresh: If True, stored results are never returned, only replaced
+        """
+        self.path = path
+        self.refresh = refresh
+        self.lock = Lock()
+        self.dirty = False
+        with open(repo_file, "rb") as f:
+            self.repo_file_sha256 = hashlib.sha256(f.read()).hexdigest()
+        # Map of key -> verify_image() result (without the image and distgit fields)
+        self.results = {}
+
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == CACHE_VERSION:
+                    self.results = data.get("results", {})
+            except ValueError:
+                logger.warning("Ignoring unreadable verify cache: {}".format(path))
+
+    def key(self, image_id, checks, image_version):
+        """
+        :return: The cache key for verifying the image with the given checks
+        """
+        return hashlib.sha256("\n".join([
+            image_id, ",".join(sorted(checks)), self.repo_file_sha256, image_version,
+        ])).hexdigest()
+
+    def get(self, key):
+        """
+        :return: The stored result (failures and status) or None.
+        """
+        if self.refresh:
+            return None
+        with self.lock:
+            result = self.results.get(key)
+        if not result:
+            return None
+        result = dict(result)
+        expires = result.pop("expires", None)
+        if expires is not None and expires < time.time():
+            return None
+        return result
+
+    def put(self, key, result, ttl=None):
+        """
+        :param ttl: If given, the number of seconds the result may be returned by get()
+        """
+        entry = {"failures": result["failures"], "status": result["status"]}
+        if ttl is not None:
+            entry["expires"] = time.time() + ttl
+        with self.lock:
+            self.results[key] = entry
+            self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache back to its file if anything has changed.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            cache_dir = os.path.dirname(self.path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w") as f:
+                json.dump({"version": CACHE_VERSION, "results": self.results}, f, indent=2, sort_keys=True)
+            os.rename(tmp_path, self.path)
+            self.dirty = False
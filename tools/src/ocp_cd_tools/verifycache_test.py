@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Test the persistent cache of image verification results
+"""
+
+import unittest
+
+import os
+import shutil
+import tempfile
+
+from verifycache import VerifyCache
+
+
+class VerifyCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-verifycache")
+        self.path = os.path.join(self.test_dir, "cache", "verify-cache.json")
+        self.repo_file = os.path.join(self.test_dir, "verify.repo")
+        self.write_repo_file("[rhel-server]\nbaseurl=http://example.com/a\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_repo_file(self, content):
+        with open(self.repo_file, "w") as f:
+            f.write(content)
+
+    def test_key(self):
+        cache = VerifyCache(self.path, self.repo_file)
+        key = cache.key("sha256:1", ["check_sigs", "check_orphans"], "3.11.0")
+        self.assertEqual(key, cache.key("sha256:1", ["check_orphans", "check_sigs"], "3.11.0"))
+        self.assertNotEqual(key, cache.key("sha256:2", ["check_orphans", "check_sigs"], "3.11.0"))
+        self.assertNotEqual(key, cache.key("sha256:1", ["check_sigs"], "3.11.0"))
+        self.assertNotEqual(key, cache.key("sha256:1", ["check_orphans", "check_sigs"], "3.11.1"))
+
+        self.write_repo_file("[rhel-server]\nbaseurl=http://example.com/b\n")
+        self.assertNotEqual(key, VerifyCache(self.path, self.repo_file).key(
+            "sha256:1", ["check_orphans", "check_sigs"], "3.11.0"))
+
+    def test_persistence(self):
+        cache = VerifyCache(self.path, self.repo_file)
+        key = cache.key("sha256:1", ["check_sigs"], "3.11.0")
+        self.assertIsNone(cache.get(key))
+        failures = {"check_sigs": {"description": "unsigned", "items": ["foo-1.0-1"]}}
+        cache.put(key, {"image": "reg/ose:v3.11.0-1", "distgit": "ose", "status": "failed", "failures": failures})
+        cache.save()
+
+        cache = VerifyCache(self.path, self.repo_file)
+        self.assertEqual(cache.get(key), {"status": "failed", "failures": failures})
+        self.assertIsNone(VerifyCache(self.path, self.repo_file, refresh=True).get(key))
+
+    def test_ttl(self):
+        cache = VerifyCache(self.path, self.repo_file)
+        key = cache.key("sha256:1", ["check_orphans"], "3.11.0")
+        cache.put(key, {"status": "passed", "failures": {}}, ttl=60)
+        self.assertEqual(cache.get(key), {"status": "passed", "failures": {}})
+        cache.put(key, {"status": "passed", "failures": {}}, ttl=-1)
+        self.assertIsNone(cache.get(key))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+A queue of image builds shared by doozer processes through a directory.
+
+`images:build --queue-dir DIR` publishes the group's images, each with the
+group members it must wait for, and `doozer worker --queue-dir DIR`
+processes (on any host which can see DIR, e.g. over NFS) claim the images
+whose parents have been built, build and push them, and hand their records
+back to the coordinator.
+
+The queue is a single JSON document (queue.json) which is only read and
+replaced while holding a POSIX lock on queue.lock, so claiming a job is
+atomic across hosts. A claim is a lease: workers renew it while building,
+and a job whose lease expires (e.g. its worker was killed) is returned to
+the queue for another worker.
+"""
+
+import contextlib
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+FINISHED = (DONE, FAILED)
+
+# Seconds a worker's claim on a job lasts unless renewed
+LEASE = 10 * 60
+
+
+def worker_id():
+    """
+    :return: A name identifying this process among the queue's workers
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        self.state_path = os.path.join(queue_dir, "queue.json")
+        self.lock_path = os.path.join(queue_dir, "queue.lock")
+
+    @contextlib.contextmanager
+    def _locked(self, save=True):
+        """
+        Holds the queue's lock and yields its state. If save is True, changes
+        made to the state are saved when the block exits normally.
+        """
+        with open(self.lock_path, "a") as lock:
+            fcntl.lockf(lock, fcntl.LOCK_EX)
+            try:
+                state = {"params": None, "jobs": {}}
+                if os.path.isfile(self.state_path):
+                    with open(self.state_path) as f:
+                        state = json.load(f)
+                yield state
+                if not save:
+                    return
+                fd, tmp_path = tempfile.mkstemp(".tmp", "queue-", self.queue_dir)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(state, f, indent=2, sort_keys=True)
+                os.rename(tmp_path, self.state_path)
+            finally:
+                fcntl.lockf(lock, fcntl.LOCK_UN)
+
+    def publish(self, params, jobs):
+        """
+        Replaces the queue's content with a new set of jobs.
+        :param params: JSON serializable parameters workers need to run the jobs
+        :param jobs: A dict of job name => names of the jobs it depends on. Dependencies
+                     which are not jobs in the queue are ignored.
+        """
+        if not os.path.isdir(self.queue_dir):
+            os.makedirs(self.queue_dir)
+        with self._locked() as state:
+            state["params"] = params
+            state["jobs"] = {
+                name: {
+                    "deps": sorted(set(d for d in deps if d in jobs)),
+                    "state": PENDING,
+                    "worker": None,
+                    "expires": None,
+                    "message": None,
+                    "records": [],
+                }
+                for name, deps in jobs.iteritems()
+            }
+
+    def params(self):
+        """
+        :return: The parameters published with the jobs, or None if nothing has been published
+        """
+        if not os.path.isfile(self.lock_path):
+            return None
+        with self._locked(save=False) as state:
+            return state["params"]
+
+    def claim(self, worker, now=None):
+        """
+        Claims a job whose dependencies are done. Jobs depending on a failed
+        job are failed, and expired claims are returned to the queue.
+        :param worker: The name of the claiming worker
+        :return: The name of the claimed job or None if no job is ready
+        """
+        now = now if now is not None else time.time()
+        with self._locked() as state:
+            jobs = state["jobs"]
+            for job in jobs.itervalues():
+                if job["state"] == CLAIMED and job["expires"] < now:
+                    job.update(state=PENDING, worker=None, expires=None)
+
+            # Failures cascade through any depth of dependencies
+            cascaded = True
+            while cascaded:
+                cascaded = False
+                for name, job in jobs.iteritems():
+                    failed = [d for d in job["deps"] if jobs[d]["state"] == FAILED]
+                    if job["state"] == PENDING and failed:
+                        job.update(state=FAILED, message="Error building parent image(s): {}".format(
+                            ", ".join(failed)))
+                        cascaded = True
+
+            for name in sorted(jobs):
+                job = jobs[name]
+                if job["state"] == PENDING and all(jobs[d]["state"] == DONE for d in job["deps"]):
+                    job.update(state=CLAIMED, worker=worker, expires=now + LEASE)
+                    return name
+        return None
+
+    def renew(self, name, worker, now=None):
+        """
+        Extends a worker's claim on a job.
+        :return: False if the worker no longer holds the claim
+        """
+        now = now if now is not None else time.time()
+        with self._locked() as state:
+            job = state["jobs"][name]
+            if job["state"] != CLAIMED or job["worker"] != worker:
+                return False
+            job["expires"] = now + LEASE
+            return True
+
+    def finish(self, name, worker, success, records=(), message=None):
+        """
+        Records the outcome of a claimed job.
+        :param records: Lines of the worker's record.log written for the job
+        :return: False if the worker no longer held the claim (it expired and the job was claimed again)
+        """
+        with self._locked() as state:
+            job = state["jobs"][name]
+            if job["state"] != CLAIMED or job["worker"] != worker:
+                return False
+            job.update(state=DONE if success else FAILED, worker=worker, expires=None,
+                       message=message, records=list(records))
+            return True
+
+    def jobs(self):
+        """
+        :return: A dict of job name => job state (a dict with keys state, worker, message, records...)
+        """
+        with self._locked(save=False) as state:
+            return state["jobs"]
+
+    def finished(self):
+        """
+        :return: True when every job in the queue is done or failed
+        """
+        return all(job["state"] in FINISHED for job in self.jobs().itervalues())
+
+    @contextlib.contextmanager
+    def claimed(self, name, worker):
+        """
+        Renews the worker's claim on a job in the background for the duration of the block.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(LEASE / 3):
+                self.renew(name, worker)
+
+        thread = threading.Thread(target=renew, name="renew-{}".format(name))
+        thread.daemon = True
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
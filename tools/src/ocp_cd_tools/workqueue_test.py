@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Test the work queue shared by images:build and doozer workers
+"""
+
+import unittest
+
+import shutil
+import tempfile
+
+import workqueue
+from workqueue import WorkQueue
+
+# openshift-enterprise-base <- cli <- {hyperkube, node}; node also waits for pod
+JOBS = {
+    "openshift-enterprise-base": [],
+    "cli": ["openshift-enterprise-base", "rhel7"],
+    "hyperkube": ["cli"],
+    "pod": [],
+    "node": ["cli", "pod"],
+}
+
+
+class WorkQueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp(prefix="ocp-cd-test-workqueue")
+        self.queue = WorkQueue(self.test_dir + "/queue")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def claim_all(self, worker="w1"):
+        claimed = []
+        while True:
+            name = self.queue.claim(worker)
+            if name is None:
+                return claimed
+            claimed.append(name)
+
+    def test_publish(self):
+        self.assertIsNone(self.queue.params())
+        self.queue.publish({"group": "openshift-3.11"}, JOBS)
+        self.assertEqual(self.queue.params(), {"group": "openshift-3.11"})
+        jobs = self.queue.jobs()
+        # Dependencies outside the queue are not waited for
+        self.assertEqual(jobs["cli"]["deps"], ["openshift-enterprise-base"])
+        self.assertEqual(set(j["state"] for j in jobs.values()), {workqueue.PENDING})
+        self.assertFalse(self.queue.finished())
+
+    def test_claim_order(self):
+        self.queue.publish({}, JOBS)
+        self.assertEqual(self.claim_all(), ["openshift-enterprise-base", "pod"])
+
+        self.assertTrue(self.queue.finish("openshift-enterprise-base", "w1", True, ["build|status=0|"]))
+        self.assertEqual(self.claim_all("w2"), ["cli"])
+        self.assertEqual(self.queue.jobs()["cli"]["worker"], "w2")
+        self.assertEqual(self.queue.jobs()["openshift-enterprise-base"]["records"], ["build|status=0|"])
+
+        self.queue.finish("cli", "w2", True)
+        self.assertEqual(self.claim_all(), ["hyperkube"])
+        self.queue.finish("pod", "w1", True)
+        self.assertEqual(self.claim_all(), ["node"])
+        self.queue.finish("hyperkube", "w1", True)
+        self.queue.finish("node", "w1", True)
+        self.assertTrue(self.queue.finished())
+
+    def test_failure_cascades(self):
+        self.queue.publish({}, JOBS)
+        self.claim_all()
+        self.queue.finish("openshift-enterprise-base", "w1", False, message="brew failed")
+        self.queue.finish("pod", "w1", True)
+        self.assertEqual(self.claim_all(), [])
+
+        jobs = self.queue.jobs()
+        self.assertEqual(jobs["openshift-enterprise-base"]["message"], "brew failed")
+        for name in ["cli", "hyperkube", "node"]:
+            self.assertEqual(jobs[name]["state"], workqueue.FAILED)
+        self.assertIn("cli", jobs["node"]["message"])
+        self.assertTrue(self.queue.finished())
+
+    def test_lease(self):
+        self.queue.publish({}, {"pod": []})
+        self.assertEqual(self.queue.claim("w1", now=0), "pod")
+        self.assertIsNone(self.queue.claim("w2", now=workqueue.LEASE - 1))
+
+        self.assertTrue(self.queue.renew("pod", "w1", now=workqueue.LEASE - 1))
+        self.assertIsNone(self.queue.claim("w2", now=workqueue.LEASE + 1))
+
+        # w1 stopped renewing; its job goes to w2
+        self.assertEqual(self.queue.claim("w2", now=3 * workqueue.LEASE), "pod")
+        self.assertFalse(self.queue.renew("pod", "w1"))
+        self.assertFalse(self.queue.finish("pod", "w1", False))
+        self.assertTrue(self.queue.finish("pod", "w2", True))
+        self.assertEqual(self.queue.jobs()["pod"]["state"], workqueue.DONE)
+
+
+if __name__ == "__main__":
+    unittest.main()